@@ -0,0 +1,336 @@
+# -*- encoding: utf-8 -*-
+'''
+Micro-benchmarks for the hot paths of the daemon.
+Usage: python benchmark.py [name ...] (runs all benchmarks when no name is given)
+'''
+from __future__ import print_function, unicode_literals, division, absolute_import
+import os
+import sys
+import timeit
+import tempfile
+import tracemalloc
+import logging
+import warnings
+from collections import OrderedDict
+
+warnings.filterwarnings('ignore')
+logging.disable(logging.CRITICAL)
+
+import globals
+import enocean.utils
+from enocean.protocol.bitfield import Bitfield
+from enocean.protocol.constants import PACKET, RORG
+from enocean.protocol.eep import EEP, EnumField, StatusField
+from enocean.protocol.packet import Packet, RadioPacket
+
+BENCHMARKS = OrderedDict()
+
+# (description, data, optional, FUNC, TYPE, command) of typical telegrams
+TELEGRAMS = [
+    ('A5-09-04 CO2', [0xA5, 0x80, 0x3C, 0x64, 0x0A, 0x01, 0x02, 0x03, 0x04, 0x00], [0x03, 0xFF, 0xFF, 0xFF, 0xFF, 0x40, 0x00], 0x09, 0x04, None),
+    ('A5-04-01 T/H', [0xA5, 0x00, 0x7F, 0x96, 0x0A, 0x01, 0x02, 0x03, 0x05, 0x00], [0x03, 0xFF, 0xFF, 0xFF, 0xFF, 0x40, 0x00], 0x04, 0x01, None),
+    ('D1079-01-00 VMI', [0xD1, 0x07, 0x90, 0x02, 0x0C, 0x00, 0x10, 0x30, 0x14, 0x1A, 0x00, 0x01, 0x00, 0x01, 0x02, 0x03, 0x06, 0x00], [0x03, 0xFF, 0xFF, 0xFF, 0xFF, 0x40, 0x00], 0x01, 0x00, 0),
+]
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def measure(statement, number=2000):
+    ''' Best time of a few runs, in microseconds per call '''
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number * 1e6
+
+
+def report(name, reference, optimized, unit='us'):
+    print('  %-24s %10.2f %s %10.2f %s %8.1fx' % (name, reference, unit, optimized, unit, reference / optimized))
+
+
+def legacy_get_raw(bitarray, offset, size):
+    ''' Field extraction as done with list-of-bool bit arrays '''
+    return int(''.join(['1' if digit else '0' for digit in bitarray[offset:offset + size]]), 2)
+
+
+@benchmark
+def bitfield():
+    ''' Field extraction: list-of-bool bit arrays vs. integer bit field '''
+    print('%-26s %13s %13s %9s' % ('bitfield', 'bitarray', 'Bitfield', 'speedup'))
+    for description, data, optional, func, type, command in TELEGRAMS:
+        packet = RadioPacket(PACKET.RADIO, list(data), list(optional))
+        packet.select_eep(func, type, command=command)
+        fields = [(field.offset, field.size) for field in packet._profile.fields if not isinstance(field, StatusField)]
+        payload = data[1:-5]
+
+        def reference():
+            bitarray = enocean.utils.to_bitarray(payload, len(payload) * 8)
+            return [legacy_get_raw(bitarray, offset, size) for offset, size in fields]
+
+        def optimized():
+            bits = Bitfield.from_bytes(payload)
+            return [bits.get(offset, size) for offset, size in fields]
+
+        assert reference() == optimized()
+        report(description, measure(reference), measure(optimized))
+
+
+@benchmark
+def decode():
+    ''' Full decode of a telegram: RadioPacket creation and EEP parsing '''
+    print('%-26s %13s' % ('decode', 'per telegram'))
+    for description, data, optional, func, type, command in TELEGRAMS:
+        def run():
+            packet = RadioPacket(PACKET.RADIO, list(data), list(optional))
+            packet.parse_eep(func, type, command=command)
+        print('  %-24s %10.2f us' % (description, measure(run)))
+
+
+@benchmark
+def startup():
+    ''' EEP loading: parsing all the XML files vs. reading the compiled cache '''
+    print('%-26s %13s %13s %9s' % ('startup', 'XML', 'cache', 'speedup'))
+    cache_file = os.path.join(tempfile.mkdtemp(), 'eep.cache')
+    try:
+        # First load writes the cache
+        assert not EEP(cache_file=cache_file).from_cache
+        assert EEP(cache_file=cache_file).from_cache
+        report('EEP()', measure(lambda: EEP(), number=1) * 1e-3, measure(lambda: EEP(cache_file=cache_file), number=5) * 1e-3, unit='ms')
+    finally:
+        os.remove(cache_file)
+        os.rmdir(os.path.dirname(cache_file))
+
+
+@benchmark
+def find_profile():
+    ''' Data description lookup for the VMI commands 0-8: resolved each time vs. memoized '''
+    print('%-26s %13s %13s %9s' % ('find_profile', 'resolved', 'memoized', 'speedup'))
+    eep = Packet.eep
+    commands = list(range(9))
+
+    def reference():
+        return [eep._EEP__find_profile(0xD1079, 0x01, 0x00, None, command) for command in commands]
+
+    def optimized():
+        return [eep.find_profile(None, 0xD1079, 0x01, 0x00, None, command) for command in commands]
+
+    assert reference() == optimized()
+    report('D1079-01-00 VMI', measure(reference), measure(optimized))
+
+
+@benchmark
+def enum():
+    ''' Enum descriptions of every raw value: linear rangeitem scan vs. interval index '''
+    print('%-26s %13s %13s %9s' % ('enum', 'linear', 'indexed', 'speedup'))
+    profile = Packet.eep.load_profile(0xD1079, 0x01, 0x00)
+    seen = set()
+    for data in profile.datas:
+        for field in data.fields:
+            if not isinstance(field, EnumField) or not field.starts or field.shortcut in seen:
+                continue
+            seen.add(field.shortcut)
+            rangeitems = list(zip(field.starts, field.ends, field.descriptions))
+            raw_values = list(range(min(1 << field.size, 4096)))
+
+            def reference():
+                output = []
+                for raw_value in raw_values:
+                    if raw_value in field.items:
+                        output.append(field.items[raw_value])
+                        continue
+                    for start, end, description in rangeitems:
+                        if raw_value in range(start, end + 1):
+                            output.append(description)
+                            break
+                return output
+
+            def optimized():
+                output = []
+                for raw_value in raw_values:
+                    try:
+                        output.append(field.get_description(raw_value))
+                    except KeyError:
+                        pass
+                return output
+
+            assert reference() == optimized()
+            report('%s (%d bits)' % (field.shortcut, field.size), measure(reference, number=20), measure(optimized, number=20))
+
+
+@benchmark
+def codegen():
+    ''' EEP decoding of the payload: generic descriptor loop vs. generated function '''
+    from enocean.protocol.codegen import DecoderGenerator
+    print('%-26s %13s %13s %9s' % ('codegen', 'generic', 'generated', 'speedup'))
+    generator = DecoderGenerator()
+    for description, data, optional, func, type, command in TELEGRAMS:
+        packet = RadioPacket(PACKET.RADIO, list(data), list(optional))
+        packet.select_eep(func, type, command=command)
+        profile, bit_data, bit_status = packet._profile, packet._bit_data, packet._bit_status
+
+        def reference():
+            return profile.decode(bit_data, bit_status)
+
+        def optimized():
+            return generator.decode(profile, bit_data, bit_status)
+
+        assert reference() == optimized() and generator.decoders[profile] is not None
+        report(description, measure(reference), measure(optimized))
+
+
+@benchmark
+def batch():
+    ''' Decoding of 10000 captured telegrams: one RadioPacket each vs. columnar decoding '''
+    try:
+        from enocean.protocol.batch import decode_batch
+        import numpy
+    except ImportError:
+        print('batch: NumPy is not installed')
+        return
+    print('%-26s %13s %13s %9s' % ('batch (10000 telegrams)', 'packets', 'columns', 'speedup'))
+    for description, data, optional, func, type, command in TELEGRAMS:
+        rows = numpy.tile(numpy.array(data, dtype=numpy.uint8), (10000, 1))
+        # Vary the payload
+        rows[:, 2] = numpy.arange(10000) % 256
+        packet = RadioPacket(PACKET.RADIO, list(data), list(optional))
+        packet.select_eep(func, type, command=command)
+        profile = packet._profile
+
+        def reference():
+            output = []
+            for row in rows.tolist():
+                packet = RadioPacket(PACKET.RADIO, row, list(optional))
+                packet.parse_eep(func, type, command=command)
+                output.append(packet.parsed)
+            return output
+
+        def optimized():
+            return decode_batch(profile, rows)
+
+        report(description, measure(reference, number=1) * 1e-3, measure(optimized, number=1) * 1e-3, unit='ms')
+
+
+@benchmark
+def dispatch():
+    ''' Post-processing of a decoded telegram: if/elif chains vs. cached handler chain '''
+    from enocean.dispatch import HandlerRegistry
+    from enocean.devices import bs4p, msc
+    print('%-26s %13s %13s %9s' % ('dispatch', 'if/elif', 'registry', 'speedup'))
+    registry = HandlerRegistry()
+    registry.register_all(bs4p.HANDLERS, PACKET.RADIO, RORG.BS4)
+    registry.register_all(msc.HANDLERS, PACKET.RADIO, RORG.MSC)
+
+    def legacy(action, packet):
+        # Selection done for every telegram before the handler chains
+        if packet.rorg == RORG.BS4:
+            action = bs4p.parse_values(action, packet)
+            if enocean.utils.profile_from_action(action) in globals.NEEDS_RESPONSE:
+                action = bs4p.parse_response(action, packet)
+            if action['func'] == '06':
+                action = bs4p.parse_illumination(action, packet)
+            if action['func'] == '12' and action['type'] in ['10', '01', '00']:
+                action = bs4p.parse_meter(action, packet)
+            if action['func'] == '09' and action['type'].lower() in ['05', '0c']:
+                action = bs4p.parse_voc(action, packet)
+            if action['func'] == '11' and action['type'] == '02':
+                action = bs4p.parse_fan(action, packet)
+        if packet.rorg == RORG.MSC:
+            action = msc.parse_values(action, packet)
+            if str(action['rorg']) == 'd1079':
+                action = msc.parse_ventilairsec(action, packet)
+        return action
+
+    for description, data, optional, func, type, command in TELEGRAMS[:2]:
+        packet = RadioPacket(PACKET.RADIO, list(data), list(optional))
+        packet.parse_eep(func, type, command=command)
+        action = {'rorg': 'a5', 'func': '%02x' % func, 'type': '%02x' % type}
+
+        def reference():
+            return legacy(dict(action), packet)
+
+        def optimized():
+            return registry.dispatch(dict(action), packet)
+
+        assert reference() == optimized()
+        report(description, measure(reference, number=20000), measure(optimized, number=20000))
+
+
+# (description, RORG, FUNC, TYPE, direction, command, values) of typical commands
+COMMANDS = [
+    ('A5-20-01 valve', 0xA5, 0x20, 0x01, 2, None, {'SP': 50}),
+    ('A5-38-08 dimmer', 0xA5, 0x38, 0x08, None, 2, {'EDIM': 50, 'RMP': 1, 'EDIMR': 0, 'STR': 0, 'SW': 1}),
+    ('D2-01-01 actuator', 0xD2, 0x01, 0x01, None, 1, {'DV': 0, 'IO': 1, 'OV': 100}),
+]
+
+
+def legacy_create(rorg, rorg_func, rorg_type, direction, command, values):
+    ''' Packet creation with a scratch packet, then a build and parse round trip '''
+    packet = Packet(PACKET.RADIO, data=[], optional=[])
+    packet.rorg = rorg
+    packet.data = [rorg]
+    packet.select_eep(rorg_func, rorg_type, direction, command)
+    if rorg == 0xA5:
+        payload = [0, 0, 0, 0]
+    else:
+        payload = [0] * int(packet._profile.get('bits', '1'))
+    packet.data = [rorg] + payload + [5, 6, 7, 8] + [0]
+    packet.optional = [3] + [1, 2, 3, 4] + [0xFF] + [0]
+    values = dict(values)
+    if command:
+        values['CMD'] = command
+    packet.set_eep(values)
+    data = packet.data
+    if rorg == 0xA5:
+        data[4] |= (1 << 3)
+    data[-1] = packet.status
+    packet.data = data
+    packet = Packet.parse_msg(packet.build())[2]
+    packet.rorg = rorg
+    packet.parse_eep(rorg_func, rorg_type, direction, command)
+    return packet
+
+
+@benchmark
+def create():
+    ''' Outgoing telegrams: build and parse round trip vs. direct encoding '''
+    print('%-26s %13s %13s %9s' % ('create', 'round trip', 'direct', 'speedup'))
+    for description, rorg, func, type, direction, command, values in COMMANDS:
+        def reference():
+            return legacy_create(rorg, func, type, direction, command, values)
+
+        def optimized():
+            return RadioPacket.create(rorg, func, type, direction=direction, command=command, destination=[1, 2, 3, 4], sender=[5, 6, 7, 8], **values)
+
+        assert reference().build() == optimized().build()
+        report(description, measure(reference), measure(optimized))
+
+
+def load_lazy(profiles):
+    eep = EEP(lazy=True)
+    for rorg, func, type in profiles:
+        assert eep.load_profile(rorg, func, type) is not None
+    return eep
+
+
+def allocated(func):
+    ''' Size in kB of the memory still allocated by the result of func '''
+    tracemalloc.start()
+    try:
+        result = func()
+        return tracemalloc.get_traced_memory()[0] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+@benchmark
+def lazy():
+    ''' EEP loading: all the profiles vs. the index and the profiles of a typical installation '''
+    profiles = [(0xD1079, 0x01, 0x00), (0xD1079, 0x00, 0x00), (0xA5, 0x09, 0x04), (0xA5, 0x04, 0x01)]
+    print('%-26s %13s %13s %9s' % ('lazy (%d profiles)' % len(profiles), 'eager', 'lazy', 'ratio'))
+    report('load time', measure(lambda: EEP(), number=1) * 1e-3, measure(lambda: load_lazy(profiles), number=1) * 1e-3, unit='ms')
+    report('allocated memory', allocated(lambda: EEP()), allocated(lambda: load_lazy(profiles)), unit='kB')
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS.keys():
+        BENCHMARKS[name]()
+        print()
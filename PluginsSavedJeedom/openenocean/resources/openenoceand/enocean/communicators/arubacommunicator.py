@@ -3,7 +3,7 @@ from __future__ import print_function, unicode_literals, division, absolute_impo
 import logging
 import socket
 import json
-import time
+import threading
 import binascii
 import globals
 
@@ -11,31 +11,37 @@ from enocean.communicators.communicator import Communicator
 
 
 class ArubaCommunicator(Communicator):
-    ''' Socket communicator class for EnOcean radio '''
+    '''
+    Socket communicator class for EnOcean radio
+    Packets go through Jeedom: their RESPONSE, if any, comes back later through the socket.
+    '''
+    WAITS_RESPONSE = False
 
     def __init__(self, host='127.0.0.1', port=9637):
-        super(ArubaCommunicator, self).__init__()
+        super(ArubaCommunicator, self).__init__(retries=0)
         self.host = host
         self.port = port
 
+    def _write_packet(self, packet):
+        try:
+            globals.JEEDOM_COM.send_change_immediate({'arubaMessage' : binascii.hexlify(bytearray(packet.build())).decode('ascii')});
+            return True
+        except Exception as e:
+            logging.error('Aruba communication exception! ' + str(e))
+            self.stop()
+            return False
+
     def run(self):
         logging.info('Aruba Communicator started')
+        writer = threading.Thread(target=self._transmit_loop, name='ArubaCommunicatorWriter')
+        writer.daemon = True
+        writer.start()
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.bind((self.host, self.port))
         sock.listen(5)
         sock.settimeout(0.5)
         try:
             while not self._stop_flag.is_set():
-                while True:
-                    packet = self._get_from_send_queue()
-                    if not packet:
-                        break
-                    try:
-                        time.sleep(0.02)
-                        globals.JEEDOM_COM.send_change_immediate({'arubaMessage' : binascii.hexlify(bytearray(packet.build())).decode('ascii')});
-                    except Exception as e:
-                        logging.error('Aruba communication exception! ' + str(e))
-                        self.stop()
                 try:
                     (client, addr) = sock.accept()
                 except socket.timeout:
@@ -50,7 +56,7 @@ class ArubaCommunicator(Communicator):
                     if not data:
                         break
                     logging.debug('Received Aruba Data ' + str(data))
-                    self._buffer.extend(bytearray.fromhex(json.loads(data)['payload']))
+                    self._buffer.write(bytearray.fromhex(json.loads(data)['payload']))
                 self.parse()
                 client.close()
                 logging.debug('Client disconnected')
@@ -3,29 +3,79 @@ from __future__ import print_function, unicode_literals, division, absolute_impo
 import logging
 import globals
 import time
+import heapq
+import itertools
 import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 try:
     import Queue as queue
 except ImportError:
     import queue
 from enocean.protocol.packet import Packet
-from enocean.protocol.constants import PACKET, PARSE_RESULT, RETURN_CODE
+from enocean.communicators.ringbuffer import RingBuffer
+from enocean.communicators.dutycycle import DutyCycle
+from enocean.protocol.constants import PACKET, PARSE_RESULT, RETURN_CODE, TX_PRIORITY
+
+
+class Transmission(Future):
+    '''
+    Frame queued for transmission.
+    Resolved with the RESPONSE packet of the module, or None if it didn't answer.
+    '''
+
+    def __init__(self, packet, retries=0, priority=TX_PRIORITY.INTERACTIVE):
+        super(Transmission, self).__init__()
+        self.packet = packet
+        self.retries = retries
+        self.priority = priority
+        self.attempts = 0
+        self.queued = time.time()
+        # Order in its priority class, and time from which the frame was held back by the duty cycle
+        self.sequence = None
+        self.paced_since = None
+
+    @property
+    def command(self):
+        ''' Name of the frame for the statistics: packet type, and first byte of data '''
+        try:
+            name = PACKET(self.packet.packet_type).name
+        except ValueError:
+            name = str(self.packet.packet_type)
+        if self.packet.data:
+            name += ' %02X' % self.packet.data[0]
+        return name
 
 
 class Communicator(threading.Thread):
     '''
     Communicator base-class for EnOcean.
     Not to be used directly, only serves as base class for SerialCommunicator etc.
+    Frames are written one at a time by _transmit_loop: the next one is written as soon as
+    the module answered the previous one, which is written again on error or timeout.
+    The next frame is the oldest of the highest priority class (TX_PRIORITY),
+    radio telegrams are paced to stay within the duty cycle of the module:
+    a held back frame is set aside until its time, and the queue is served meanwhile.
+    Communicators which don't get a RESPONSE right after each frame set WAITS_RESPONSE to False:
+    their frames are resolved with None once written, and a late RESPONSE goes to the last frame written.
     '''
+    # The module answers each frame with a RESPONSE, before the next frame is written
+    WAITS_RESPONSE = True
+    # Return codes worth writing the frame again
+    RETRY_CODES = (RETURN_CODE.ERROR, RETURN_CODE.RET_LOCK_SET, RETURN_CODE.RET_NO_FREE_BUFFER)
+    # Return codes of a module over its duty cycle
+    REJECT_CODES = (RETURN_CODE.OPERATION_DENIED, RETURN_CODE.RET_NO_FREE_BUFFER)
 
-    def __init__(self, callback=None, teach_in=True):
+    def __init__(self, callback=None, teach_in=True, buffer_size=4096, retries=None):
         super(Communicator, self).__init__()
         # Create an event to stop the thread
         self._stop_flag = threading.Event()
         # Input buffer
-        self._buffer = []
-        # Setup packet queues
-        self.transmit = queue.Queue()
+        self._buffer = RingBuffer(buffer_size)
+        # Setup packet queues, transmit holds (priority, sequence, transmission)
+        self.transmit = queue.PriorityQueue()
+        self._tx_sequence = itertools.count()
+        # Frames held back by the duty cycle, (not before, sequence, transmission), only used by _transmit_loop
+        self._paced = []
         self.receive = queue.Queue()
         # Set the callback method
         self.__callback = callback
@@ -34,57 +84,209 @@ class Communicator(threading.Thread):
         # Should new messages be learned automatically? Defaults to True.
         # TODO: Not sure if we should use CO_WR_LEARNMODE??
         self.teach_in = teach_in
+        # Writes of a frame after the first one, when it is not answered OK
+        self.retries = globals.TX_RETRIES if retries is None else retries
+        # Airtime used by the transmitted telegrams
+        self.duty_cycle = None
+        if globals.DUTY_CYCLE:
+            self.duty_cycle = DutyCycle(globals.DUTY_CYCLE, globals.DUTY_CYCLE_WINDOW, globals.DUTY_CYCLE_MAX_WAIT, globals.DUTY_CYCLE_BACKOFF)
+        # Frame waiting for its RESPONSE, and that response
+        self._in_flight = None
+        # Last frame written without waiting for its RESPONSE, and when the Base ID was last asked for
+        self._written = None
+        self._base_id_asked = 0
+        self._response = None
+        self._response_event = threading.Event()
+        # Transmit statistics, per command and per priority class
+        self._tx_stats = {}
+        self._tx_lock = threading.Lock()
+        self._priority_stats = dict((priority, {'depth': 0, 'sent': 0, 'wait_total': 0.0, 'wait_max': 0.0}) for priority in TX_PRIORITY)
 
-    def _get_from_send_queue(self):
-        ''' Get message from send queue, if one exists '''
+    def _get_from_send_queue(self, timeout=None):
+        ''' Get transmission from send queue, if one exists (waiting up to timeout seconds, if given) '''
         try:
-            packet = self.transmit.get(block=False)
+            priority, sequence, transmission = self.transmit.get(block=timeout is not None, timeout=timeout)
+            if transmission.paced_since is None:
+                wait = time.time() - transmission.queued
+                with self._tx_lock:
+                    stats = self._priority_stats[priority]
+                    stats['depth'] -= 1
+                    stats['sent'] += 1
+                    stats['wait_total'] += wait
+                    stats['wait_max'] = max(stats['wait_max'], wait)
             logging.info('Sending packet')
-            logging.debug(packet)
-            return packet
+            logging.debug(transmission.packet)
+            return transmission
         except queue.Empty:
             pass
         return None
 
-    def send(self, packet):
+    def send(self, packet, retries=None, priority=TX_PRIORITY.INTERACTIVE):
+        '''
+        Queue packet for transmission, after the frames of a higher priority.
+        Returns a Transmission, which result is the RESPONSE packet of the module.
+        '''
         if not isinstance(packet, Packet):
             logging.error('Object to send must be an instance of Packet')
             return False
-        timeout = time.time() + 0.5
-        while globals.WAITING_RES:
-            if time.time()>timeout:
-                logging.debug('No Response continue')
+        priority = TX_PRIORITY(priority)
+        transmission = Transmission(packet, self.retries if retries is None else retries, priority)
+        transmission.sequence = next(self._tx_sequence)
+        with self._tx_lock:
+            self._priority_stats[priority]['depth'] += 1
+        self.transmit.put((priority, transmission.sequence, transmission))
+        return transmission
+
+    def _write_packet(self, packet):
+        ''' Write packet to the module, returns False if it failed. Implemented by SerialCommunicator etc. '''
+        logging.error('Cannot write ' + str(packet) + ', ' + self.__class__.__name__ + ' has no link to a module')
+        return False
+
+    def _transmit_loop(self):
+        ''' Transmit thread: writes the queued frames, one at a time '''
+        while not self._stop_flag.is_set():
+            # Held back frames go back in the queue once their time has come, in their original order
+            now = time.time()
+            while self._paced and self._paced[0][0] <= now:
+                not_before, sequence, transmission = heapq.heappop(self._paced)
+                self.transmit.put((transmission.priority, sequence, transmission))
+            timeout = min(0.5, self._paced[0][0] - now) if self._paced else 0.5
+            transmission = self._get_from_send_queue(timeout=timeout)
+            if transmission is None:
+                continue
+            if transmission.running() or transmission.set_running_or_notify_cancel():
+                self._transmit(transmission)
+        for not_before, sequence, transmission in self._paced:
+            transmission.set_result(None)
+        self._paced = []
+
+    def _pace(self, transmission, delay):
+        ''' Set transmission aside for delay seconds '''
+        now = time.time()
+        if transmission.paced_since is None:
+            transmission.paced_since = now
+        heapq.heappush(self._paced, (now + delay, transmission.sequence, transmission))
+
+    def _transmit(self, transmission):
+        '''
+        Write the frame of transmission until the module answers OK, or retries are exhausted.
+        A frame held back by the duty cycle is set aside, and written again from _transmit_loop.
+        '''
+        stats = self._tx_stats.setdefault(transmission.command, {'sent': 0, 'writes': 0, 'answered': 0, 'timeouts': 0, 'errors': 0, 'latency_total': 0.0, 'latency_max': 0.0})
+        response = None
+        while transmission.attempts <= transmission.retries and not self._stop_flag.is_set():
+            if self.duty_cycle is not None:
+                waited = time.time() - transmission.paced_since if transmission.paced_since is not None else 0
+                delay = self.duty_cycle.admit(transmission.packet, transmission.priority, waited)
+                if delay is None:
+                    break
+                if delay > 0:
+                    self._pace(transmission, delay)
+                    return
+            transmission.attempts += 1
+            stats['writes'] += 1
+            self._response_event.clear()
+            self._response = None
+            if self.WAITS_RESPONSE:
+                self._in_flight = transmission
+            else:
+                self._written = transmission
+            start = time.time()
+            if not self._write_packet(transmission.packet):
+                break
+            if not self.WAITS_RESPONSE:
+                if self.duty_cycle is not None:
+                    self.duty_cycle.record(transmission.packet)
                 break
-            logging.debug('Waiting Response')
-            time.sleep(0.05)
-        if globals.DEVICE == 'aruba':
-            self.transmit.put(packet)
-        else:
-            for x in range(0,3):
-                self.transmit.put(packet)
-        globals.WAITING_RES = True
-        return True
+            answered = self._response_event.wait(globals.TX_RESPONSE_TIMEOUT)
+            self._in_flight = None
+            rejected = False
+            if self.duty_cycle is not None:
+                rejected = answered and self._response.response in self.REJECT_CODES
+                if rejected:
+                    self.duty_cycle.reject()
+                else:
+                    self.duty_cycle.record(transmission.packet)
+            if not answered:
+                stats['timeouts'] += 1
+                logging.debug('No response to ' + transmission.command + ' (attempt ' + str(transmission.attempts) + ')')
+                continue
+            latency = time.time() - start
+            stats['answered'] += 1
+            stats['latency_total'] += latency
+            stats['latency_max'] = max(stats['latency_max'], latency)
+            response = self._response
+            # A refused response is too late once the module accepts frames again
+            if response.response not in self.RETRY_CODES or (rejected and transmission.priority == TX_PRIORITY.RESPONSE):
+                break
+            stats['errors'] += 1
+            logging.debug('Response ' + str(response.response) + ' to ' + transmission.command + ' (attempt ' + str(transmission.attempts) + ')')
+        self._in_flight = None
+        stats['sent'] += 1
+        transmission.set_result(response)
 
     def stop(self):
         self._stop_flag.set()
 
     def parse(self):
         ''' Parses messages and puts them to receive queue '''
+        # Scan the whole buffer, and move the read cursor only once at the end
+        offset = self._buffer.read_pos
         # Loop while we get new messages
         while True:
-            status, self._buffer, packet = Packet.parse_msg(self._buffer, communicator=self)
+            status, offset, packet = Packet.scan_msg(self._buffer.data, offset, self._buffer.write_pos, communicator=self)
             # If message is incomplete -> break the loop
             if status == PARSE_RESULT.INCOMPLETE:
+                self._buffer.consume(offset)
                 return status
 
             # If message is OK, add it to receive queue or send to the callback method
             if status == PARSE_RESULT.OK and packet:
+                if packet.packet_type == PACKET.RESPONSE:
+                    if self._in_flight is not None:
+                        self._response = packet
+                        self._response_event.set()
+                    elif self._written is not None:
+                        self._late_response(self._written, packet)
                 if self.__callback is None:
                     self.receive.put(packet)
                 else:
                     self.__callback(packet)
                 logging.debug(packet)
 
+    def _late_response(self, transmission, packet):
+        ''' RESPONSE packet received after transmission was resolved, keeps the Base ID it answers '''
+        if transmission.packet.packet_type != PACKET.COMMON_COMMAND or list(transmission.packet.data) != [0x08]:
+            return
+        if packet.response == RETURN_CODE.OK and len(packet.response_data) == 4:
+            self._base_id = packet.response_data
+
+    def stats(self):
+        ''' Statistics of the communicator, for debugging purposes '''
+        transmit = {}
+        for command, stats in list(self._tx_stats.items()):
+            transmit[command] = {
+                'sent': stats['sent'],
+                'writes': stats['writes'],
+                'timeouts': stats['timeouts'],
+                'errors': stats['errors'],
+                'latency_avg_ms': round(stats['latency_total'] * 1000 / stats['answered'], 1) if stats['answered'] else None,
+                'latency_max_ms': round(stats['latency_max'] * 1000, 1),
+            }
+        priorities = {}
+        with self._tx_lock:
+            for priority, stats in self._priority_stats.items():
+                priorities[priority.name] = {
+                    'depth': stats['depth'],
+                    'sent': stats['sent'],
+                    'wait_avg_ms': round(stats['wait_total'] * 1000 / stats['sent'], 1) if stats['sent'] else None,
+                    'wait_max_ms': round(stats['wait_max'] * 1000, 1),
+                }
+        output = {'buffer': self._buffer.stats(), 'queued': self.transmit.qsize(), 'paced': len(self._paced), 'priority': priorities, 'transmit': transmit}
+        if self.duty_cycle is not None:
+            output['duty_cycle'] = self.duty_cycle.stats()
+        return output
+
     @property
     def base_id(self):
         ''' Fetches Base ID from the transmitter, if required. Otherwise returns the currently set Base ID. '''
@@ -92,25 +294,23 @@ class Communicator(threading.Thread):
         if self._base_id is not None:
             return self._base_id
 
-        # Send COMMON_COMMAND 0x08, CO_RD_IDBASE request to the module
-        self.send(Packet(PACKET.COMMON_COMMAND, data=[0x08]))
-        # Loop over 10 times, to make sure we catch the response.
-        # Thanks to timeout, shouldn't take more than a second.
-        # Unfortunately, all other messages received during this time are ignored.
-        for i in range(0, 10):
-            try:
-                packet = self.receive.get(block=True, timeout=0.1)
-                # We're only interested in responses to the request in question.
-                if packet.packet_type == PACKET.RESPONSE and packet.response == RETURN_CODE.OK and len(packet.response_data) == 4:
-                    # Base ID is set in the response data.
-                    self._base_id = packet.response_data
-                    # Put packet back to the Queue, so the user can also react to it if required...
-                    self.receive.put(packet)
-                    break
-                # Put other packets back to the Queue.
-                self.receive.put(packet)
-            except queue.Empty:
-                continue
+        # Without a RESPONSE to wait for, ask at most once a second: parse keeps the Base ID when it arrives
+        if not self.WAITS_RESPONSE:
+            now = time.time()
+            if now - self._base_id_asked >= 1:
+                self._base_id_asked = now
+                self.send(Packet(PACKET.COMMON_COMMAND, data=[0x08]))
+            return self._base_id
+
+        # Send COMMON_COMMAND 0x08, CO_RD_IDBASE request to the module, and wait for its response
+        transmission = self.send(Packet(PACKET.COMMON_COMMAND, data=[0x08]))
+        try:
+            packet = transmission.result(timeout=(transmission.retries + 1) * globals.TX_RESPONSE_TIMEOUT + 1)
+        except FutureTimeoutError:
+            packet = None
+        # Base ID is set in the response data.
+        if packet is not None and packet.response == RETURN_CODE.OK and len(packet.response_data) == 4:
+            self._base_id = packet.response_data
         # Return the current Base ID (might be None).
         return self._base_id
 
@@ -0,0 +1,132 @@
+# -*- encoding: utf-8 -*-
+from __future__ import print_function, unicode_literals, division, absolute_import
+import logging
+import threading
+import time
+from collections import deque
+
+from enocean.protocol.constants import PACKET, TX_PRIORITY
+
+
+class DutyCycle(object):
+    '''
+    Airtime accounting of the transmitted radio telegrams, over a sliding window.
+    Each priority class may use a share of the budget (duty_cycle * window seconds):
+    above it, a frame is held back until older airtime leaves the window (up to max_wait seconds)
+    or, for background frames, is not sent at all. Responses are never held back.
+    When the module refuses a frame, background frames are not sent for backoff seconds,
+    and the other ones are held back up to max_wait seconds before being tried.
+    admit never blocks, holding back the frame is up to the caller.
+    '''
+    # Bit rate of the ERP1 radio, and bits on air per telegram byte (8/12 encoding)
+    BIT_RATE = 125000
+    BITS_PER_BYTE = 12
+    # Preamble, start and end of frame, and CRC byte
+    OVERHEAD_BITS = 40
+    # Each telegram is sent as 3 subtelegrams
+    SUBTELEGRAMS = 3
+    # Share of the budget each class may use
+    SHARES = {
+        TX_PRIORITY.RESPONSE: 1.0,
+        TX_PRIORITY.INTERACTIVE: 0.9,
+        TX_PRIORITY.BACKGROUND: 0.7,
+    }
+
+    def __init__(self, duty_cycle=0.01, window=3600, max_wait=10, backoff=30):
+        self.budget = duty_cycle * window
+        self.window = window
+        self.max_wait = max_wait
+        self.backoff = backoff
+        # (time, airtime) of the telegrams in the window, oldest first
+        self._sent = deque()
+        self._used = 0.0
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+        # Statistics
+        self.frames = 0
+        self.paced = 0
+        self.shed = dict((priority.name, 0) for priority in TX_PRIORITY)
+        self.rejected = 0
+
+    @classmethod
+    def airtime(cls, packet):
+        ''' Estimated seconds on air of packet, 0 for frames which are not sent by radio '''
+        if packet.packet_type != PACKET.RADIO:
+            return 0.0
+        return cls.SUBTELEGRAMS * (cls.OVERHEAD_BITS + cls.BITS_PER_BYTE * len(packet.data)) / cls.BIT_RATE
+
+    def _expire(self, now):
+        while self._sent and now - self._sent[0][0] >= self.window:
+            self._used -= self._sent.popleft()[1]
+        if not self._sent:
+            self._used = 0.0
+
+    def _delay(self, airtime, priority, now):
+        ''' Seconds before airtime fits in the share of priority, None if it never will '''
+        excess = self._used + airtime - self.budget * self.SHARES.get(priority, 1.0)
+        if excess <= 0:
+            return 0
+        for sent, sent_airtime in self._sent:
+            excess -= sent_airtime
+            if excess <= 0:
+                return sent + self.window - now
+        return None
+
+    def admit(self, packet, priority, waited=0):
+        '''
+        Seconds before packet can be sent (0 to send it now), None if it must be dropped.
+        waited is the time packet was already held back.
+        '''
+        airtime = self.airtime(packet)
+        if airtime == 0 or priority == TX_PRIORITY.RESPONSE:
+            return 0
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            delay = self._delay(airtime, priority, now)
+            blocked = max(0, self._blocked_until - now)
+        if delay == 0 and blocked == 0:
+            return 0
+        if delay is None or waited + delay > self.max_wait or priority == TX_PRIORITY.BACKGROUND:
+            logging.info('Duty cycle budget used, not sending ' + str(packet))
+            self.shed[TX_PRIORITY(priority).name] += 1
+            return None
+        delay = max(delay, min(blocked, self.max_wait - waited))
+        if delay <= 0:
+            return 0
+        logging.debug('Duty cycle budget used, holding back ' + str(round(delay, 2)) + ' seconds')
+        self.paced += 1
+        return delay
+
+    def record(self, packet):
+        ''' Account the airtime of packet, once written '''
+        airtime = self.airtime(packet)
+        if airtime == 0:
+            return
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            self._sent.append((now, airtime))
+            self._used += airtime
+            self.frames += 1
+
+    def reject(self):
+        ''' The module refused a frame, hold back the traffic for backoff seconds '''
+        logging.info('Transmit refused by the module, holding back traffic for ' + str(self.backoff) + ' seconds')
+        with self._lock:
+            self._blocked_until = time.time() + self.backoff
+            self.rejected += 1
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.time())
+            return {
+                'budget_s': round(self.budget, 3),
+                'used_s': round(self._used, 3),
+                'used_pct': round(self._used * 100 / self.budget, 1) if self.budget else None,
+                'frames': self.frames,
+                'paced': self.paced,
+                'shed': dict(self.shed),
+                'rejected': self.rejected,
+                'blocked': self._blocked_until > time.time(),
+            }
@@ -0,0 +1,80 @@
+# -*- encoding: utf-8 -*-
+from __future__ import print_function, unicode_literals, division, absolute_import
+import logging
+
+
+class RingBuffer(object):
+    '''
+    Fixed-capacity input buffer for the communicators.
+    Bytes are written at the write cursor and consumed from the read cursor.
+    Instead of wrapping around, unread bytes are moved back to the start of the storage
+    when the tail runs out of room, so the frame scanner always gets a contiguous region.
+    The storage is never reallocated: when more bytes arrive than there is room for,
+    the oldest unread bytes are dropped (a stuck partial frame can't keep it growing).
+    '''
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.data = bytearray(capacity)
+        self.read_pos = 0
+        self.write_pos = 0
+        # Statistics
+        self.high_water = 0
+        self.written = 0
+        self.dropped = 0
+        self.compactions = 0
+
+    def __len__(self):
+        return self.write_pos - self.read_pos
+
+    def _compact(self):
+        ''' Move unread bytes to the start of the storage '''
+        size = self.write_pos - self.read_pos
+        if self.read_pos == 0:
+            return
+        if size:
+            self.data[0:size] = self.data[self.read_pos:self.write_pos]
+            self.compactions += 1
+        self.read_pos = 0
+        self.write_pos = size
+
+    def write(self, chunk):
+        ''' Append bytes at the write cursor, dropping the oldest bytes if full '''
+        length = len(chunk)
+        if length == 0:
+            return
+        self.written += length
+        if length >= self.capacity:
+            # Only the most recent bytes can be kept
+            self.dropped += len(self) + length - self.capacity
+            chunk = chunk[length - self.capacity:]
+            length = self.capacity
+            self.read_pos = self.write_pos = 0
+        elif self.write_pos + length > self.capacity:
+            overflow = len(self) + length - self.capacity
+            if overflow > 0:
+                logging.debug('Input buffer full, dropping ' + str(overflow) + ' bytes')
+                self.dropped += overflow
+                self.read_pos += overflow
+            self._compact()
+        self.data[self.write_pos:self.write_pos + length] = chunk
+        self.write_pos += length
+        if len(self) > self.high_water:
+            self.high_water = len(self)
+
+    def consume(self, position):
+        ''' Move the read cursor up to position (as returned by the frame scanner) '''
+        self.read_pos = min(max(position, self.read_pos), self.write_pos)
+        if self.read_pos == self.write_pos:
+            # Empty, rewind the cursors for free
+            self.read_pos = self.write_pos = 0
+
+    def stats(self):
+        return {
+            'capacity': self.capacity,
+            'size': len(self),
+            'high_water': self.high_water,
+            'written': self.written,
+            'dropped': self.dropped,
+            'compactions': self.compactions,
+        }
@@ -2,43 +2,76 @@
 from __future__ import print_function, unicode_literals, division, absolute_import
 import logging
 import serial
-import time
+import threading
 
 from enocean.communicators.communicator import Communicator
 
 
 class SerialCommunicator(Communicator):
-    ''' Serial port communicator class for EnOcean radio '''
+    '''
+    Serial port communicator class for EnOcean radio
+    With bulk_read, reads block on the port and are sized from the bytes waiting.
+    Packets are written from a separate thread, so receiving never waits on transmits.
+    '''
     logger = logging.getLogger('enocean.communicators.SerialCommunicator')
 
-    def __init__(self, port='/dev/ttyAMA0', callback=None):
+    def __init__(self, port='/dev/ttyAMA0', callback=None, bulk_read=False):
         super(SerialCommunicator, self).__init__(callback)
-        # Initialize serial port
-        self.__ser = serial.Serial(port, 57600, timeout=0.1)
+        self.bulk_read = bulk_read
+        # Initialize serial port, without polling timeout in bulk mode
+        self.__ser = serial.Serial(port, 57600, timeout=None if bulk_read else 0.1)
+
+    def stop(self):
+        super(SerialCommunicator, self).stop()
+        if self.bulk_read:
+            # Wake up the blocking read
+            try:
+                self.__ser.cancel_read()
+            except (AttributeError, serial.SerialException):
+                pass
+
+    def _write_packet(self, packet):
+        try:
+            self.__ser.write(bytearray(packet.build()))
+            return True
+        except serial.SerialException:
+            logging.error('Serial port exception!')
+            self.stop()
+            return False
 
     def run(self):
         logging.info('SerialCommunicator started')
-        while not self._stop_flag.is_set():
-            # If there's messages in transmit queue
-            # send them
-            while True:
-                packet = self._get_from_send_queue()
-                if not packet:
-                    break
-                try:
-                    self.__ser.write(bytearray(packet.build()))
-                    time.sleep(0.02)
-                except serial.SerialException:
-                    logging.error('Serial port exception!')
-                    self.stop()
+        writer = threading.Thread(target=self._transmit_loop, name='SerialCommunicatorWriter')
+        writer.daemon = True
+        writer.start()
+        if self.bulk_read:
+            self._run_bulk()
+        else:
+            self._run_poll()
+        writer.join(1)
+        self.__ser.close()
+        logging.info('SerialCommunicator stopped')
 
+    def _run_poll(self):
+        while not self._stop_flag.is_set():
             # Read chars from serial port as hex numbers
             try:
-                self._buffer.extend(bytearray(self.__ser.read(16)))
+                self._buffer.write(self.__ser.read(16))
             except serial.SerialException:
                 logging.error('Serial port exception! (device disconnected or multiple access on port?)')
                 self.stop()
             self.parse()
 
-        self.__ser.close()
-        logging.info('SerialCommunicator stopped')
+    def _run_bulk(self):
+        while not self._stop_flag.is_set():
+            # Block until at least one byte is there, then take everything waiting
+            try:
+                chunk = self.__ser.read(self.__ser.in_waiting or 1)
+            except serial.SerialException:
+                logging.error('Serial port exception! (device disconnected or multiple access on port?)')
+                self.stop()
+                break
+            if not chunk:
+                continue
+            self._buffer.write(chunk)
+            self.parse()
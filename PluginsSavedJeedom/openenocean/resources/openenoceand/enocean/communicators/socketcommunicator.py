@@ -36,7 +36,7 @@ class SocketCommunicator(Communicator):
                 if not data:
                     break
                 logging.debug('Received Socket Data ' + str(data))
-                self._buffer.extend(bytearray.fromhex(data))
+                self._buffer.write(bytearray.fromhex(data))
             self.parse()
             client.close()
             logging.debug('Client disconnected')
@@ -35,7 +35,7 @@ class TCPCommunicator(Communicator):
                     break
                 if not data:
                     break
-                self._buffer.extend(bytearray(data))
+                self._buffer.write(data)
             self.parse()
             client.close()
             logging.debug('Client disconnected')
@@ -4,6 +4,7 @@ from enocean import utils
 import globals
 from enocean.protocol.packet import RadioPacket, UTETeachIn
 from enocean.protocol.constants import PACKET, RORG
+from enocean.devices.bs4p import learn_eep_bytes
 
 def parse(action,packet):
     logging.debug("Its a BS4 message")
@@ -57,20 +58,16 @@ def parse(action,packet):
     return action
 
 def response_learn_BS4VAR3(packet):
-    data = [165] + utils.from_bitarray_split(utils.bitarray_sizing(utils.to_bitarray(packet.rorg_func),6) + \
-            utils.bitarray_sizing(utils.to_bitarray(packet.rorg_type),7) +\
-            utils.bitarray_sizing(utils.to_bitarray(packet.rorg_manufacturer),11)) + \
-            [utils.from_bitarray([True,True,True,True,False,False,False,False])] + globals.COMMUNICATOR.base_id + [0]
+    data = [165] + learn_eep_bytes(packet.rorg_func, packet.rorg_type, packet.rorg_manufacturer) + \
+            [0xF0] + globals.COMMUNICATOR.base_id + [0]
     optional = [0x03] + utils.from_hex_string(packet.sender_hex) + [0xFF, 0x00]
     globals.COMMUNICATOR.send(RadioPacket(PACKET.RADIO, data=data, optional=optional))
     return
 
 def send_learn(message):
     logging.debug('Sending BS4 learn message')
-    data = [165] + utils.from_bitarray_split(utils.bitarray_sizing(utils.to_bitarray(utils.from_hex_string(message['profile']['func'])),6) + \
-        utils.bitarray_sizing(utils.to_bitarray(utils.from_hex_string(message['profile']['type'])),7) +\
-        utils.bitarray_sizing(utils.to_bitarray(0xFF),11)) + \
-        [utils.from_bitarray([True,False,False,False,False,False,False,False])] + globals.COMMUNICATOR.base_id + [0]
+    data = [165] + learn_eep_bytes(utils.from_hex_string(message['profile']['func']), utils.from_hex_string(message['profile']['type']), 0xFF) + \
+        [0x80] + globals.COMMUNICATOR.base_id + [0]
     optional = [0x03] + [0xFF,0xFF,0xFF,0xFF] + [0xFF, 0x00]
     globals.COMMUNICATOR.send(RadioPacket(PACKET.RADIO, data=data, optional=optional))
     return
@@ -3,74 +3,98 @@ import logging
 from enocean import utils
 import globals
 from enocean.protocol.packet import RadioPacket, UTETeachIn
-from enocean.protocol.constants import PACKET, RORG
+from enocean.protocol.bitfield import Bitfield
+from enocean.protocol.constants import PACKET, RORG, TX_PRIORITY
 
-def parse(action,packet):
+def parse_values(action,packet):
 	logging.debug("Its a BS4 message")
 	for k in packet.parsed:
 		action[k] = packet.parsed[k]
-	if utils.profile_from_action(action) in globals.NEEDS_RESPONSE:
-			logging.debug('This packets needs response')
-			if action['id'] in globals.STORAGE_MESSAGE:
-				logging.debug('A message is stored sending it')
-				send_command(globals.STORAGE_MESSAGE[action['id']],immediate=True)
-			else:
-				logging.debug('Sending same message response to BS4')
-				send_response(action)
-	if action['func'] == '06':
-		if 'RS' in action:
-			if action['RS']['raw_value'] == 1:
-				action['ILL'] = action['ILL2']['value']
-			else :
-				action['ILL'] = action['ILL1']['value']
-	if action['func'] == '12' and action['type'] in ['10','01','00'] :
-		channel = 1
-		if 'CH' in action :
-			channel = action['CH']['value'] + 1
-		type = 'P'
-		if action['DT']['raw_value']== 0:
-			type = 'C'
-		value = action['MR']['raw_value']
-		if action['DIV']['raw_value'] == 1:
-			finalValue = int(value)/float(10)
-		elif action['DIV']['raw_value'] == 2:
-			finalValue = int(value)/float(100)
-		elif action['DIV']['raw_value'] == 3:
-			finalValue = int(value)/float(1000)
+	return action
+
+def parse_response(action,packet):
+	logging.debug('This packets needs response')
+	if action['id'] in globals.STORAGE_MESSAGE:
+		logging.debug('A message is stored sending it')
+		send_command(globals.STORAGE_MESSAGE[action['id']],immediate=True,priority=TX_PRIORITY.RESPONSE)
+	else:
+		logging.debug('Sending same message response to BS4')
+		send_response(action)
+	return action
+
+def parse_illumination(action,packet):
+	if 'RS' in action:
+		if action['RS']['raw_value'] == 1:
+			action['ILL'] = action['ILL2']['value']
+		else :
+			action['ILL'] = action['ILL1']['value']
+	return action
+
+def parse_meter(action,packet):
+	channel = 1
+	if 'CH' in action :
+		channel = action['CH']['value'] + 1
+	type = 'P'
+	if action['DT']['raw_value']== 0:
+		type = 'C'
+	value = action['MR']['raw_value']
+	if action['DIV']['raw_value'] == 1:
+		finalValue = int(value)/float(10)
+	elif action['DIV']['raw_value'] == 2:
+		finalValue = int(value)/float(100)
+	elif action['DIV']['raw_value'] == 3:
+		finalValue = int(value)/float(1000)
+	else:
+		finalValue = value
+	action[type+str(int(channel))] = finalValue
+	return action
+
+def parse_voc(action,packet):
+	return parseVOC(action)
+
+def parse_fan(action,packet):
+	if 'FAN' in action :
+		if action['FAN']['raw_value'] in [0,16]:
+			action['FANTECH'] = 190
+		elif action['FAN']['raw_value'] in [1,17]:
+			action['FANTECH'] = 165 
+		elif action['FAN']['raw_value'] in [2,18]:
+			action['FANTECH'] = 145 
+		elif action['FAN']['raw_value'] in [3,19]:
+			action['FANTECH'] = 0 
 		else:
-			finalValue = value
-		action[type+str(int(channel))] = finalValue
-	if action['func'] == '09' and action['type'].lower() in ['05','0c']:
-		action = parseVOC(action)
-	if action['func'] == '11' and action['type'] == '02':
-		if 'FAN' in action :
-			if action['FAN']['raw_value'] in [0,16]:
-				action['FANTECH'] = 190
-			elif action['FAN']['raw_value'] in [1,17]:
-				action['FANTECH'] = 165 
-			elif action['FAN']['raw_value'] in [2,18]:
-				action['FANTECH'] = 145 
-			elif action['FAN']['raw_value'] in [3,19]:
-				action['FANTECH'] = 0 
-			else:
-				action['FANTECH'] = 210
+			action['FANTECH'] = 210
 	return action
 
+# (match(rorg, func, type), handler) of BS4 telegrams, in order
+HANDLERS = [
+	(None, parse_values),
+	(lambda rorg, func, type: rorg + '-' + func + '-' + type in globals.NEEDS_RESPONSE, parse_response),
+	(lambda rorg, func, type: func == '06', parse_illumination),
+	(lambda rorg, func, type: func == '12' and type in ['10','01','00'], parse_meter),
+	(lambda rorg, func, type: func == '09' and type.lower() in ['05','0c'], parse_voc),
+	(lambda rorg, func, type: func == '11' and type == '02', parse_fan),
+]
+
+def learn_eep_bytes(func, type, manufacturer):
+	''' FUNC (6 bits), TYPE (7 bits) and manufacturer (11 bits) of a BS4 learn telegram '''
+	bits = Bitfield(0, 24)
+	bits.set(0, 6, func)
+	bits.set(6, 7, type)
+	bits.set(13, 11, manufacturer)
+	return bits.to_bytes()
+
 def response_learn_BS4VAR3(packet):
-	data = [165] + utils.from_bitarray_split(utils.bitarray_sizing(utils.to_bitarray(packet.rorg_func),6) + \
-			utils.bitarray_sizing(utils.to_bitarray(packet.rorg_type),7) +\
-			utils.bitarray_sizing(utils.to_bitarray(packet.rorg_manufacturer),11)) + \
-			[utils.from_bitarray([True,True,True,True,False,False,False,False])] + globals.COMMUNICATOR.base_id + [0]
+	data = [165] + learn_eep_bytes(packet.rorg_func, packet.rorg_type, packet.rorg_manufacturer) + \
+			[0xF0] + globals.COMMUNICATOR.base_id + [0]
 	optional = [0x03] + utils.from_hex_string(packet.sender_hex) + [0xFF, 0x00]
-	globals.COMMUNICATOR.send(RadioPacket(PACKET.RADIO, data=data, optional=optional))
+	globals.COMMUNICATOR.send(RadioPacket(PACKET.RADIO, data=data, optional=optional), priority=TX_PRIORITY.RESPONSE)
 	return
 
 def send_learn(message):
 	logging.debug('Sending BS4 learn message')
-	data = [165] + utils.from_bitarray_split(utils.bitarray_sizing(utils.to_bitarray(utils.from_hex_string(message['profile']['func'])),6) + \
-		utils.bitarray_sizing(utils.to_bitarray(utils.from_hex_string(message['profile']['type'])),7) +\
-		utils.bitarray_sizing(utils.to_bitarray(0xFF),11)) + \
-		[utils.from_bitarray([True,False,False,False,False,False,False,False])] + globals.COMMUNICATOR.base_id + [0]
+	data = [165] + learn_eep_bytes(utils.from_hex_string(message['profile']['func']), utils.from_hex_string(message['profile']['type']), 0xFF) + \
+		[0x80] + globals.COMMUNICATOR.base_id + [0]
 	optional = [0x03] + [0xFF,0xFF,0xFF,0xFF] + [0xFF, 0x00]
 	globals.COMMUNICATOR.send(RadioPacket(PACKET.RADIO, data=data, optional=optional))
 	return
@@ -90,7 +114,7 @@ def parseVOC(action):
 		action[vocname] = finalValue
 	return action
 
-def send_command(message,learn=False, immediate=False):
+def send_command(message,learn=False, immediate=False, priority=TX_PRIORITY.INTERACTIVE):
 	kwargs={}
 	command = None
 	generic = ''
@@ -121,10 +145,10 @@ def send_command(message,learn=False, immediate=False):
 			except :
 				kwargs[data] = message['command'][data]
 	logging.debug(str(kwargs) +' on command ' + str(command) + ' ' + str(commandRorg)+ ' '+ str(commandFunc) + ' ' + str(commandType))
-	globals.COMMUNICATOR.send(RadioPacket.create(rorg=commandRorg, rorg_func =commandFunc, rorg_type =commandType, destination=commandDestination, sender=sender, learn = learn, command = command, direction = direction, **kwargs))
+	globals.COMMUNICATOR.send(RadioPacket.create(rorg=commandRorg, rorg_func =commandFunc, rorg_type =commandType, destination=commandDestination, sender=sender, learn = learn, command = command, direction = direction, **kwargs), priority=priority)
 
 def send_response(action):
 	logging.debug(str(action))
 	message = {"cmd" : "send" , "dest" : action['id'], "profile" : {"func" : action['func'], "rorg" : action['rorg'], "type" : action["type"]}, "command" : {"direction" : 2 , "SP" : action['CV']['value']}}
-	send_command(message)
+	send_command(message, priority=TX_PRIORITY.RESPONSE)
 
@@ -1,75 +1,63 @@
 # -*- encoding: utf-8 -*-
 import logging
+import threading
 from enocean import utils
 import globals
 from enocean.protocol.packet import RadioPacket, UTETeachIn
 from enocean.protocol.constants import PACKET, RORG
 
-def parse(action,packet):
+def parse_values(action,packet):
     for k in packet.parsed:
         action[k] = packet.parsed[k]
-    if str(action['rorg']) == 'd1079':
-        if str(action['func']) == '01':
-            if str(action['destination']).lower() != 'ffffffff' and str(action['destination']).lower() != str(utils.to_hex_string(globals.COMMUNICATOR.base_id)).replace(':','').lower():
-                logging.debug("Vmi message not for jeedom ignoring")
-                action['ignore'] = 1
-        if 'IDMACH' in action:
-            action['IDMACH']['value'] = hex(int(action['IDMACH']['raw_value']))[2:].rstrip("L").zfill(8)
-        if 'CAPTINDEX' in action:
-            name = 'CAPTEUR'+ str(action['CAPTINDEX']['raw_value'])
-            action[name]={}
-            action[name]['value'] = hex(int(action['IDAPP']['raw_value']))[2:].rstrip("L").zfill(8) +'|'+action['PIECEAPP']['value']+'|'+action['PROFAPP']['value']
     return action
 
+def parse_ventilairsec(action,packet):
+    if str(action['func']) == '01':
+        if str(action['destination']).lower() != 'ffffffff' and str(action['destination']).lower() != str(utils.to_hex_string(globals.COMMUNICATOR.base_id)).replace(':','').lower():
+            logging.debug("Vmi message not for jeedom ignoring")
+            action['ignore'] = 1
+    if 'IDMACH' in action:
+        action['IDMACH']['value'] = hex(int(action['IDMACH']['raw_value']))[2:].rstrip("L").zfill(8)
+    if 'CAPTINDEX' in action:
+        name = 'CAPTEUR'+ str(action['CAPTINDEX']['raw_value'])
+        action[name]={}
+        action[name]['value'] = hex(int(action['IDAPP']['raw_value']))[2:].rstrip("L").zfill(8) +'|'+action['PIECEAPP']['value']+'|'+action['PROFAPP']['value']
+    return action
+
+# (match(rorg, func, type), handler) of MSC telegrams, in order
+HANDLERS = [
+    (None, parse_values),
+    (lambda rorg, func, type: str(rorg) == 'd1079', parse_ventilairsec),
+]
+
 def send(rorg,datas,sender,destination):
     logging.debug("Handling MSC message " +str(destination) + ' ' + str(sender) + ' ' + str(datas) + ' ' + str(rorg))
     if str(rorg) == 'd1079':
         logging.debug('Msc message for Ventilairsec VMI')
         ventilairsecVMI(destination,sender,datas)
 
+# Fields of the 0790 frame, in order. 0xFF leaves a field unchanged
+VMI_0790_FIELDS = ['MODEFONC', 'FONC', 'VACS', 'BOOST', 'TEMPEL', 'TEMPSOUF', 'TEMPHYD', 'TEMPSOL', 'COMMAND']
+# destination -> {'sender', 'fields', 'requests'} of the 0790 frames waiting to be merged
+VMI_PENDING = {}
+VMI_LOCK = threading.Lock()
+VMI_STATS = {'requests': 0, 'frames': 0, 'saved': 0}
+
 def ventilairsecVMI(dest,sender,datas):
     if str(datas['command']) == '0':
         logging.debug('VentilairsecVmi : This is a 0 CMD')
-        rawcommand ='0790'
-        if 'MODEFONC' in datas :
-            rawcommand += hex(int(datas['MODEFONC']))[2:].zfill(2)
-        else:
-            rawcommand += 'FF'
-        if 'FONC' in datas :
-            rawcommand += hex(int(datas['FONC'],2))[2:].zfill(2)
-        else:
-            rawcommand += 'FF'
-        if 'VACS' in datas :
-            rawcommand += hex(int(datas['VACS']))[2:].zfill(2)
-        else:
-            rawcommand += 'FF'
-        if 'BOOST' in datas :
-            rawcommand += hex(int(datas['BOOST']))[2:].zfill(2)
-        else:
-            rawcommand += 'FF'
-        if 'TEMPEL' in datas :
-            rawcommand += hex(int(datas['TEMPEL']))[2:].zfill(2)
-        else:
-            rawcommand += 'FF'
-        if 'TEMPSOUF' in datas :
-            rawcommand += hex(int(datas['TEMPSOUF']))[2:].zfill(2)
-        else:
-            rawcommand += 'FF'
-        if 'TEMPHYD' in datas :
-            rawcommand += hex(int(datas['TEMPHYD']))[2:].zfill(2)
-        else:
-            rawcommand += 'FF'
-        if 'TEMPSOL' in datas :
-            rawcommand +=  hex(int(datas['TEMPSOL']))[2:].zfill(2)
-        else:
-            rawcommand += 'FF'
-        if 'COMMAND' in datas :
-            rawcommand += hex(int(datas['COMMAND']))[2:].zfill(2)
-        else:
-            rawcommand += 'FF'
-        logging.debug(rawcommand)
-        transmit(int('d1',16),rawcommand,sender,dest)
-    elif str(datas['command']) == '1':
+        fields = {}
+        for field in VMI_0790_FIELDS:
+            if field in datas :
+                if field == 'FONC':
+                    fields[field] = hex(int(datas[field],2))[2:].zfill(2)
+                else:
+                    fields[field] = hex(int(datas[field]))[2:].zfill(2)
+        queue_0790(dest,sender,fields)
+        return
+    # Keep the order of the commands
+    flush_0790(dest)
+    if str(datas['command']) == '1':
         logging.debug('VentilairsecVmi : This is a 1 CMD')
         rawcommand ='0791'
         if 'HOUR' in datas :
@@ -84,6 +72,50 @@ def ventilairsecVMI(dest,sender,datas):
         logging.debug(rawcommand)
         transmit(int('d1',16),rawcommand,sender,dest)
 
+def queue_0790(dest,sender,fields):
+    '''
+    Send the fields of a 0790 frame to dest, after VMI_COALESCE_WINDOW seconds.
+    Fields of the frames queued in the meantime are merged in the same frame, the last value of a field wins.
+    '''
+    with VMI_LOCK:
+        VMI_STATS['requests'] += 1
+        pending = VMI_PENDING.get(dest)
+        if pending is not None:
+            logging.debug('VentilairsecVmi : merging with the pending 0790 frame ' + str(fields))
+            pending['fields'].update(fields)
+            pending['requests'] += 1
+            VMI_STATS['saved'] += 1
+            return
+        if globals.VMI_COALESCE_WINDOW > 0 and globals.SCHEDULER is not None:
+            VMI_PENDING[dest] = {'sender': sender, 'fields': fields, 'requests': 1}
+            if globals.SCHEDULER.call_later(globals.VMI_COALESCE_WINDOW, flush_0790, dest) is not None:
+                return
+            del VMI_PENDING[dest]
+    send_0790(dest,sender,fields)
+
+def flush_0790(dest):
+    ''' Send the pending 0790 frame of dest, if any '''
+    with VMI_LOCK:
+        pending = VMI_PENDING.pop(dest, None)
+    if pending is None:
+        return
+    if pending['requests'] > 1:
+        logging.debug('VentilairsecVmi : ' + str(pending['requests']) + ' commands merged in one 0790 frame')
+    send_0790(dest,pending['sender'],pending['fields'])
+
+def send_0790(dest,sender,fields):
+    rawcommand ='0790'
+    for field in VMI_0790_FIELDS:
+        rawcommand += fields.get(field, 'FF')
+    logging.debug(rawcommand)
+    with VMI_LOCK:
+        VMI_STATS['frames'] += 1
+    transmit(int('d1',16),rawcommand,sender,dest)
+
+def coalesce_stats():
+    with VMI_LOCK:
+        return dict(VMI_STATS, pending=len(VMI_PENDING))
+
 def transmit(rorg,raw,sender,destination):
     logging.debug('Sending Raw message ' + str(raw))
     data = [rorg] + utils.string_to_list(raw) + sender +[0x80]
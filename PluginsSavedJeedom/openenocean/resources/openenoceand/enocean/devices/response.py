@@ -31,5 +31,4 @@ def parse(packet):
         action['chip_version'] = utils.to_hex_string(packet.data[13:17])
         action['app_description'] = str(bytearray(packet.data[17:]))
         globals.JEEDOM_COM.send_change_immediate(action)
-    globals.WAITING_RES = False
     return
@@ -0,0 +1,72 @@
+# -*- encoding: utf-8 -*-
+from __future__ import print_function, unicode_literals, division, absolute_import
+import logging
+import threading
+
+
+class HandlerRegistry(object):
+    '''
+    Handlers of decoded telegrams, selected by packet type, RORG, FUNC and TYPE.
+    The chain of handlers of a (packet type, RORG, FUNC, TYPE) is resolved the first time
+    it is needed, and cached: later telegrams don't go through any matching.
+    Handlers are called in registration order with (action, packet), and return the action.
+    '''
+
+    def __init__(self):
+        self._handlers = []
+        self._chains = {}
+        self._lock = threading.Lock()
+        # Statistics
+        self.resolved = 0
+        self.dispatched = 0
+
+    def register(self, handler, packet_type=None, rorg=None, match=None):
+        '''
+        Add handler for packet_type and rorg (None matches all).
+        match(rorg, func, type) can restrict it further, on the strings of the action
+        (rorg includes the manufacturer for MSC, like 'd1079').
+        '''
+        with self._lock:
+            self._handlers.append((packet_type, rorg, match, handler))
+            self._chains = {}
+
+    def register_all(self, handlers, packet_type=None, rorg=None):
+        ''' Add a list of (match, handler), as defined by the device modules '''
+        for match, handler in handlers:
+            self.register(handler, packet_type, rorg, match)
+
+    def chain(self, packet_type, rorg, action_rorg, func, type):
+        ''' Handlers for the telegram, resolved once per key '''
+        key = (packet_type, rorg, action_rorg, func, type)
+        chain = self._chains.get(key)
+        if chain is None:
+            chain = []
+            for handler_packet_type, handler_rorg, match, handler in self._handlers:
+                if handler_packet_type is not None and handler_packet_type != packet_type:
+                    continue
+                if handler_rorg is not None and handler_rorg != rorg:
+                    continue
+                if match is not None and not match(action_rorg, func, type):
+                    continue
+                chain.append(handler)
+            chain = tuple(chain)
+            logging.debug('Handlers for ' + str(key) + ' : ' + str([handler.__name__ for handler in chain]))
+            with self._lock:
+                self._chains[key] = chain
+                self.resolved += 1
+        return chain
+
+    def dispatch(self, action, packet):
+        ''' Run the handlers of the telegram on action '''
+        self.dispatched += 1
+        for handler in self.chain(packet.packet_type, packet.rorg, action['rorg'], action['func'], action['type']):
+            action = handler(action, packet)
+        return action
+
+    def stats(self):
+        return {
+            'handlers': len(self._handlers),
+            'chains': len(self._chains),
+            'resolved': self.resolved,
+            'dispatched': self.dispatched,
+        }
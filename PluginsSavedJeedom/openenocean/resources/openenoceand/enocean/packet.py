@@ -1,7 +1,9 @@
 import globals
 import json
-import time
 from enocean import utils
+from enocean.dispatch import HandlerRegistry
+from enocean.protocol.chain import ChainReassembler
+from enocean.protocol.duplicate import DuplicateFilter
 from enocean.devices import vld, rps, bs4p, bs1,response, rawhandler, remMan ,msc
 from enocean.protocol.constants import PACKET, RORG
 from enocean.protocol.packet import RadioPacket, UTETeachIn
@@ -12,83 +14,55 @@ except ImportError:
     print("Error: importing module from jeedom folder")
     sys.exit(1)
 
+# Decoded actions of the last telegrams, identical telegrams are not decoded again
+DECODE_CACHE = utils.LRUCache(globals.DECODE_CACHE_SIZE)
+# Chained telegrams being received
+CHAINS = ChainReassembler(globals.CHAIN_TTL, globals.CHAIN_MAX)
+# Last telegram of each sender, its copies from repeaters in the next DUPLICATE_WINDOW seconds are not decoded
+DUPLICATES = DuplicateFilter(globals.DUPLICATE_WINDOW)
+
 def packet_get_eep(packet):
-    packet_id = str(packet.sender_hex).replace(":","")
-    packet_rorg = str(jeedom_utils.dec2hex(packet.rorg))
-    if packet_id in globals.KNOWN_DEVICES:
-        for info in globals.KNOWN_DEVICES[packet_id]:
-            if packet.rorg == RORG.MSC:
-                if str(info['rorg']) == str(jeedom_utils.dec2hex(packet.rorg)).zfill(2)+str(jeedom_utils.dec2hex(packet.rorg_manufacturer)).zfill(3):
-                    return info,packet
-            else:
-                if str(info['rorg']) == packet_rorg:
-                    return info,packet
+    device = globals.DEVICE_INDEX.get(packet.sender_int)
+    if device is not None:
+        if packet.rorg == RORG.MSC:
+            info = device['rorg'].get((packet.rorg << 12) | (packet.rorg_manufacturer or 0))
+        else:
+            info = device['rorg'].get(packet.rorg)
+        if info is not None:
+            return info,packet
     if packet.contains_eep:
         try:
             rorg = jeedom_utils.dec2hex(packet.rorg_of_eep)
         except:
-            rorg = packet_rorg
+            rorg = str(jeedom_utils.dec2hex(packet.rorg))
         if rorg == jeedom_utils.dec2hex(RORG.MSC):
             return {'rorg' : str(jeedom_utils.dec2hex(packet.rorg_of_eep)).zfill(2)+str(jeedom_utils.dec2hex(packet.rorg_manufacturer)).zfill(3), 'func' : str(jeedom_utils.dec2hex(packet.rorg_func)).zfill(2) , 'type' : str(jeedom_utils.dec2hex(packet.rorg_type)).zfill(2)},packet
         else:
             return {'rorg' : rorg, 'func' : str(jeedom_utils.dec2hex(packet.rorg_func)).zfill(2) , 'type' : str(jeedom_utils.dec2hex(packet.rorg_type)).zfill(2)},packet
     
     if packet.rorg == RORG.BS4:
-        return {'rorg' : packet_rorg, 'func' : '02' , 'type' : '05'},packet
+        return {'rorg' : str(jeedom_utils.dec2hex(packet.rorg)), 'func' : '02' , 'type' : '05'},packet
 
     if packet.rorg == RORG.BS1:
-        return {'rorg' : packet_rorg, 'func' : '00' , 'type' : '01'},packet
+        return {'rorg' : str(jeedom_utils.dec2hex(packet.rorg)), 'func' : '00' , 'type' : '01'},packet
 
     if packet.rorg == RORG.RPS:
-        return {'rorg' : packet_rorg, 'func' : '02' , 'type' : '02'},packet
+        return {'rorg' : str(jeedom_utils.dec2hex(packet.rorg)), 'func' : '02' , 'type' : '02'},packet
 
     if packet.rorg == RORG.VLD:
-        return {'rorg' : packet_rorg, 'func' : '01' , 'type' : '01'},packet
+        return {'rorg' : str(jeedom_utils.dec2hex(packet.rorg)), 'func' : '01' , 'type' : '01'},packet
     
     if packet.rorg == RORG.CHAINED:
         logging.debug('This is a chained telegram ')
         logging.debug('Chained data ' + str(packet.data))
-        data = packet.data
-        binary = bin(int(str(data[1])))[2:].zfill(8)
-        logging.debug('Chained telegram binary seq idx ' + str(binary))
-        seq = int(str(binary)[0:4].zfill(8),2)
-        idx = int(str(binary)[5:].zfill(8),2)
-        key = packet_id+'.'+str(seq)
-        logging.debug('Chained telegram binary seq is ' + str(seq) + ' and idx is ' + str(idx))
-        if idx == 0 :
-            logging.debug('First message of the chain with seq ' + str(seq))
-            logging.debug('First message of the chainhas optional ' + str(packet.optional))
-            lendata = int(str(data[2])+str(data[3]))
-            logging.debug('Chain Len will be ' + str(lendata) + ' and sender is ' + str(packet_id))
-            storagedata={}
-            storagedata['len']=lendata
-            storagedata['optional']=packet.optional
-            storagedata['data']=data[4:-5]
-            storagedata['final']=data[-5:]
-            storagedata['time']=int(time.time())
-            globals.STORAGE_CHAIN[key] = storagedata
-            logging.debug('Storage Chain ' + str(globals.STORAGE_CHAIN))
-        else:
-            logging.debug('This is number ' + str(idx) + ' message of the chain with seq ' + str(seq))
-            if key in globals.STORAGE_CHAIN:
-                logging.debug('Found data in storage chain : appending')
-                globals.STORAGE_CHAIN[key]['data'] = globals.STORAGE_CHAIN[key]['data']+data[2:-5]
-                logging.debug('Storage Chain ' + str(globals.STORAGE_CHAIN))
-                expectedlen = globals.STORAGE_CHAIN[key]['len']
-                currentlen = len(globals.STORAGE_CHAIN[key]['data'])
-                logging.debug('Chain expected len for ' + key + ' is ' + str(expectedlen) + ' current len is ' + str(currentlen))
-                if currentlen >= expectedlen:
-                    logging.debug('Chain Data is complete and is ' + str(globals.STORAGE_CHAIN[key]['data']) + ' with final ' + str(globals.STORAGE_CHAIN[key]['final']))
-                    packet.data=globals.STORAGE_CHAIN[key]['data']+globals.STORAGE_CHAIN[key]['final']
-                    del globals.STORAGE_CHAIN[key]
-                    logging.debug('Reparsing chained final data')
-                    packet.parse()
-                    logging.debug('Reanalysing chained final data')
-                    return packet_get_eep(packet)
-                else:
-                    logging.debug('Chain Data is still not complete')
-            else:
-                logging.debug('No data in storage chain can\'t do anything with this data')
+        data = CHAINS.add(packet.sender_int, packet.data)
+        if data is not None:
+            logging.debug('Chain Data is complete and is ' + str(data))
+            packet.data = data
+            logging.debug('Reparsing chained final data')
+            packet.parse()
+            logging.debug('Reanalysing chained final data')
+            return packet_get_eep(packet)
     if packet.rorg == RORG.MSC:
         data = packet.data
         logging.debug('This is a MSC telegram ' + str(data))
@@ -97,31 +71,36 @@ def packet_get_eep(packet):
         logging.debug('This is a UTE telegram ' + str(packet.data))
     return None,packet
     
+def log_packet(message):
+    def log(packet):
+        logging.debug(message + str(packet))
+    return log
+
+# Handlers of the packets other than radio telegrams
+PACKET_HANDLERS = {
+    PACKET.RESPONSE : response.parse,
+    PACKET.EVENT : log_packet('Received event packet : '),
+    PACKET.RADIO_SUB_TEL : log_packet('Received radio sub tel packet : '),
+    PACKET.COMMON_COMMAND : log_packet('Received common command packet : '),
+    PACKET.SMART_ACK_COMMAND : log_packet('Received smart ack command packet : '),
+    PACKET.REMOTE_MAN_COMMAND : remMan.parse,
+    PACKET.RADIO_MESSAGE : log_packet('Received radio message packet : '),
+    PACKET.RADIO_ADVANCED : log_packet('Received radio advanced packet : '),
+}
+
+# Post-processing of the decoded radio telegrams, by RORG
+PARSERS = HandlerRegistry()
+PARSERS.register(vld.parse, PACKET.RADIO, RORG.VLD)
+PARSERS.register(rps.parse, PACKET.RADIO, RORG.RPS)
+PARSERS.register_all(bs4p.HANDLERS, PACKET.RADIO, RORG.BS4)
+PARSERS.register(bs1.parse, PACKET.RADIO, RORG.BS1)
+PARSERS.register_all(msc.HANDLERS, PACKET.RADIO, RORG.MSC)
+
 def decode_packet(packet):
     action = {}
-    if packet.packet_type == PACKET.RESPONSE:
-        response.parse(packet)
-        return
-    elif packet.packet_type == PACKET.EVENT:
-        logging.debug('Received event packet : ' + str(packet))
-        return
-    elif packet.packet_type == PACKET.RADIO_SUB_TEL:
-        logging.debug('Received radio sub tel packet : ' + str(packet))
-        return
-    elif packet.packet_type == PACKET.COMMON_COMMAND:
-        logging.debug('Received common command packet : ' + str(packet))
-        return
-    elif packet.packet_type == PACKET.SMART_ACK_COMMAND:
-        logging.debug('Received smart ack command packet : ' + str(packet))
-        return
-    elif packet.packet_type == PACKET.REMOTE_MAN_COMMAND:
-        remMan.parse(packet)
-        return
-    elif packet.packet_type == PACKET.RADIO_MESSAGE:
-        logging.debug('Received radio message packet : ' + str(packet))
-        return
-    elif packet.packet_type == PACKET.RADIO_ADVANCED:
-        logging.debug('Received radio advanced packet : ' + str(packet))
+    handler = PACKET_HANDLERS.get(packet.packet_type)
+    if handler is not None:
+        handler(packet)
         return
     if packet.packet_type != PACKET.RADIO:
         logging.debug('Not decode because it\'s not radio package : ' + str(packet.packet_type))
@@ -129,6 +108,12 @@ def decode_packet(packet):
     if packet.sender[0:3] == globals.COMMUNICATOR.base_id[0:3]:
         logging.debug('Ignore this is an echo')
         return
+    copy = DUPLICATES.check(packet.sender_int, packet.data, packet.dBm)
+    if copy != DuplicateFilter.NEW:
+        device_id = str(packet.sender_hex).replace(":","")
+        if copy == DuplicateFilter.BETTER_COPY and device_id in globals.KNOWN_DEVICES:
+            globals.JEEDOM_COM.add_changes('devices::'+device_id,{'id' : device_id, 'dBm' : str(packet.dBm)})
+        return
     eep,packet = packet_get_eep(packet)
     if eep is None:
         logging.debug('No eep found, no decoded')
@@ -193,22 +178,43 @@ def decode_packet(packet):
         return
     if eep['func'] == '38' and eep['type']=='08':
         packet.cmd = 2
+    cache_key = decode_cache_key(action,packet)
+    if cache_key is not None:
+        cached = DECODE_CACHE.get(cache_key)
+        if cached is not DECODE_CACHE.MISSING:
+            logging.debug('Same telegram already decoded, using cached data')
+            decoded = copy_action(cached)
+            # Not part of the key, they change with each copy of the telegram
+            decoded['dBm'] = action['dBm']
+            decoded['repeat'] = action['repeat']
+            send_action(decoded)
+            return
     packet.parse_eep(utils.from_hex_string(eep['func']),utils.from_hex_string(eep['type']) , command = packet.cmd )
-    parse_packet(action,packet)
+    parse_packet(action,packet,cache_key)
+
+def decode_cache_key(action,packet):
+    ''' Key of the decoded telegram in DECODE_CACHE, None if it must always be decoded '''
+    if DECODE_CACHE.maxsize <= 0:
+        return None
+    profile = utils.profile_from_action(action)
+    if profile in globals.NEEDS_RESPONSE or profile in globals.DECODE_CACHE_BYPASS:
+        # Decoding has side effects
+        return None
+    return (action['id'], profile, packet.cmd, action['destination'], tuple(packet.data))
+
+def copy_action(action):
+    ''' Copy of action and of the field dicts in it '''
+    return dict((k, dict(v) if isinstance(v, dict) else v) for k, v in action.items())
 
-def parse_packet(action,packet):
+def parse_packet(action,packet,cache_key=None):
     logging.debug("Parsing Packet")
-    if packet.rorg == RORG.VLD:
-        action = vld.parse(action,packet)
-    if packet.rorg == RORG.RPS:
-        action = rps.parse(action,packet)
-    if packet.rorg == RORG.BS4:
-        action = bs4p.parse(action,packet)
-    if packet.rorg == RORG.BS1:
-        action = bs1.parse(action,packet)
-    if packet.rorg == RORG.MSC:
-        action = msc.parse(action,packet)
+    action = PARSERS.dispatch(action,packet)
     logging.debug('Decode data : '+json.dumps(action))
+    if cache_key is not None:
+        DECODE_CACHE.put(cache_key,copy_action(action))
+    send_action(action)
+
+def send_action(action):
     try:
         if len(action) > 7 and (not 'ignore' in action or action['ignore'] != 1):
             if ('immediate' in action and action['immediate'] == 1) :
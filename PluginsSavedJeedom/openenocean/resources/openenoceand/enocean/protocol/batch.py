@@ -0,0 +1,101 @@
+# -*- encoding: utf-8 -*-
+'''
+Columnar decoding of many telegrams of the same profile, for backfills and replays.
+Requires NumPy, which the daemon itself doesn't need.
+'''
+from __future__ import print_function, unicode_literals, division, absolute_import
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from enocean.protocol.eep import ValueField, EnumField, StatusField
+
+
+def decode_batch(profile, data, status=None):
+    '''
+    Decode the rows of data with profile (a data description, as returned by EEP.find_profile).
+    data is a 2-D uint8 array (or list of lists) of Packet.data rows: RORG, payload, sender and status.
+    status defaults to the last column, as for RPS/BS1/BS4 telegrams (VLD telegrams carry it in the optional data).
+    Returns an OrderedDict shortcut -> {'description', 'unit', 'raw_value', 'value'},
+    with raw_value and value as arrays of one item per row.
+    Like the per telegram decoding, values without unit are left out.
+    Enum values which have no description are None.
+    '''
+    if numpy is None:
+        raise ImportError('NumPy is required for batch decoding (pip install numpy)')
+    data = numpy.asarray(data, dtype=numpy.uint8)
+    if data.ndim != 2 or data.shape[1] < 6:
+        raise ValueError('Data must be a 2-D array of Packet.data rows.')
+    payload = data[:, 1:data.shape[1] - 5]
+    if status is None:
+        status = data[:, -1]
+    status = numpy.asarray(status, dtype=numpy.uint8).reshape(-1, 1)
+
+    output = OrderedDict()
+    if profile is None:
+        return output
+    for field in profile.fields:
+        if isinstance(field, StatusField):
+            raw_value = _get_raw(status, field.offset, field.size)
+        else:
+            raw_value = _get_raw(payload, field.offset, field.size)
+        if raw_value is None:
+            continue
+        if isinstance(field, ValueField):
+            if field.unit is None or field.factor is None:
+                continue
+            value = field.factor * (raw_value - field.rng_min) + field.scl_min
+        elif isinstance(field, EnumField):
+            value = _get_enum_values(field, raw_value)
+        elif isinstance(field, StatusField):
+            value = raw_value != 0
+        else:
+            value = raw_value
+        output[field.shortcut] = {
+            'description': field.description,
+            'unit': field.unit,
+            'raw_value': raw_value,
+            'value': value,
+        }
+    return output
+
+
+def _get_raw(columns, offset, size):
+    '''
+    Field of every row, like Bitfield.get: MSB-first offsets, truncated at the end of the row.
+    None if the field is out of range.
+    '''
+    width = columns.shape[1] * 8
+    if offset < 0:
+        offset += width
+    size = min(size, width - offset)
+    if offset < 0 or size <= 0:
+        return None
+    first = offset // 8
+    last = (offset + size - 1) // 8
+    if last - first >= 8:
+        # Wider than 64 bits, fall back to Python integers
+        rows = [int.from_bytes(bytearray(row), 'big') for row in columns[:, first:last + 1]]
+        shift = (last + 1) * 8 - offset - size
+        return numpy.array([(row >> shift) & ((1 << size) - 1) for row in rows], dtype=object)
+    raw_value = numpy.zeros(columns.shape[0], dtype=numpy.uint64)
+    for byte in range(first, last + 1):
+        raw_value = (raw_value << numpy.uint64(8)) | columns[:, byte].astype(numpy.uint64)
+    raw_value >>= numpy.uint64((last + 1) * 8 - offset - size)
+    raw_value &= numpy.uint64((1 << size) - 1)
+    return raw_value
+
+
+def _get_enum_values(field, raw_value):
+    ''' Description of every raw value, looked up once per distinct value '''
+    uniques, inverse = numpy.unique(raw_value, return_inverse=True)
+    values = numpy.empty(len(uniques), dtype=object)
+    for index, unique in enumerate(uniques):
+        try:
+            values[index] = field.get_value(int(unique))
+        except Exception:
+            values[index] = None
+    return values[inverse.reshape(-1)]
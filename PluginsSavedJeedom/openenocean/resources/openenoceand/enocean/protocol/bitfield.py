@@ -0,0 +1,80 @@
+# -*- encoding: utf-8 -*-
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+
+class Bitfield(object):
+    '''
+    Integer backed bit field.
+    Bits are indexed MSB-first, like the offsets in the EEP XML:
+    offset 0 is the most significant bit of the first byte.
+    Negative offsets count from the end, so the DBx.BIT_y constants can be used.
+    '''
+    __slots__ = ('value', 'width')
+
+    def __init__(self, value=0, width=8):
+        self.value = value
+        self.width = width
+
+    @classmethod
+    def from_bytes(cls, data):
+        ''' Create bit field from a list of integers or a bytearray '''
+        return cls(int.from_bytes(bytearray(data), 'big'), len(data) * 8)
+
+    def to_bytes(self):
+        ''' Convert bit field back to a list of integers '''
+        return list(self.value.to_bytes(self.width // 8, 'big'))
+
+    def __len__(self):
+        return self.width
+
+    def __eq__(self, other):
+        return isinstance(other, Bitfield) and self.value == other.value and self.width == other.width
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return 'Bitfield(%s, %d)' % (bin(self.value), self.width)
+
+    def _index(self, index):
+        if index < 0:
+            index += self.width
+        if index < 0 or index >= self.width:
+            raise IndexError('Bit index out of range')
+        return index
+
+    def get(self, offset, size):
+        '''
+        Get field as integer, based on offset and size.
+        Like slicing a bit array, a field overlapping the end is truncated to the available bits.
+        '''
+        if offset < 0:
+            offset += self.width
+        size = min(size, self.width - offset)
+        if offset < 0 or size <= 0:
+            raise ValueError('Field at offset %d is out of range' % offset)
+        return (self.value >> (self.width - offset - size)) & ((1 << size) - 1)
+
+    def set(self, offset, size, raw_value):
+        ''' Put the lowest size bits of raw_value into the field '''
+        if offset < 0:
+            offset += self.width
+        if offset < 0 or offset + size > self.width:
+            raise IndexError('Field at offset %d is out of range' % offset)
+        shift = self.width - offset - size
+        mask = ((1 << size) - 1) << shift
+        self.value = (self.value & ~mask) | ((int(raw_value) << shift) & mask)
+        return self
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # Backwards compatibility with list of booleans
+            return [self[i] for i in range(*index.indices(self.width))]
+        return (self.value >> (self.width - 1 - self._index(index))) & 0x01 == 1
+
+    def __setitem__(self, index, bit):
+        shift = self.width - 1 - self._index(index)
+        if bit:
+            self.value |= 1 << shift
+        else:
+            self.value &= ~(1 << shift)
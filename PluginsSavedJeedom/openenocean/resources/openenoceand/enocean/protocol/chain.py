@@ -0,0 +1,109 @@
+# -*- encoding: utf-8 -*-
+from __future__ import print_function, unicode_literals, division, absolute_import
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+class ChainReassembler(object):
+    '''
+    Reassembly of chained telegrams (RORG 0x40), per sender and sequence.
+    The first fragment (index 0) holds the length of the whole data. Fragments are kept by index,
+    so they may arrive in any order and a repeated one is ignored; the chain is complete once
+    the fragments from index 0 up hold that length.
+    Chains not completed within ttl seconds are dropped, and when max_chains are in flight
+    the oldest one is dropped to make room: a noisy radio environment can't grow memory.
+    '''
+
+    def __init__(self, ttl=10, max_chains=16):
+        self.ttl = ttl
+        self.max_chains = max_chains
+        # (sender, seq) -> chain, oldest first
+        self._chains = OrderedDict()
+        self._lock = threading.Lock()
+        # Statistics
+        self.completed = 0
+        self.expired = 0
+        self.evicted = 0
+        self.orphans = 0
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self._chains)
+
+    def _expire(self, now):
+        while self._chains:
+            key, chain = next(iter(self._chains.items()))
+            if now - chain['time'] < self.ttl:
+                return
+            logging.debug('Chain ' + str(key) + ' expired')
+            del self._chains[key]
+            self.expired += 1
+
+    def _new_chain(self, key, now):
+        if len(self._chains) >= self.max_chains:
+            oldest = next(iter(self._chains))
+            logging.debug('Too many chains in flight, dropping ' + str(oldest))
+            del self._chains[oldest]
+            self.evicted += 1
+        chain = {'len': None, 'fragments': {}, 'final': None, 'time': now}
+        self._chains[key] = chain
+        return chain
+
+    def add(self, sender, data, now=None):
+        '''
+        Add the fragment in data (Packet.data of a chained telegram) from sender.
+        Returns the data of the reassembled telegram, with the sender and status of the first fragment,
+        once the chain is complete. Returns None otherwise.
+        '''
+        if now is None:
+            now = time.time()
+        seq = data[1] >> 4
+        idx = data[1] & 0x07
+        key = (sender, seq)
+        fragment = bytes(bytearray(data[4:-5] if idx == 0 else data[2:-5]))
+        with self._lock:
+            self._expire(now)
+            chain = self._chains.get(key)
+            if chain is not None and idx in chain['fragments']:
+                if chain['fragments'][idx] == fragment:
+                    logging.debug('Message ' + str(idx) + ' of the chain ' + str(key) + ' already received, ignoring')
+                    self.duplicates += 1
+                    return None
+                # Restarted before completion
+                del self._chains[key]
+                chain = None
+            if chain is None:
+                if idx != 0:
+                    logging.debug('Message ' + str(idx) + ' of the chain ' + str(key) + ' before its first message')
+                    self.orphans += 1
+                chain = self._new_chain(key, now)
+            chain['fragments'][idx] = fragment
+            if idx == 0:
+                chain['len'] = (data[2] << 8) | data[3]
+                chain['final'] = list(data[-5:])
+                logging.debug('First message of the chain ' + str(key) + ', length will be ' + str(chain['len']))
+            if chain['len'] is None:
+                return None
+            reassembled = bytearray()
+            for i in range(len(chain['fragments'])):
+                if i not in chain['fragments']:
+                    break
+                reassembled.extend(chain['fragments'][i])
+            logging.debug('Chain ' + str(key) + ' expected len is ' + str(chain['len']) + ' current len is ' + str(len(reassembled)))
+            if len(reassembled) < chain['len']:
+                return None
+            del self._chains[key]
+            self.completed += 1
+        return list(reassembled) + chain['final']
+
+    def stats(self):
+        return {
+            'in_flight': len(self._chains),
+            'completed': self.completed,
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'orphans': self.orphans,
+            'duplicates': self.duplicates,
+        }
@@ -0,0 +1,205 @@
+# -*- encoding: utf-8 -*-
+from __future__ import print_function, unicode_literals, division, absolute_import
+import os
+import math
+import random
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import enocean.utils
+from enocean.protocol.bitfield import Bitfield
+from enocean.protocol.eep import ValueField, EnumField, StatusField
+
+
+class DecoderGenerator(object):
+    '''
+    Generates a decoding function for each data description of the EEP,
+    with one shift, mask and scale statement per field instead of the generic descriptor loop.
+    The generated sources are written to directory (when given) and reused on next start.
+    Before use, every decoder is checked against the generic decoding over random payloads,
+    the generic decoding is kept when they differ.
+    '''
+    # Bump when the generated code changes
+    VERSION = 1
+    # Random payloads used to check a decoder
+    SAMPLES = 64
+    MISSING = object()
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        # EEPData -> decoding function, or None to use the generic decoding
+        self.decoders = {}
+        self._lock = threading.Lock()
+        # Statistics
+        self.generated = 0
+        self.loaded = 0
+        self.rejected = 0
+
+    def decode(self, data, bitarray, status):
+        ''' Decode with the generated function of data, generating it on first use '''
+        decoder = self.decoders.get(data, self.MISSING)
+        if decoder is self.MISSING:
+            with self._lock:
+                decoder = self.decoders.get(data, self.MISSING)
+                if decoder is self.MISSING:
+                    decoder = self.decoders[data] = self.get_decoder(data)
+        if decoder is None:
+            return data.decode(bitarray, status)
+        return decoder(bitarray, status)
+
+    def get_decoder(self, data):
+        ''' Generated (or cached) and checked decoding function of data, None if not possible '''
+        try:
+            spec = self.get_spec(data)
+            if spec is None:
+                return None
+            key = hashlib.sha1(repr((self.VERSION, spec)).encode('utf-8')).hexdigest()
+            source = self.__load_source(key)
+            if source is None:
+                source = self.get_source(spec)
+                self.generated += 1
+                self.__save_source(key, source)
+            else:
+                self.loaded += 1
+            namespace = {'OrderedDict': OrderedDict, 'FIELDS': data.fields, 'generic': data.decode}
+            exec(compile(source, '<eep decoder ' + key + '>', 'exec'), namespace)
+            decoder = namespace['decode']
+            if not self.check(data, decoder, spec):
+                self.rejected += 1
+                logging.error('Generated decoder differs from EEP for data ' + str(data.attrs) + ', using generic decoding')
+                return None
+            return decoder
+        except Exception as e:
+            logging.error('Cannot generate decoder for data ' + str(data.attrs) + ' : ' + str(e))
+            self.rejected += 1
+            return None
+
+    @staticmethod
+    def get_spec(data):
+        '''
+        Everything the generated source depends on, one tuple per field.
+        Fields which can never be decoded (a value without unit) are left out, like the generic decoding does.
+        '''
+        spec = []
+        for index, field in enumerate(data.fields):
+            if field.offset < 0:
+                # Relative to the end, not worth it
+                return None
+            common = (field.shortcut, field.description, field.unit, field.offset, field.size)
+            if isinstance(field, StatusField):
+                spec.append(('status',) + common + (None,))
+            elif isinstance(field, ValueField):
+                if field.unit is None or field.factor is None:
+                    continue
+                if all(math.isfinite(x) for x in (field.factor, field.rng_min, field.scl_min)):
+                    spec.append(('value',) + common + ((field.factor, field.rng_min, field.scl_min),))
+                else:
+                    spec.append(('field',) + common + (index,))
+            elif isinstance(field, EnumField) and field.size <= EnumField.LOOKUP_BITS:
+                # Descriptions are complete for small enums, so are the formatted values
+                values = []
+                for raw_value in range(1 << field.size):
+                    try:
+                        values.append((raw_value, field.get_value(raw_value)))
+                    except Exception:
+                        continue
+                spec.append(('enum',) + common + (tuple(values),))
+            else:
+                spec.append(('field',) + common + (index,))
+        return tuple(spec)
+
+    @staticmethod
+    def get_source(spec):
+        ''' Python source of the decode(bitarray, status) function '''
+        data_end = max([0] + [field[4] + field[5] for field in spec if field[0] != 'status'])
+        status_end = max([0] + [field[4] + field[5] for field in spec if field[0] == 'status'])
+        constants = []
+        lines = [
+            'def decode(bitarray, status):',
+            '    if bitarray.width < %d or status.width < %d:' % (data_end, status_end),
+            '        # Truncated fields, let the generic decoding handle them',
+            '        return generic(bitarray, status)',
+            '    value = bitarray.value',
+            '    width = bitarray.width',
+            '    status_value = status.value',
+            '    output = OrderedDict()',
+        ]
+        for index, field in enumerate(spec):
+            kind, shortcut, description, unit, offset, size, extra = field
+            if kind == 'status':
+                lines.append('    raw = (status_value >> (status.width - %d)) & 0x%x' % (offset + size, (1 << size) - 1))
+            else:
+                lines.append('    raw = (value >> (width - %d)) & 0x%x' % (offset + size, (1 << size) - 1))
+            head = '{%r: %r, %r: %r, %r: ' % ('description', description, 'unit', unit, 'value')
+            tail = ', %r: raw}' % 'raw_value'
+            if kind == 'status':
+                lines.append('    output[%r] = %s%s%s' % (shortcut, head, 'raw != 0', tail))
+            elif kind == 'value':
+                factor, rng_min, scl_min = extra
+                lines.append('    output[%r] = %s%r * (raw - %r) + %r%s' % (shortcut, head, factor, rng_min, scl_min, tail))
+            elif kind == 'enum':
+                constants.append('VALUES_%d = %r' % (index, dict(extra)))
+                lines.append('    text = VALUES_%d.get(raw)' % index)
+                lines.append('    if text is not None:')
+                lines.append('        output[%r] = %s%s%s' % (shortcut, head, 'text', tail))
+            else:
+                lines.append('    try:')
+                lines.append('        output[%r] = %sFIELDS[%d].get_value(raw)%s' % (shortcut, head, extra, tail))
+                lines.append('    except Exception:')
+                lines.append('        pass')
+        lines.append('    return output')
+        return '# -*- encoding: utf-8 -*-\n' + '\n'.join(constants + [''] + lines) + '\n'
+
+    def check(self, data, decoder, spec):
+        ''' Compare decoder with the generic decoding over random payloads '''
+        data_end = max([8] + [field[4] + field[5] for field in spec if field[0] != 'status'])
+        width = (data_end + 7) // 8 * 8
+        rand = random.Random(width)
+        samples = [(0, 0), ((1 << width) - 1, 0xFF)]
+        samples += [(rand.getrandbits(width), rand.getrandbits(8)) for x in range(self.SAMPLES)]
+        for payload_width in (width, width + 8):
+            for value, status in samples:
+                bitarray = Bitfield(value, payload_width)
+                if decoder(bitarray, Bitfield(status, 8)) != data.decode(bitarray, Bitfield(status, 8)):
+                    return False
+        return True
+
+    def __source_file(self, key):
+        return os.path.join(self.directory, key + '.py')
+
+    def __load_source(self, key):
+        if not self.directory:
+            return None
+        try:
+            with enocean.utils.private_open(self.__source_file(key), 'rb') as source:
+                # Only trust sources written by ourselves
+                if hasattr(os, 'getuid') and os.fstat(source.fileno()).st_uid != os.getuid():
+                    return None
+                return source.read().decode('utf-8')
+        except (IOError, OSError):
+            return None
+
+    def __save_source(self, key, source):
+        if not self.directory:
+            return
+        temp_file = self.__source_file(key) + '.' + str(os.getpid())
+        try:
+            with enocean.utils.private_open(temp_file, 'wb') as output:
+                output.write(source.encode('utf-8'))
+            os.replace(temp_file, self.__source_file(key))
+        except (IOError, OSError) as e:
+            logging.info('Cannot write generated decoder : ' + str(e))
+            try:
+                os.remove(temp_file)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            'decoders': len([decoder for decoder in self.decoders.values() if decoder is not None]),
+            'generated': self.generated,
+            'loaded': self.loaded,
+            'rejected': self.rejected,
+        }
@@ -64,6 +64,16 @@ class PARSE_RESULT(IntEnum):
     CRC_MISMATCH = 0x03
 
 
+# Classes of the transmitted frames, lowest are written first
+class TX_PRIORITY(IntEnum):
+    # Answers to devices, which only listen for a short time (teach-in, valves)
+    RESPONSE = 0
+    # Commands from Jeedom
+    INTERACTIVE = 1
+    # Requests nobody waits for
+    BACKGROUND = 2
+
+
 # Data byte indexing
 # Starts from the end, so works on messages of all length.
 class DB0(object):
@@ -0,0 +1,74 @@
+# -*- encoding: utf-8 -*-
+from __future__ import print_function, unicode_literals, division, absolute_import
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+class DuplicateFilter(object):
+    '''
+    Suppression of the copies of a radio telegram received through repeaters.
+    Copies only differ by the repeater count (low nibble of the status) and the dBm,
+    and directly follow the original: a telegram is a copy when it has the same data
+    as the last telegram of the same sender, received within window seconds.
+    The last telegram of at most max_entries senders is remembered.
+    '''
+    # Results of check
+    NEW = 0
+    COPY = 1
+    BETTER_COPY = 2
+
+    def __init__(self, window=0.5, max_entries=256):
+        self.window = window
+        self.max_entries = max_entries
+        # sender -> [time, data, best dBm, copies] of its last telegram, oldest first
+        self._last = OrderedDict()
+        self._lock = threading.Lock()
+        # Statistics
+        self.passed = 0
+        self.suppressed = 0
+
+    def __len__(self):
+        return len(self._last)
+
+    def _expire(self, now):
+        while self._last:
+            last = next(iter(self._last.values()))
+            if now - last[0] < self.window and len(self._last) < self.max_entries:
+                return
+            self._last.popitem(last=False)
+
+    def check(self, sender, data, dBm=0, now=None):
+        '''
+        NEW if data (Packet.data of a radio telegram) from sender must be decoded,
+        COPY if it is a copy of the last telegram of sender,
+        BETTER_COPY if it is a copy received with a better dBm than the previous ones.
+        '''
+        if self.window <= 0:
+            return self.NEW
+        if now is None:
+            now = time.time()
+        key = (bytes(bytearray(data[:-1])), data[-1] & 0xF0)
+        with self._lock:
+            last = self._last.pop(sender, None)
+            self._expire(now)
+            if last is None or last[1] != key or now - last[0] >= self.window:
+                self._last[sender] = [now, key, dBm, 1]
+                self.passed += 1
+                return self.NEW
+            self._last[sender] = last
+            last[3] += 1
+            self.suppressed += 1
+            better = dBm > last[2]
+            if better:
+                last[2] = dBm
+        logging.debug('Copy ' + str(last[3]) + ' of the telegram, ignoring (best dBm is ' + str(last[2]) + ')')
+        return self.BETTER_COPY if better else self.COPY
+
+    def stats(self):
+        return {
+            'entries': len(self._last),
+            'passed': self.passed,
+            'suppressed': self.suppressed,
+        }
@@ -1,7 +1,12 @@
 # -*- encoding: utf-8 -*-
 from __future__ import print_function, unicode_literals, division, absolute_import
 import os
+import re
+import bisect
+import hashlib
 import logging
+import pickle
+import threading
 from collections import OrderedDict
 from bs4 import BeautifulSoup
 
@@ -9,12 +14,272 @@ import enocean.utils
 from enocean.protocol.constants import RORG
 
 
+class EEPField(object):
+    '''
+    Data description compiled from the XML: a <value>, <enum> or <status> tag.
+    Everything needed to decode or encode the field is parsed once, at load time.
+    '''
+    __slots__ = ('shortcut', 'description', 'unit', 'offset', 'size')
+
+    def __init__(self, source):
+        self.shortcut = source['shortcut']
+        self.description = source.get('description')
+        self.unit = source.get('unit', '')
+        self.offset = int(source['offset'])
+        self.size = int(source['size'])
+
+    def decode(self, bitarray, status):
+        raw_value = bitarray.get(self.offset, self.size)
+        return {
+            'description': self.description,
+            'unit': self.unit,
+            'value': self.get_value(raw_value),
+            'raw_value': raw_value,
+        }
+
+    def get_value(self, raw_value):
+        return raw_value
+
+    def encode(self, value, bitarray, status):
+        ''' Store value in bitarray or status, returns both of them '''
+        return bitarray.set(self.offset, self.size, self.get_raw(value)), status
+
+    def get_raw(self, value):
+        return value
+
+
+class ValueField(EEPField):
+    ''' Scaled numeric value '''
+    __slots__ = ('rng_min', 'rng_max', 'scl_min', 'scl_max', 'factor')
+
+    def __init__(self, source):
+        super(ValueField, self).__init__(source)
+        # Unit is mandatory when decoding values
+        self.unit = source.get('unit')
+        rng = source.find('range')
+        self.rng_min = float(rng.find('min').text)
+        self.rng_max = float(rng.find('max').text)
+        scl = source.find('scale')
+        self.scl_min = float(scl.find('min').text)
+        self.scl_max = float(scl.find('max').text)
+        try:
+            self.factor = (self.scl_max - self.scl_min) / (self.rng_max - self.rng_min)
+        except ZeroDivisionError:
+            self.factor = None
+
+    def get_value(self, raw_value):
+        if self.unit is None or self.factor is None:
+            raise ValueError('Cannot decode value %s' % self.shortcut)
+        return self.factor * (raw_value - self.rng_min) + self.scl_min
+
+    def get_raw(self, value):
+        return int((value - self.scl_min) * (self.rng_max - self.rng_min) / (self.scl_max - self.scl_min) + self.rng_min)
+
+
+class EnumField(EEPField):
+    '''
+    Enumeration, with <item> and <rangeitem> descriptions.
+    Items take precedence over rangeitems, and the first matching rangeitem wins.
+    The rangeitems are flattened to sorted, disjoint intervals searched by bisection,
+    and for fields up to LOOKUP_BITS wide every raw value is resolved at load time.
+    '''
+    __slots__ = ('items', 'lookup', 'starts', 'ends', 'descriptions', 'raw_values')
+    LOOKUP_BITS = 8
+
+    def __init__(self, source):
+        super(EnumField, self).__init__(source)
+        # raw value -> description, description -> raw value
+        self.items = {}
+        self.raw_values = {}
+        for item in source.find_all('item'):
+            value = item.get('value')
+            description = item.get('description')
+            try:
+                raw_value = int(value)
+            except (TypeError, ValueError):
+                continue
+            if str(raw_value) == value:
+                self.items.setdefault(raw_value, description)
+            if description is not None:
+                self.raw_values.setdefault(description, raw_value)
+        # (start, end, description), in document order
+        rangeitems = []
+        for rangeitem in source.find_all('rangeitem'):
+            try:
+                rangeitems.append((int(rangeitem.get('start', -1)), int(rangeitem.get('end', -1)), rangeitem.get('description')))
+            except ValueError:
+                continue
+        self.__index_rangeitems(rangeitems)
+        self.lookup = self.items
+        if self.size <= self.LOOKUP_BITS:
+            self.lookup = {}
+            for raw_value in range(1 << self.size):
+                try:
+                    self.lookup[raw_value] = self.get_description(raw_value)
+                except KeyError:
+                    continue
+
+    def __index_rangeitems(self, rangeitems):
+        ''' Split the rangeitems at their bounds, keeping the first rangeitem covering each part '''
+        self.starts = []
+        self.ends = []
+        self.descriptions = []
+        bounds = sorted(set([start for start, end, description in rangeitems] + [end + 1 for start, end, description in rangeitems]))
+        for start, next_start in zip(bounds, bounds[1:]):
+            end = next_start - 1
+            for item_start, item_end, description in rangeitems:
+                if item_start <= start and end <= item_end:
+                    break
+            else:
+                continue
+            if self.ends and self.ends[-1] == start - 1 and self.descriptions[-1] == description:
+                # Merge with previous part of the same rangeitem
+                self.ends[-1] = end
+                continue
+            self.starts.append(start)
+            self.ends.append(end)
+            self.descriptions.append(description)
+
+    def _get_rangeitem(self, raw_value):
+        index = bisect.bisect_right(self.starts, raw_value) - 1
+        if index >= 0 and raw_value <= self.ends[index]:
+            return self.descriptions[index]
+        raise KeyError(raw_value)
+
+    def get_description(self, raw_value):
+        if raw_value in self.lookup:
+            return self.lookup[raw_value]
+        if raw_value in self.items:
+            return self.items[raw_value]
+        return self._get_rangeitem(raw_value)
+
+    def get_value(self, raw_value):
+        return self.get_description(raw_value).format(value=raw_value)
+
+    def get_raw(self, value):
+        ''' Raw value from enum value (by string or integer value) '''
+        if isinstance(value, int):
+            # check whether this value exists
+            try:
+                self.get_description(value)
+            except KeyError:
+                raise ValueError('Enum value "%s" not found in EEP.' % (value))
+            # set integer values directly
+            return value
+        if value not in self.raw_values:
+            raise ValueError('Enum description for value "%s" not found in EEP.' % (value))
+        return self.raw_values[value]
+
+
+class StatusField(EEPField):
+    ''' Boolean, read from the status byte '''
+    __slots__ = ()
+
+    def decode(self, bitarray, status):
+        return super(StatusField, self).decode(status, None)
+
+    def get_value(self, raw_value):
+        return True if raw_value else False
+
+    def encode(self, value, bitarray, status):
+        status[self.offset] = value
+        return bitarray, status
+
+
+class EEPData(object):
+    ''' Compiled <data> of a profile: its attributes and fields, in document order '''
+    FIELDS = {'value': ValueField, 'enum': EnumField, 'status': StatusField}
+
+    def __init__(self, source):
+        self.attrs = dict(source.attrs)
+        self.fields = []
+        self.by_shortcut = {}
+        for child in source.children:
+            if child.name not in self.FIELDS:
+                continue
+            try:
+                field = self.FIELDS[child.name](child)
+            except Exception as e:
+                logging.debug('Ignoring data description ' + str(child.get('shortcut')) + ' : ' + str(e))
+                continue
+            self.fields.append(field)
+            self.by_shortcut.setdefault(field.shortcut, field)
+
+    def decode(self, bitarray, status):
+        ''' Values of the fields, skipping the ones that cannot be decoded '''
+        output = OrderedDict({})
+        for field in self.fields:
+            try:
+                output[field.shortcut] = field.decode(bitarray, status)
+            except Exception:
+                continue
+        return output
+
+    def encode(self, properties, bitarray, status):
+        ''' Store the properties in bitarray and status, returns both of them '''
+        for shortcut, value in properties.items():
+            field = self.by_shortcut.get(shortcut)
+            if field is None:
+                # TODO: Should we raise an error?
+                logging.debug('Cannot find data description for shortcut %s', shortcut)
+                continue
+            bitarray, status = field.encode(value, bitarray, status)
+        return bitarray, status
+
+    def get(self, key, default=None):
+        return self.attrs.get(key, default)
+
+    def __getitem__(self, key):
+        return self.attrs[key]
+
+
+class EEPProfile(object):
+    ''' Compiled <profile>: the data descriptions, and whether it defines commands '''
+
+    def __init__(self, source):
+        self.attrs = dict(source.attrs)
+        self.has_command = source.find('command', recursive=False) is not None
+        self.datas = [EEPData(data) for data in source.find_all('data', recursive=False)]
+
+    def find_data(self, key=None, value=None):
+        ''' First data description, optionally having attribute key set to value '''
+        for data in self.datas:
+            if key is None or data.attrs.get(key) == str(value):
+                return data
+        return None
+
+
 class EEP(object):
+    '''
+    Profiles of the EEP XML files, compiled to descriptors.
+    With a cache_file, the compiled profiles are pickled there and reused on next start,
+    as long as the XML files are unchanged.
+    In lazy mode, only an index of the profiles defined by each file is built,
+    and a profile is compiled the first time it is needed (see load_profile).
+    '''
+    # Bump when the compiled classes change
+    CACHE_VERSION = 2
+    # Opening tags used to index the files without parsing them
+    INDEX_TAG = re.compile(r'<(telegram|profiles|profile)\b([^>]*)>')
+    INDEX_ATTR = re.compile(r'([\w-]+)="([^"]*)"')
 
-    def __init__(self):
+    def __init__(self, cache_file=None, lazy=False, memo_size=256, codegen=False, codegen_dir=None):
         self.num_profiles = 0
         self.init_ok = False
         self.telegrams = {}
+        # (rorg, func, type, direction, command) -> data description found
+        self.memo = enocean.utils.LRUCache(memo_size)
+        # Generated decoding functions, if enabled
+        self.generator = None
+        if codegen:
+            from enocean.protocol.codegen import DecoderGenerator
+            self.generator = DecoderGenerator(codegen_dir)
+        self.cache_file = cache_file
+        self.from_cache = False
+        self.lazy = lazy
+        # (rorg, func, type) -> defining file, in lazy mode
+        self.index = {}
+        self._lock = threading.Lock()
         directory = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'eep')
         file_array = []
         for root, dirs, files in os.walk(directory):
@@ -22,14 +287,26 @@ class EEP(object):
                 if (file.endswith('.xml')):
                     file_array.append(os.path.join(root,file))
         try:
+            if lazy:
+                for file in file_array:
+                    self.__index_xml(file)
+                    self.num_profiles += 1
+                self.init_ok = True
+                logging.info('Successfully indexed ' + str(len(self.index)) + ' profiles in ' + str(self.num_profiles) + ' files !')
+                return
+            cache_key = self.__cache_key(directory, file_array) if cache_file else None
+            if cache_key and self.__load_cache(cache_key):
+                logging.info('Successfully loaded ' + str(self.num_profiles) + ' profiles from cache !')
+                return
             for file in file_array:
                 logging.info('Loading profile file : ' + str(os.path.basename(file)))
-                with open(file, 'r') as xml_file:
-                    self.soup = BeautifulSoup(xml_file.read(), "html.parser")
+                soup = self.__read_xml(file)
                 self.init_ok = True
-                self.__load_xml()
+                self.__load_xml(soup)
                 self.num_profiles += 1
             logging.info('Successfully loaded ' + str(self.num_profiles) + ' profiles !')
+            if cache_key and self.init_ok:
+                self.__save_cache(cache_key)
         except IOError:
             # Impossible to test with the current structure?
             # To be honest, as the XML is included with the library,
@@ -37,130 +314,98 @@ class EEP(object):
             logging.error('Cannot load protocol file!')
             self.init_ok = False
 
-    def __load_xml(self):
-        for telegram in self.soup.find_all('telegram'):
+    @staticmethod
+    def __read_xml(file):
+        with open(file, 'r') as xml_file:
+            return BeautifulSoup(xml_file.read(), "html.parser")
+
+    def __index_xml(self, file):
+        ''' Record the RORG-FUNC-TYPE defined by the file, the first definition wins '''
+        with open(file, 'r') as xml_file:
+            content = xml_file.read()
+        rorg = func = None
+        for tag in self.INDEX_TAG.finditer(content):
+            attrs = dict(self.INDEX_ATTR.findall(tag.group(2)))
+            if tag.group(1) == 'telegram':
+                rorg = enocean.utils.from_hex_string(attrs['rorg'])
+            elif tag.group(1) == 'profiles':
+                func = enocean.utils.from_hex_string(attrs['func'])
+            else:
+                self.index.setdefault((rorg, func, enocean.utils.from_hex_string(attrs['type'])), file)
+
+    def load_profile(self, eep_rorg, rorg_func, rorg_type):
+        ''' Compiled profile for RORG-FUNC-TYPE, compiling it first in lazy mode (None if unknown) '''
+        try:
+            return self.telegrams[eep_rorg][rorg_func][rorg_type]
+        except KeyError:
+            pass
+        file = self.index.get((eep_rorg, rorg_func, rorg_type))
+        if file is None:
+            return None
+        with self._lock:
+            logging.info('Loading profile file : ' + str(os.path.basename(file)))
+            self.__load_xml(self.__read_xml(file), file)
+        return self.telegrams.get(eep_rorg, {}).get(rorg_func, {}).get(rorg_type)
+
+    def __load_xml(self, soup, file=None):
+        ''' Compile the profiles of the XML, the first definition of a RORG-FUNC-TYPE wins '''
+        for telegram in soup.find_all('telegram'):
             for function in telegram.find_all('profiles'):
                 for type in function.find_all('profile'):
                     rorg = enocean.utils.from_hex_string(telegram['rorg'])
                     func = enocean.utils.from_hex_string(function['func'])
                     typeidx = enocean.utils.from_hex_string(type['type'])
-                    if rorg in self.telegrams :
-                        if func in self.telegrams[rorg]:
-                            if typeidx in self.telegrams[rorg][func]:
-                                continue
-                            else:
-                                self.telegrams[rorg][func].update({typeidx : type})
-                        else:
-                            self.telegrams[rorg].update({func : {typeidx : type}})
-                    else:
-                        self.telegrams.update({rorg : {func : {typeidx : type}}})
-
-    @staticmethod
-    def _get_raw(source, bitarray):
-        ''' Get raw data as integer, based on offset and size '''
-        offset = int(source['offset'])
-        size = int(source['size'])
-        return int(''.join(['1' if digit else '0' for digit in bitarray[offset:offset + size]]), 2)
-
-    @staticmethod
-    def _set_raw(target, raw_value, bitarray):
-        ''' put value into bit array '''
-        offset = int(target['offset'])
-        size = int(target['size'])
-        for digit in range(size):
-            bitarray[offset+digit] = (raw_value >> (size-digit-1)) & 0x01 != 0
-        return bitarray
-
-    @staticmethod
-    def _get_rangeitem(source, raw_value):
-        for rangeitem in source.find_all('rangeitem'):
-            if raw_value in range(int(rangeitem.get('start', -1)), int(rangeitem.get('end', -1)) + 1):
-                return rangeitem
-
-    def _get_value(self, source, bitarray):
-        ''' Get value, based on the data in XML '''
-        raw_value = self._get_raw(source, bitarray)
-
-        rng = source.find('range')
-        rng_min = float(rng.find('min').text)
-        rng_max = float(rng.find('max').text)
-
-        scl = source.find('scale')
-        scl_min = float(scl.find('min').text)
-        scl_max = float(scl.find('max').text)
-
-        return {
-            source['shortcut']: {
-                'description': source.get('description'),
-                'unit': source['unit'],
-                'value': (scl_max - scl_min) / (rng_max - rng_min) * (raw_value - rng_min) + scl_min,
-                'raw_value': raw_value,
-            }
-        }
-
-    def _get_enum(self, source, bitarray):
-        ''' Get enum value, based on the data in XML '''
-        raw_value = self._get_raw(source, bitarray)
-
-        # Find value description.
-        value_desc = source.find('item', {'value': str(raw_value)}) or self._get_rangeitem(source, raw_value)
-
-        return {
-            source['shortcut']: {
-                'description': source.get('description'),
-                'unit': source.get('unit', ''),
-                'value': value_desc['description'].format(value=raw_value),
-                'raw_value': raw_value,
-            }
-        }
+                    types = self.telegrams.setdefault(rorg, {}).setdefault(func, {})
+                    if typeidx in types:
+                        continue
+                    if self.lazy and self.index.get((rorg, func, typeidx)) != file:
+                        # Defined first by another file
+                        continue
+                    types[typeidx] = EEPProfile(type)
 
-    def _get_boolean(self, source, bitarray):
-        ''' Get boolean value, based on the data in XML '''
-        raw_value = self._get_raw(source, bitarray)
-        return {
-            source['shortcut']: {
-                'description': source.get('description'),
-                'unit': source.get('unit', ''),
-                'value': True if raw_value else False,
-                'raw_value': raw_value,
-            }
-        }
+    def __cache_key(self, directory, file_array):
+        ''' Hash of the XML files, in loading order, with their mtimes and contents '''
+        digest = hashlib.sha1(str(self.CACHE_VERSION).encode('utf-8'))
+        for file in file_array:
+            digest.update(os.path.relpath(file, directory).encode('utf-8'))
+            digest.update(str(os.path.getmtime(file)).encode('utf-8'))
+            with open(file, 'rb') as xml_file:
+                digest.update(xml_file.read())
+        return digest.hexdigest()
 
-    def _set_value(self, target, value, bitarray):
-        ''' set given numeric value to target field in bitarray '''
-        # derive raw value
-        rng = target.find('range')
-        rng_min = float(rng.find('min').text)
-        rng_max = float(rng.find('max').text)
-        scl = target.find('scale')
-        scl_min = float(scl.find('min').text)
-        scl_max = float(scl.find('max').text)
-        raw_value = (value - scl_min) * (rng_max - rng_min) / (scl_max - scl_min) + rng_min
-        # store value in bitfield
-        return self._set_raw(target, int(raw_value), bitarray)
-
-    def _set_enum(self, target, value, bitarray):
-        ''' set given enum value (by string or integer value) to target field in bitarray '''
-        # derive raw value
-        if isinstance(value, int):
-            # check whether this value exists
-            if target.find('item', {'value': value}) or self._get_rangeitem(target, value):
-                # set integer values directly
-                raw_value = value
-            else:
-                raise ValueError('Enum value "%s" not found in EEP.' % (value))
-        else:
-            value_item = target.find('item', {'description': value})
-            if value_item is None:
-                raise ValueError('Enum description for value "%s" not found in EEP.' % (value))
-            raw_value = int(value_item['value'])
-        return self._set_raw(target, raw_value, bitarray)
+    def __load_cache(self, cache_key):
+        try:
+            with enocean.utils.private_open(self.cache_file, 'rb') as cache:
+                # Only trust a cache written by ourselves
+                if hasattr(os, 'getuid') and os.fstat(cache.fileno()).st_uid != os.getuid():
+                    logging.debug('Ignoring EEP cache not owned by current user')
+                    return False
+                key, num_profiles, telegrams = pickle.load(cache)
+        except Exception as e:
+            logging.debug('Cannot read EEP cache : ' + str(e))
+            return False
+        if key != cache_key:
+            logging.debug('EEP cache is outdated, rebuilding')
+            return False
+        self.num_profiles = num_profiles
+        self.telegrams = telegrams
+        self.init_ok = True
+        self.from_cache = True
+        return True
 
-    @staticmethod
-    def _set_boolean(target, data, bitarray):
-        ''' set given value to target bit in bitarray '''
-        bitarray[int(target['offset'])] = data
-        return bitarray
+    def __save_cache(self, cache_key):
+        # Write to a temporary file and rename, so a concurrent start never reads a partial cache
+        temp_file = self.cache_file + '.' + str(os.getpid())
+        try:
+            with enocean.utils.private_open(temp_file, 'wb') as cache:
+                pickle.dump((cache_key, self.num_profiles, self.telegrams), cache, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_file, self.cache_file)
+        except Exception as e:
+            logging.info('Cannot write EEP cache : ' + str(e))
+            try:
+                os.remove(temp_file)
+            except OSError:
+                pass
 
     def find_profile(self, bitarray, eep_rorg, rorg_func, rorg_type, direction=None, command=None):
         ''' Find profile and data description, matching RORG, FUNC and TYPE '''
@@ -168,80 +413,47 @@ class EEP(object):
             logging.error('EEP.xml not loaded!')
             return None
 
-        if eep_rorg not in self.telegrams.keys():
-            logging.debug('Cannot find rorg in EEP!')
-            return None
+        key = (eep_rorg, rorg_func, rorg_type, direction, command)
+        data = self.memo.get(key)
+        if data is self.memo.MISSING:
+            data = self.__find_profile(eep_rorg, rorg_func, rorg_type, direction, command)
+            self.memo.put(key, data)
+        return data
 
-        if rorg_func not in self.telegrams[eep_rorg].keys():
-            logging.debug('Cannot find func in EEP!')
+    def __find_profile(self, eep_rorg, rorg_func, rorg_type, direction, command):
+        profile = self.load_profile(eep_rorg, rorg_func, rorg_type)
+        if profile is None:
+            logging.debug('Cannot find rorg/func/type in EEP!')
             return None
 
-        if rorg_type not in self.telegrams[eep_rorg][rorg_func].keys():
-            logging.debug('Cannot find type in EEP!')
-            return None
-
-        profile = self.telegrams[eep_rorg][rorg_func][rorg_type]
-
         if (eep_rorg == RORG.VLD or eep_rorg == RORG.MSC) or not command is None:
             # For VLD; multiple commands can be defined, with the command id always in same location (per RORG-FUNC-TYPE).
-            eep_command = profile.find('command', recursive=False)
             # If commands are not set in EEP, or command is None,
             # get the first data as a "best guess".
-            if not eep_command or command is None:
-                return profile.find('data', recursive=False)
+            if not profile.has_command or command is None:
+                return profile.find_data()
 
             # If eep_command is defined, so should be data.command
-            return profile.find('data', {'command': str(command)}, recursive=False)
+            return profile.find_data('command', command)
 
         # extract data description
         # the direction tag is optional
         if direction is None:
-            return profile.find('data', recursive=False)
-        return profile.find('data', {'direction': direction}, recursive=False)
+            return profile.find_data()
+        return profile.find_data('direction', direction)
 
     def get_values(self, profile, bitarray, status):
         ''' Get keys and values from bitarray '''
         if not self.init_ok or profile is None:
             return [], {}
-        output = OrderedDict({})
-        for source in profile.contents:
-            if not source.name:
-                continue
-            if source.name == 'value':
-                try:
-                    output.update(self._get_value(source, bitarray))
-                except:
-                    continue
-            if source.name == 'enum':
-                try:
-                    output.update(self._get_enum(source, bitarray))
-                except:
-                    continue
-            if source.name == 'status':
-                try:
-                    output.update(self._get_boolean(source, status))
-                except:
-                    continue
+        if self.generator is not None:
+            output = self.generator.decode(profile, bitarray, status)
+        else:
+            output = profile.decode(bitarray, status)
         return output.keys(), output
 
     def set_values(self, profile, data, status, properties):
         ''' Update data based on data contained in properties '''
         if not self.init_ok or profile is None:
             return data, status
-
-        for shortcut, value in properties.items():
-            # find the given property from EEP
-            target = profile.find(shortcut=shortcut)
-            if not target:
-                # TODO: Should we raise an error?
-                logging.debug('Cannot find data description for shortcut %s', shortcut)
-                continue
-
-            # update bit_data
-            if target.name == 'value':
-                data = self._set_value(target, value, data)
-            if target.name == 'enum':
-                data = self._set_enum(target, value, data)
-            if target.name == 'status':
-                status = self._set_boolean(target, value, status)
-        return data, status
+        return profile.encode(properties, data, status)
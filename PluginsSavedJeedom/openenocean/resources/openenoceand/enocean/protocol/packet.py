@@ -5,8 +5,9 @@ from collections import OrderedDict
 
 import enocean.utils
 from enocean.protocol import crc8
+from enocean.protocol.bitfield import Bitfield
 from enocean.protocol.eep import EEP
-from enocean.protocol.constants import PACKET, RORG, PARSE_RESULT, DB0,DB1, DB2, DB3, DB4, DB6
+from enocean.protocol.constants import PACKET, RORG, PARSE_RESULT, TX_PRIORITY, DB0,DB1, DB2, DB3, DB4, DB6
 import globals
 
 class Packet(object):
@@ -16,7 +17,11 @@ class Packet(object):
     Packet.parse_msg(buf) for parsing message.
     parse_msg() returns subclass, if one is defined for the data type.
     '''
-    eep = EEP()
+    eep = EEP(cache_file=globals.EEP_CACHE_FILE, lazy=globals.EEP_LAZY, memo_size=globals.EEP_MEMO_SIZE,
+              codegen=globals.EEP_CODEGEN, codegen_dir=globals.EEP_CODEGEN_DIR)
+    # Usage of the cached bit views, for debugging purposes
+    bit_cache_hits = 0
+    bit_cache_misses = 0
 
     def __init__(self, packet_type, data=None, optional=None):
         self.packet_type = packet_type
@@ -53,6 +58,36 @@ class Packet(object):
     def __eq__(self, other):
         return self.packet_type == other.packet_type and self.rorg == other.rorg and self.data == other.data and self.optional == other.optional
 
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        # Bit view is rebuilt on next access.
+        # Modifying the list in place doesn't invalidate it, assign the list again instead.
+        self._data = value
+        self._bit_data_cache = None
+
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        self._status = value
+        self._bit_status_cache = None
+
+    @classmethod
+    def bit_cache_stats(cls):
+        ''' Hit rate of the cached bit views '''
+        total = cls.bit_cache_hits + cls.bit_cache_misses
+        return {
+            'hits': cls.bit_cache_hits,
+            'misses': cls.bit_cache_misses,
+            'hit_rate': round(cls.bit_cache_hits / total, 3) if total else 0,
+        }
+
     @property
     def _bit_data(self):
         # First and last 5 bits are always defined, so the data we're modifying is between them...
@@ -60,13 +95,19 @@ class Packet(object):
         # Needs the redefinition of Packet.data -> Packet.message.
         # Packet.data would then only have the actual, documented data-bytes. Packet.message would contain the whole message.
         # See discussion in issue #14
-        return enocean.utils.to_bitarray(self.data[1:len(self.data) - 5], (len(self.data) - 6) * 8)
+        # The view is cached and shared, changes must be written back through the setter.
+        if self._bit_data_cache is None:
+            Packet.bit_cache_misses += 1
+            self._bit_data_cache = Bitfield.from_bytes(self._data[1:len(self._data) - 5])
+        else:
+            Packet.bit_cache_hits += 1
+        return self._bit_data_cache
 
     @_bit_data.setter
     def _bit_data(self, value):
         # The same as getting the data, first and last 5 bits are ommitted, as they are defined...
-        for byte in range(len(self.data) - 6):
-            self.data[byte+1] = enocean.utils.from_bitarray(value[byte*8:(byte+1)*8])
+        self._data[1:len(self._data) - 5] = value.to_bytes()
+        self._bit_data_cache = value
 
     # # COMMENTED OUT, AS NOTHING TOUCHES _bit_optional FOR NOW.
     # # Thus, this is also untested.
@@ -84,11 +125,14 @@ class Packet(object):
 
     @property
     def _bit_status(self):
-        return enocean.utils.to_bitarray(self.status)
+        if self._bit_status_cache is None:
+            self._bit_status_cache = Bitfield(self._status, 8)
+        return self._bit_status_cache
 
     @_bit_status.setter
     def _bit_status(self, value):
-        self.status = enocean.utils.from_bitarray(value)
+        self.status = value.value
+        self._bit_status_cache = value
 
     @staticmethod
     def parse_msg(buf, communicator=None):
@@ -99,63 +143,81 @@ class Packet(object):
             - remaining buffer
             - Packet -object (if message was valid, else None)
         '''
-        # If the buffer doesn't contain 0x55 (start char)
-        # the message isn't needed -> ignore
-        if 0x55 not in buf:
-            return PARSE_RESULT.INCOMPLETE, [], None
-
-        # Valid buffer starts from 0x55
-        # Convert to list, as index -method isn't defined for bytearray
-        buf = [ord(x) if not isinstance(x, int) else x for x in buf[list(buf).index(0x55):]]
-        try:
-            data_len = (buf[1] << 8) | buf[2]
-            opt_len = buf[3]
-        except IndexError:
-            # If the fields don't exist, message is incomplete
-            return PARSE_RESULT.INCOMPLETE, buf, None
-
-        # Header: 6 bytes, data, optional data and data checksum
-        msg_len = 6 + data_len + opt_len + 1
-        if len(buf) < msg_len:
-            # If buffer isn't long enough, the message is incomplete
-            return PARSE_RESULT.INCOMPLETE, buf, None
-
-        msg = buf[0:msg_len]
-        buf = buf[msg_len:]
-        logging.debug(msg)
-        packet_type = msg[4]
-        data = msg[6:6 + data_len]
-        opt_data = msg[6 + data_len:6 + data_len + opt_len]
-
-        # Check CRCs for header and data
-        if msg[5] != crc8.calc(msg[1:5]):
-            # Fail if doesn't match message
-            logging.error('Header CRC error!')
-            # Return CRC_MISMATCH
-            return PARSE_RESULT.CRC_MISMATCH, buf, None
-        if msg[6 + data_len + opt_len] != crc8.calc(msg[6:6 + data_len + opt_len]):
-            # Fail if doesn't match message
-            logging.error('Data CRC error!')
-            # Return CRC_MISMATCH
-            return PARSE_RESULT.CRC_MISMATCH, buf, None
+        buf = bytearray(buf)
+        status, offset, packet = Packet.scan_msg(buf, communicator=communicator)
+        return status, list(buf[offset:]), packet
+
+    @staticmethod
+    def scan_msg(buf, offset=0, end=None, communicator=None):
+        '''
+        Scans a bytearray for the next message, between offset and end.
+        Nothing is copied or removed from the buffer, so the caller can loop over
+        a whole read and drop the consumed bytes once at the end.
+        returns:
+            - PARSE_RESULT
+            - offset of the first byte not consumed
+            - Packet -object (if message was valid, else None)
+        '''
+        if end is None:
+            end = len(buf)
+        # Valid message starts from 0x55 (start char),
+        # everything before it isn't needed -> ignore
+        start = buf.find(0x55, offset, end)
+        if start == -1:
+            return PARSE_RESULT.INCOMPLETE, end, None
+
+        # Header: sync byte, 4 bytes and header checksum
+        if end - start < 6:
+            return PARSE_RESULT.INCOMPLETE, start, None
+
+        with memoryview(buf) as view:
+            # Check header CRC as soon as the header is there, so a false sync byte
+            # doesn't make us wait for a message that will never come.
+            if buf[start + 5] != crc8.calc(view[start + 1:start + 5]):
+                logging.error('Header CRC error!')
+                # Resynchronize on the next start char
+                return PARSE_RESULT.CRC_MISMATCH, start + 1, None
+
+            data_len = (buf[start + 1] << 8) | buf[start + 2]
+            opt_len = buf[start + 3]
+            packet_type = buf[start + 4]
+
+            # Header: 6 bytes, data, optional data and data checksum
+            msg_len = 6 + data_len + opt_len + 1
+            if end - start < msg_len:
+                # If buffer isn't long enough, the message is incomplete
+                return PARSE_RESULT.INCOMPLETE, start, None
+
+            data_start = start + 6
+            opt_start = data_start + data_len
+            crc_pos = opt_start + opt_len
+            if buf[crc_pos] != crc8.calc(view[data_start:crc_pos]):
+                logging.error('Data CRC error!')
+                return PARSE_RESULT.CRC_MISMATCH, start + msg_len, None
+
+            data = list(view[data_start:opt_start])
+            opt_data = list(view[opt_start:crc_pos])
 
         # If we got this far, everything went ok (?)
+        return PARSE_RESULT.OK, start + msg_len, Packet.from_frame(packet_type, data, opt_data, communicator)
+
+    @staticmethod
+    def from_frame(packet_type, data, opt_data, communicator=None):
+        ''' Creates the Packet subclass for the packet type, from its data and optional data '''
         if packet_type == PACKET.RADIO:
             # Need to handle UTE Teach-in here, as it's a separate packet type...
             if data[0] == RORG.UTE:
                 packet = UTETeachIn(packet_type, data, opt_data, communicator=communicator)
                 packet.send_response()
-            else:
-                packet = RadioPacket(packet_type, data, opt_data)
-        elif packet_type == PACKET.RESPONSE:
-            packet = ResponsePacket(packet_type, data, opt_data)
-        elif packet_type == PACKET.EVENT:
-            packet = EventPacket(packet_type, data, opt_data)
-        elif packet_type == PACKET.REMOTE_MAN_COMMAND:
-            packet = RemoteCoPacket(packet_type, data, opt_data)
-        else:
-            packet = Packet(packet_type, data, opt_data)
-        return PARSE_RESULT.OK, buf, packet
+                return packet
+            return RadioPacket(packet_type, data, opt_data)
+        if packet_type == PACKET.RESPONSE:
+            return ResponsePacket(packet_type, data, opt_data)
+        if packet_type == PACKET.EVENT:
+            return EventPacket(packet_type, data, opt_data)
+        if packet_type == PACKET.REMOTE_MAN_COMMAND:
+            return RemoteCoPacket(packet_type, data, opt_data)
+        return Packet(packet_type, data, opt_data)
 
     @staticmethod
     def create(packet_type, rorg, rorg_func, rorg_type, direction=None, command=None,
@@ -201,44 +263,50 @@ class Packet(object):
         if not isinstance(sender, list) or len(sender) != 4:
             raise ValueError('Sender must a list containing 4 (numeric) values.')
 
-        packet = Packet(packet_type,data=[], optional=[])
-        packet.rorg = rorg
-        packet.data = [packet.rorg]
         # Select EEP at this point, so we know how many bits we're dealing with (for VLD).
-        packet.select_eep(rorg_func, rorg_type, direction, command)
+        profile = Packet.eep.find_profile(None, Packet._eep_rorg(rorg, None), rorg_func, rorg_type, direction, command)
 
         # Initialize data depending on the profile.
         if rorg in [RORG.RPS, RORG.BS1]:
-            packet.data.extend([0])
+            payload_size = 1
         elif rorg == RORG.BS4:
-            packet.data.extend([0, 0, 0, 0])
+            payload_size = 4
         else:
-            packet.data.extend([0] * int(packet._profile.get('bits', '1')))
-        packet.data.extend(sender)
-        packet.data.extend([0])
-        # Always use sub-telegram 3, maximum dbm (as per spec, when sending),
-        # and no security (security not supported as per EnOcean Serial Protocol).
-        packet.optional = [3] + destination + [0xFF] + [0]
+            payload_size = int(profile.get('bits', '1'))
 
         if command:
             # Set CMD to command, if applicable.. Helps with VLD.
             kwargs['CMD'] = command
 
-        packet.set_eep(kwargs)
+        # Encode the values straight into the payload
+        bit_data, bit_status = Packet.eep.set_values(profile, Bitfield(0, payload_size * 8), Bitfield(0, 8), kwargs)
+        data = [rorg] + bit_data.to_bytes() + sender + [bit_status.value]
         if rorg in [RORG.BS1, RORG.BS4] and not learn:
             if rorg == RORG.BS1:
-                packet.data[1] |= (1 << 3)
+                data[1] |= (1 << 3)
             if rorg == RORG.BS4:
-                packet.data[4] |= (1 << 3)
-        packet.data[-1] = packet.status
+                data[4] |= (1 << 3)
+        # Always use sub-telegram 3, maximum dbm (as per spec, when sending),
+        # and no security (security not supported as per EnOcean Serial Protocol).
+        optional = [3] + destination + [0xFF] + [0]
 
-        # Parse the built packet, so it corresponds to the received packages
-        # For example, stuff like RadioPacket.learn should be set.
-        packet = Packet.parse_msg(packet.build())[2]
+        # Create the packet as it would be received,
+        # so stuff like RadioPacket.learn is set.
+        packet = Packet.from_frame(packet_type, data, optional)
         packet.rorg = rorg
         packet.parse_eep(rorg_func, rorg_type, direction, command)
         return packet
 
+    @staticmethod
+    def _eep_rorg(rorg, rorg_manufacturer):
+        ''' RORG used to find the profile in EEP, MSC profiles are defined per manufacturer '''
+        if rorg == RORG.MSC:
+            manufacturer = str(enocean.utils.dec2hex(rorg_manufacturer)).zfill(3)
+            rorg = str(enocean.utils.dec2hex(rorg)).zfill(2)
+            logging.debug(str(rorg+manufacturer))
+            return enocean.utils.from_hex_string(rorg+manufacturer)
+        return rorg
+
     def parse(self):
         ''' Parse data from Packet '''
         # Parse status from messages
@@ -249,7 +317,7 @@ class Packet(object):
 
         if self.rorg in [RORG.RPS, RORG.BS1, RORG.BS4]:
             # These message types should have repeater count in the last for bits of status.
-            self.repeater_count = enocean.utils.from_bitarray(self._bit_status[4:])
+            self.repeater_count = self._bit_status.get(4, 4)
         return self.parsed
 
     def select_eep(self, rorg_func, rorg_type, direction=None, command=None):
@@ -257,13 +325,7 @@ class Packet(object):
         # set EEP profile
         self.rorg_func = rorg_func
         self.rorg_type = rorg_type
-        if self.rorg == RORG.MSC:
-            manufacturer = str(enocean.utils.dec2hex(self.rorg_manufacturer)).zfill(3)
-            rorg = str(enocean.utils.dec2hex(self.rorg)).zfill(2)
-            logging.debug(str(rorg+manufacturer))
-            self._profile = self.eep.find_profile(self._bit_data, enocean.utils.from_hex_string(rorg+manufacturer), rorg_func, rorg_type, direction, command)
-        else:
-            self._profile = self.eep.find_profile(self._bit_data, self.rorg, rorg_func, rorg_type, direction, command)
+        self._profile = self.eep.find_profile(self._bit_data, Packet._eep_rorg(self.rorg, self.rorg_manufacturer), rorg_func, rorg_type, direction, command)
         return self._profile is not None
 
     def parse_eep(self, rorg_func=None, rorg_type=None, direction=None, command=None):
@@ -309,7 +371,7 @@ class RadioPacket(Packet):
 
     @property
     def sender_int(self):
-        return enocean.utils.combine_hex(self.sender)
+        return int.from_bytes(bytearray(self.sender), 'big')
 
     @property
     def sender_hex(self):
@@ -334,33 +396,37 @@ class RadioPacket(Packet):
         # parse learn CMD, if applicable
         self.cmd = None
         if self.rorg == RORG.VLD:
-            if enocean.utils.to_hex_string(self.sender).replace(':','') in globals.KNOWN_DEVICES and globals.KNOWN_DEVICES[enocean.utils.to_hex_string(self.sender).replace(':','')][0]['rorg'] == 'd2' and globals.KNOWN_DEVICES[enocean.utils.to_hex_string(self.sender).replace(':','')][0]['func'] == '05':
-                if len(self._bit_data) == 40:
-                    self.cmd =  enocean.utils.from_bitarray(self._bit_data[36:40])
-                elif len(self._bit_data) == 32:
-                    self.cmd =  enocean.utils.from_bitarray(self._bit_data[28:32])
+            bit_data = self._bit_data
+            device = globals.DEVICE_INDEX.get(self.sender_int)
+            if device is not None and device['first'] == (RORG.VLD, 0x05):
+                if len(bit_data) == 40:
+                    self.cmd = bit_data.get(36, 4)
+                elif len(bit_data) == 32:
+                    self.cmd = bit_data.get(28, 4)
                 else:
-                    self.cmd =  enocean.utils.from_bitarray(self._bit_data[4:8])
+                    self.cmd = bit_data.get(4, 4)
             else:
-                self.cmd =  enocean.utils.from_bitarray(self._bit_data[4:8])
+                self.cmd = bit_data.get(4, 4)
         if self.rorg == RORG.MSC:
-            self.rorg_manufacturer = enocean.utils.from_bitarray(enocean.utils.bitarray_sizing(self._bit_data[0:12],12))
+            bit_data = self._bit_data
+            self.rorg_manufacturer = bit_data.get(0, 12)
             if str(self.rorg_manufacturer) == "d1079" or str(self.rorg_manufacturer) == "121":
-                self.cmd = enocean.utils.from_bitarray(self._bit_data[12:16])
+                self.cmd = bit_data.get(12, 4)
             else:
-                self.cmd = enocean.utils.from_bitarray(self._bit_data[16:24])
+                self.cmd = bit_data.get(16, 8)
         # parse learn bit and FUNC/TYPE, if applicable
         if self.rorg == RORG.BS1:
             self.learn = not self._bit_data[DB0.BIT_3]
         if self.rorg == RORG.BS4:
-            self.learn = not self._bit_data[DB0.BIT_3]
+            bit_data = self._bit_data
+            self.learn = not bit_data[DB0.BIT_3]
             if self.learn:
-                self.contains_eep = self._bit_data[DB0.BIT_7]
+                self.contains_eep = bit_data[DB0.BIT_7]
                 if self.contains_eep:
                     # Get rorg_func and rorg_type from an unidirectional learn packet
-                    self.rorg_func = enocean.utils.from_bitarray(self._bit_data[DB3.BIT_7:DB3.BIT_1])
-                    self.rorg_type = enocean.utils.from_bitarray(self._bit_data[DB3.BIT_1:DB2.BIT_2])
-                    self.rorg_manufacturer = enocean.utils.from_bitarray(self._bit_data[DB2.BIT_2:DB0.BIT_7])
+                    self.rorg_func = bit_data.get(DB3.BIT_7, 6)
+                    self.rorg_type = bit_data.get(DB3.BIT_1, 7)
+                    self.rorg_manufacturer = bit_data.get(DB2.BIT_2, 11)
                     logging.debug('learn received, EEP detected, RORG: 0x%02X, FUNC: 0x%02X, TYPE: 0x%02X, Manufacturer: 0x%02X' % (self.rorg, self.rorg_func, self.rorg_type, self.rorg_manufacturer))
         return super(RadioPacket, self).parse()
 
@@ -404,11 +470,12 @@ class UTETeachIn(RadioPacket):
 
     def parse(self):
         super(UTETeachIn, self).parse()
-        self.unidirectional = not self._bit_data[DB6.BIT_7]
-        self.response_expected = not self._bit_data[DB6.BIT_6]
-        self.cmdidentifier = not self._bit_data[DB6.BIT_3]
-        self.request_type = enocean.utils.from_bitarray(self._bit_data[DB6.BIT_5:DB6.BIT_3])
-        self.rorg_manufacturer = enocean.utils.from_bitarray(self._bit_data[DB3.BIT_2:DB2.BIT_7] + self._bit_data[DB4.BIT_7:DB3.BIT_7])
+        bit_data = self._bit_data
+        self.unidirectional = not bit_data[DB6.BIT_7]
+        self.response_expected = not bit_data[DB6.BIT_6]
+        self.cmdidentifier = not bit_data[DB6.BIT_3]
+        self.request_type = bit_data.get(DB6.BIT_5, 2)
+        self.rorg_manufacturer = (bit_data.get(DB3.BIT_2, 3) << 8) | bit_data.get(DB4.BIT_7, 8)
         self.channel = self.data[2]
         self.rorg_type = self.data[5]
         self.rorg_func = self.data[6]
@@ -450,7 +517,7 @@ class UTETeachIn(RadioPacket):
             logging.info('Ute but jeedom not in learn or exclude')
             return
         logging.info('Sending response to UTE teach-in.')
-        self.__communicator.send(self._create_response_packet(self.__communicator.base_id))
+        self.__communicator.send(self._create_response_packet(self.__communicator.base_id), priority=TX_PRIORITY.RESPONSE)
 
 
 class ResponsePacket(Packet):
@@ -0,0 +1,132 @@
+# -*- encoding: utf-8 -*-
+from __future__ import print_function, unicode_literals, division, absolute_import
+import heapq
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+class Scheduler(threading.Thread):
+    '''
+    Single thread running delayed calls, from a heap ordered by due time.
+    call_spaced keeps a minimum spacing between the calls of a key (a destination),
+    in the order they were requested.
+    At most max_pending calls wait in the heap, later ones are dropped.
+    '''
+
+    def __init__(self, max_pending=1000):
+        super(Scheduler, self).__init__(name='Scheduler')
+        self.daemon = True
+        self.max_pending = max_pending
+        # [due, sequence, callback, args], callback is None once cancelled
+        self._heap = []
+        self._sequence = 0
+        # key -> time from which the next call of key can run, oldest first
+        self._next = OrderedDict()
+        self._condition = threading.Condition()
+        self._stop_flag = threading.Event()
+        # Statistics
+        self.scheduled = 0
+        self.immediate = 0
+        self.run_count = 0
+        self.cancelled = 0
+        self.dropped = 0
+
+    def stop(self):
+        self._stop_flag.set()
+        with self._condition:
+            self._condition.notify()
+
+    def call_later(self, delay, callback, *args):
+        ''' Call callback(*args) from the scheduler thread in delay seconds. Returns the entry to cancel it, None if dropped '''
+        with self._condition:
+            return self._push(time.monotonic() + delay, callback, args)
+
+    def call_spaced(self, key, spacing, callback, *args):
+        '''
+        Call callback(*args) at least spacing seconds after the previous call of key.
+        When key is free, callback is called right away from the calling thread.
+        Returns False if the call was dropped.
+        '''
+        with self._condition:
+            now = time.monotonic()
+            self._expire(now)
+            due = self._next.pop(key, now)
+            if due > now:
+                if self._push(due, callback, args) is None:
+                    self._next[key] = due
+                    return False
+                logging.debug('Delaying ' + str(round(due - now, 3)) + ' seconds for ' + str(key))
+            self._next[key] = max(due, now) + spacing
+        if due <= now:
+            self.immediate += 1
+            callback(*args)
+        return True
+
+    def cancel(self, entry):
+        ''' Cancel a call returned by call_later, returns False if it already ran '''
+        with self._condition:
+            if entry is None or entry[2] is None:
+                return False
+            entry[2] = None
+            entry[3] = None
+            self.cancelled += 1
+            return True
+
+    def _push(self, due, callback, args):
+        if len(self._heap) >= self.max_pending:
+            self.dropped += 1
+            logging.error('Too many scheduled calls, dropping ' + str(getattr(callback, '__name__', callback)))
+            return None
+        self._sequence += 1
+        entry = [due, self._sequence, callback, args]
+        heapq.heappush(self._heap, entry)
+        self.scheduled += 1
+        if self._heap[0] is entry:
+            self._condition.notify()
+        return entry
+
+    def _expire(self, now):
+        ''' Forget the keys which can be called again '''
+        while self._next:
+            key, due = next(iter(self._next.items()))
+            if due > now:
+                return
+            del self._next[key]
+
+    def run(self):
+        logging.info('Scheduler started')
+        while not self._stop_flag.is_set():
+            with self._condition:
+                while not self._stop_flag.is_set():
+                    if self._heap and self._heap[0][2] is None:
+                        heapq.heappop(self._heap)
+                        continue
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._condition.wait(timeout)
+                if self._stop_flag.is_set():
+                    break
+                entry = heapq.heappop(self._heap)
+                callback, args = entry[2], entry[3]
+                entry[2] = None
+                entry[3] = None
+            self.run_count += 1
+            try:
+                callback(*args)
+            except Exception as e:
+                logging.error('Exception in scheduled call ' + str(getattr(callback, '__name__', callback)) + ' : ' + str(e))
+        logging.info('Scheduler stopped')
+
+    def stats(self):
+        return {
+            'pending': len(self._heap),
+            'keys': len(self._next),
+            'scheduled': self.scheduled,
+            'immediate': self.immediate,
+            'run': self.run_count,
+            'cancelled': self.cancelled,
+            'dropped': self.dropped,
+        }
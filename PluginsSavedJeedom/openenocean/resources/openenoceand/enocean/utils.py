@@ -1,27 +1,50 @@
 # -*- encoding: utf-8 -*-
 from __future__ import print_function, unicode_literals, division, absolute_import
 import globals
+import os
+import stat
 import logging
 import threading
-import time
+from collections import OrderedDict
+
+def device_rorg_key(rorg):
+    ''' Integer RORG of a device profile, MSC profiles include the manufacturer (d1079 -> 0xD1079) '''
+    return int(str(rorg), 16)
+
+def register_device(id, profils):
+    ''' Add device to KNOWN_DEVICES, and to DEVICE_INDEX with integer keys '''
+    globals.KNOWN_DEVICES[id] = profils
+    try:
+        sender = int(id, 16)
+    except ValueError:
+        logging.error('Cannot index device with id ' + str(id))
+        return
+    try:
+        rorgs = {}
+        for info in profils:
+            # First profile of a RORG wins, like the scan of KNOWN_DEVICES did
+            rorgs.setdefault(device_rorg_key(info['rorg']), info)
+        first = (device_rorg_key(profils[0]['rorg']), int(str(profils[0]['func']), 16)) if profils else None
+    except (KeyError, TypeError, ValueError) as e:
+        logging.error('Cannot index device ' + str(id) + ' : ' + str(e))
+        globals.DEVICE_INDEX.pop(sender, None)
+        return
+    globals.DEVICE_INDEX[sender] = {'rorg': rorgs, 'first': first}
+
+def unregister_device(id):
+    ''' Remove device from KNOWN_DEVICES and DEVICE_INDEX '''
+    del globals.KNOWN_DEVICES[id]
+    try:
+        globals.DEVICE_INDEX.pop(int(id, 16), None)
+    except ValueError:
+        pass
 
 def sender(packet,destination):
-    if destination in globals.LAST_SENT:
-        delta = time.time()-globals.LAST_SENT[destination]
-        logging.debug('Last packet for this ' + destination + ' was emited ' + str(delta) + ' seconds ago')
-        if delta<0.5 and delta>0 and destination != 'Broadcast':
-            timer=0.5-delta
-            threading.Thread( target=threadedsender, args= (packet,timer,destination,)).start()
-            return
-    globals.COMMUNICATOR.send(packet)
-    globals.LAST_SENT[destination] = time.time()
-    return
-
-def threadedsender(packet,timer,destination):
-    logging.debug('Waiting ' + str(timer) + ' seconds ' + str(packet))
-    time.sleep(timer)
-    globals.COMMUNICATOR.send(packet)
-    globals.LAST_SENT[destination] = time.time()
+    ''' Send packet, SEND_SPACING seconds after the previous packet sent to destination '''
+    if destination == 'Broadcast':
+        globals.COMMUNICATOR.send(packet)
+        return
+    globals.SCHEDULER.call_spaced(destination, globals.SEND_SPACING, globals.COMMUNICATOR.send, packet)
 
 def get_bit(byte, bit):
     ''' Get bit value from byte '''
@@ -47,25 +70,6 @@ def from_bitarray(data):
     ''' Convert bit array back to integer '''
     return int(''.join(['1' if x else '0' for x in data]), 2)
 
-def from_bitarray_split(data):
-    ''' Convert bit array back to list of integer '''
-    chunks = [data[x:x+8] for x in xrange(0, len(data), 8)]
-    list=[]
-    for chunk in chunks:
-        list.append(int(''.join(['1' if x else '0' for x in chunk]), 2))
-    return list
-
-def bitarray_sizing(data,size):
-    ''' Add or delete first element to list of bitarray to fit size '''
-    if len(data)>size :
-        for x in range(0,len(data)-size):
-            data.pop(0)
-    if len(data)<size :
-        for x in range(0,size-len(data)):
-            data.insert(0,False)
-    return data
-
-
 def to_hex_string(data):
     ''' Convert list of integers to a hex string, separated by ":" '''
     if isinstance(data, int):
@@ -81,6 +85,83 @@ def from_hex_string(hex_string):
         return reval[0]
     return reval
 
+def private_dir(directory):
+    '''
+    Create directory (and its parents) if needed, readable by the current user only.
+    Raises OSError if it is a symbolic link, or if another user owns it or can write to it.
+    '''
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode):
+        raise OSError('Not a directory : ' + directory)
+    if hasattr(os, 'getuid'):
+        if info.st_uid != os.getuid():
+            raise OSError('Directory owned by another user : ' + directory)
+        if info.st_mode & 0o077:
+            os.chmod(directory, 0o700)
+
+def private_open(file, mode):
+    ''' Open file of a private_dir, created with mode 0600. Writing never follows an existing file '''
+    private_dir(os.path.dirname(file))
+    if 'r' in mode:
+        return open(file, mode)
+    fd = os.open(file, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+    return os.fdopen(fd, mode)
+
+class LRUCache(object):
+    '''
+    Bounded mapping, evicting the least recently used entry when full.
+    Counts hits and misses; safe to share between threads.
+    '''
+    MISSING = object()
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=MISSING):
+        ''' Cached value for key, or default (LRUCache.MISSING, as None can be cached) '''
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / total, 3) if total else 0,
+        }
+
 def profile_from_action(action):
     return action['rorg'] + '-' + action['func'] +'-' + action['type']
 
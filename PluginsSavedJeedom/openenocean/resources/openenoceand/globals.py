@@ -1,16 +1,52 @@
+import os
+
 JEEDOM_COM = ''
 DEVICE = ''
 KNOWN_DEVICES = {}
+# KNOWN_DEVICES by sender integer: {'rorg' : {RORG integer : profile}, 'first' : (RORG, FUNC) of first profile}
+DEVICE_INDEX = {}
 LEARN_MODE = False
 EXCLUDE_MODE = False
 STORAGE_MESSAGE={}
 LOG_LEVEL=''
-LAST_SENT={}
-WAITING_RES = False
+SCHEDULER = None
+# Minimum seconds between two packets sent to a destination, and delayed calls kept at most
+SEND_SPACING=0.5
+SCHEDULER_MAX_PENDING=1000
+# Seconds during which the 0790 commands of a Ventilairsec VMI are merged in one frame (0 to disable)
+VMI_COALESCE_WINDOW=0.3
+# Seconds to wait for the response of the module to a frame, writes of a frame after the first one
+TX_RESPONSE_TIMEOUT=0.5
+TX_RETRIES=2
+# Share of the time the module may transmit over DUTY_CYCLE_WINDOW seconds (0 to disable),
+# seconds a frame may wait for airtime, and seconds traffic is held back when the module refuses a frame
+DUTY_CYCLE=0.01
+DUTY_CYCLE_WINDOW=3600
+DUTY_CYCLE_MAX_WAIT=10
+DUTY_CYCLE_BACKOFF=30
 NEEDS_RESPONSE =['a5-20-01']
-STORAGE_CHAIN={}
+# Decoded telegrams kept to skip decoding identical copies (0 to disable)
+DECODE_CACHE_SIZE=512
+# Profiles always decoded, on top of NEEDS_RESPONSE
+DECODE_CACHE_BYPASS=[]
+# Chained telegrams: seconds to complete a chain, chains received at the same time
+CHAIN_TTL=10
+CHAIN_MAX=16
+# Seconds during which copies of a telegram (from repeaters) are ignored (0 to disable)
+DUPLICATE_WINDOW=0.5
 ALWAYS_UTE=[0x79]
-LAST_CHAIN_SEQ=0
+STATS_INTERVAL=300
+# Private directory (created 0700) of the caches, in the data folder of the plugin
+CACHE_DIR=os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data', 'cache')
+# Compiled EEP profiles, rebuilt when the XML files change (None to disable)
+EEP_CACHE_FILE=os.path.join(CACHE_DIR, 'eep.cache')
+# Only compile the EEP profiles in use, when they are first needed
+EEP_LAZY=False
+# Resolved data descriptions kept by EEP.find_profile
+EEP_MEMO_SIZE=256
+# Decode with generated functions, sources are kept in EEP_CODEGEN_DIR (None to disable)
+EEP_CODEGEN=False
+EEP_CODEGEN_DIR=os.path.join(CACHE_DIR, 'decoders')
 
 
 KNOWN_MSC= ['d1079-01-00']
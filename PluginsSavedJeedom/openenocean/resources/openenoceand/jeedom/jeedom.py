@@ -17,15 +17,14 @@
 import time
 import logging
 import threading
-import _thread as thread
 import requests
 import datetime
-import collections
+import collections.abc
 import serial
 import os
 from os.path import join
 import socket
-from queue import Queue
+from queue import Queue, Empty
 import socketserver
 from socketserver import (TCPServer, StreamRequestHandler)
 import signal
@@ -36,52 +35,75 @@ import globals
 # ------------------------------------------------------------------------------
 
 class jeedom_com():
-	def __init__(self,apikey = '',url = '',cycle = 0.5,retry = 3):
+	def __init__(self,apikey = '',url = '',cycle = 0.5,retry = 3,workers = 2,batch_size = 50):
 		self.apikey = apikey
 		self.url = url
 		self.cycle = cycle
 		self.retry = retry
+		# Changes are sent cycle seconds after the first one, or once there are batch_size of them
+		self.batch_size = batch_size
 		self.changes = {}
+		self.changes_condition = threading.Condition()
+		self.changes_count = 0
+		self.changes_since = None
+		self.flushes = 0
+		self.flushed_changes = 0
+		self.batch_max = 0
+		self.flush_latency_total = 0.0
+		self.flush_latency_max = 0.0
+		# Keep-alive connections to Jeedom, shared by all the requests
+		self.session = requests.Session()
+		adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers + 1)
+		self.session.mount('http://', adapter)
+		self.session.mount('https://', adapter)
+		# Immediate changes, sent by a fixed number of workers
+		self.immediate = Queue()
+		self.stats_lock = threading.Lock()
+		self.posts = 0
+		self.immediate_changes = 0
+		self.merged = 0
+		for i in range(workers):
+			worker = threading.Thread(target=self.immediate_worker, name='JeedomComWorker' + str(i))
+			worker.daemon = True
+			worker.start()
 		if cycle > 0 :
-			self.send_changes_async()
+			flusher = threading.Thread(target=self.send_changes_async, name='JeedomComFlusher')
+			flusher.daemon = True
+			flusher.start()
 		logging.debug('Init request module v%s' % (str(requests.__version__),))
 
 	def send_changes_async(self):
-		try:
-			if len(self.changes) == 0:
-				resend_changes = threading.Timer(self.cycle, self.send_changes_async)
-				resend_changes.start()
-				return
-			start_time = datetime.datetime.now()
-			changes = self.changes
-			self.changes = {}
-			logging.debug('Send to jeedom : '+str(changes))
-			i = 1
-			bad_status_code = True
-			while i <= self.retry:
-				try:
-					r = requests.post(self.url + '?apikey=' + self.apikey, json=changes, timeout=(0.5*i, 120), verify=False)
-					if r.status_code == requests.codes.ok:
-						bad_status_code = False
-						break
-				except Exception as error:
-					logging.error('Error on send request to jeedom ' + str(error)+' retry : '+str(i)+'/'+str(self.retry))
-				i = i + 1
-			if bad_status_code:
-				logging.error('Error on send request to jeedom, return code %s' % (str(r.status_code),))
-			dt = datetime.datetime.now() - start_time
-			ms = (dt.days * 24 * 60 * 60 + dt.seconds) * 1000 + dt.microseconds / 1000.0
-			timer_duration = self.cycle - ms
-			if timer_duration < 0.1:
-				timer_duration = 0.1
-			if timer_duration > self.cycle:
-				timer_duration = self.cycle
-			resend_changes = threading.Timer(timer_duration, self.send_changes_async)
-			resend_changes.start()
-		except Exception as error:
-			logging.error('Critical error on  send_changes_async %s' % (str(error),))
-			resend_changes = threading.Timer(self.cycle, self.send_changes_async)
-			resend_changes.start()
+		''' Flusher thread: sends the changes, sleeping while there are none '''
+		while True:
+			try:
+				with self.changes_condition:
+					while len(self.changes) == 0:
+						self.changes_condition.wait()
+					while self.changes_count < self.batch_size:
+						remaining = self.changes_since + self.cycle - time.time()
+						if remaining <= 0:
+							break
+						self.changes_condition.wait(remaining)
+					changes = self.changes
+					count = self.changes_count
+					since = self.changes_since
+					self.changes = {}
+					self.changes_count = 0
+					self.changes_since = None
+				logging.debug('Send to jeedom : '+str(changes))
+				r = self.post(changes)
+				if r is None or r.status_code != requests.codes.ok:
+					logging.error('Error on send request to jeedom, return code %s' % (str(r.status_code) if r is not None else 'none',))
+				latency = time.time() - since
+				with self.stats_lock:
+					self.flushes += 1
+					self.flushed_changes += count
+					self.batch_max = max(self.batch_max, count)
+					self.flush_latency_total += latency
+					self.flush_latency_max = max(self.flush_latency_max, latency)
+			except Exception as error:
+				logging.error('Critical error on  send_changes_async %s' % (str(error),))
+				time.sleep(self.cycle)
 
 	def add_changes(self,key,value):
 		if key.find('::') != -1:
@@ -96,46 +118,134 @@ class jeedom_com():
 			if self.cycle <= 0:
 				self.send_change_immediate(changes)
 			else:
-				self.merge_dict(self.changes,changes)
+				with self.changes_condition:
+					self.merge_dict(self.changes,changes)
+					self.changed()
 		else:
 			if self.cycle <= 0:
 				self.send_change_immediate({key:value})
 			else:
-				self.changes[key] = value
-
-	def send_change_immediate(self,change):
-		thread.start_new_thread( self.thread_change, (change,))
-
-	def thread_change(self,change):
-		logging.debug('Send to jeedom :  %s' % (str(change),))
+				with self.changes_condition:
+					self.changes[key] = value
+					self.changed()
+
+	def changed(self):
+		''' Wake up the flusher on the first change, and when the batch is full (changes_condition held) '''
+		if self.changes_since is None:
+			self.changes_since = time.time()
+			self.changes_condition.notify()
+		self.changes_count += 1
+		if self.changes_count == self.batch_size:
+			self.changes_condition.notify()
+
+	def post(self,change):
+		''' POST change to Jeedom, with retries. Returns the last response, None if there was none '''
+		r = None
 		i = 1
 		while i <= self.retry:
 			try:
-				r = requests.post(self.url + '?apikey=' + self.apikey, json=change, timeout=(0.5*i, 120), verify=False)
+				r = self.session.post(self.url + '?apikey=' + self.apikey, json=change, timeout=(0.5*i, 120), verify=False)
+				with self.stats_lock:
+					self.posts += 1
 				if r.status_code == requests.codes.ok:
 					break
 			except Exception as error:
 				logging.error('Error on send request to jeedom ' + str(error)+' retry : '+str(i)+'/'+str(self.retry))
 			i = i + 1
+		return r
+
+	def send_change_immediate(self,change):
+		self.immediate.put(change)
+
+	def immediate_worker(self):
+		''' Send the immediate changes, merging the device updates queued behind each other '''
+		change = None
+		while True:
+			if change is None:
+				change = self.immediate.get()
+			batch = change
+			change = None
+			count = 1
+			while True:
+				try:
+					change = self.immediate.get_nowait()
+				except Empty:
+					change = None
+					break
+				if not self.mergeable(batch) or not self.mergeable(change) or self.conflicts(batch, change):
+					# Sent by the next request, so that no value is lost
+					break
+				if count == 1:
+					batch = self.copy_dict(batch)
+				self.merge_dict(batch, change)
+				count += 1
+				change = None
+			with self.stats_lock:
+				self.immediate_changes += count
+				self.merged += count - 1
+			self.thread_change(batch)
+
+	def thread_change(self,change):
+		logging.debug('Send to jeedom :  %s' % (str(change),))
+		self.post(change)
+
+	def mergeable(self,change):
+		''' Only device updates can be merged, Jeedom stops at the first other key (learn_mode, exclude_mode...) '''
+		return isinstance(change, collections.abc.Mapping) and list(change.keys()) == ['devices']
+
+	def conflicts(self,d1,d2):
+		''' True if merging d2 in d1 would replace a value of d1 by a different one '''
+		for k,v2 in d2.items():
+			if k not in d1:
+				continue
+			v1 = d1[k]
+			if isinstance(v1, collections.abc.Mapping) and isinstance(v2, collections.abc.Mapping):
+				if self.conflicts(v1, v2):
+					return True
+			elif v1 != v2:
+				return True
+		return False
+
+	def copy_dict(self,d):
+		return dict((k, self.copy_dict(v) if isinstance(v, collections.abc.Mapping) else v) for k,v in d.items())
+
+	def stats(self):
+		with self.stats_lock:
+			return {
+				'queued': self.immediate.qsize(),
+				'changes': self.immediate_changes,
+				'merged': self.merged,
+				'posts': self.posts,
+				'flushes': self.flushes,
+				'batch_avg': round(self.flushed_changes / self.flushes, 1) if self.flushes else None,
+				'batch_max': self.batch_max,
+				'flush_latency_avg_ms': round(self.flush_latency_total * 1000 / self.flushes, 1) if self.flushes else None,
+				'flush_latency_max_ms': round(self.flush_latency_max * 1000, 1),
+			}
 
 	def set_change(self,changes):
-		self.changes = changes
+		with self.changes_condition:
+			self.changes = changes
+			self.changes_count = len(changes)
+			self.changes_since = time.time() if changes else None
+			self.changes_condition.notify()
 
 	def get_change(self):
-		return self.changes
+		with self.changes_condition:
+			return self.changes
 
 	def merge_dict(self,d1, d2):
 		for k,v2 in d2.items():
 			v1 = d1.get(k) # returns None if v1 has no value for this key
-			if ( isinstance(v1, collections.Mapping) and
-				 isinstance(v2, collections.Mapping) ):
+			if ( isinstance(v1, collections.abc.Mapping) and
+				 isinstance(v2, collections.abc.Mapping) ):
 				self.merge_dict(v1, v2)
 			else:
 				d1[k] = v2
 
 	def test(self):
 		try:
-			response = requests.get(self.url + '?apikey=' + self.apikey, verify=False)
+			response = self.session.get(self.url + '?apikey=' + self.apikey, verify=False)
 			if response.status_code != requests.codes.ok:
 				logging.error('Callback error: %s %s. Please check your network configuration page'% ( response.status_code, response.text,))
 				return False
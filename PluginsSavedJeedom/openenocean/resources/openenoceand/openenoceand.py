@@ -46,10 +46,12 @@ communicator = None
 def listen():
     jeedom_socket.open()
     logging.debug("Start listening...")
+    globals.SCHEDULER = Scheduler(globals.SCHEDULER_MAX_PENDING)
+    globals.SCHEDULER.start()
     if globals.DEVICE == 'aruba':
         globals.COMMUNICATOR = ArubaCommunicator()
     else:
-        globals.COMMUNICATOR = SerialCommunicator(port=_device)
+        globals.COMMUNICATOR = SerialCommunicator(port=_device, bulk_read=True)
     globals.COMMUNICATOR.start()
     if globals.COMMUNICATOR.base_id is None and globals.DEVICE != 'aruba':
         logging.error("No base id from enocean key, shutdown")
@@ -57,10 +59,8 @@ def listen():
 
     logging.info('The Base ID of your controler is %s.' % enocean.utils.to_hex_string(globals.COMMUNICATOR.base_id).replace(':',''))
     globals.JEEDOM_COM.send_change_immediate({'baseid' : str(enocean.utils.to_hex_string(globals.COMMUNICATOR.base_id)).replace(':','')});
-    globals.WAITING_RES = False
     packet = Packet(PACKET.COMMON_COMMAND, [0x03])
-    globals.COMMUNICATOR.send(packet)
-    globals.WAITING_RES = False
+    globals.COMMUNICATOR.send(packet, priority=TX_PRIORITY.BACKGROUND)
     try:
         threading.Thread( target=read_socket, args=('socket',)).start()
         logging.debug('Read Socket Thread Launched')
@@ -71,8 +71,31 @@ def listen():
         logging.error("KeyboardInterrupt, shutdown")
         shutdown()
 
+def log_stats():
+    if not logging.getLogger().isEnabledFor(logging.DEBUG):
+        return
+    try:
+        logging.debug('Communicator stats : ' + json.dumps(globals.COMMUNICATOR.stats()))
+        logging.debug('Scheduler stats : ' + json.dumps(globals.SCHEDULER.stats()))
+        logging.debug('Jeedom stats : ' + json.dumps(globals.JEEDOM_COM.stats()))
+        logging.debug('Bit view cache stats : ' + json.dumps(Packet.bit_cache_stats()))
+        logging.debug('EEP profile memo stats : ' + json.dumps(Packet.eep.memo.stats()))
+        logging.debug('Decode cache stats : ' + json.dumps(PacketAnalyser.DECODE_CACHE.stats()))
+        logging.debug('Dispatch stats : ' + json.dumps(PacketAnalyser.PARSERS.stats()))
+        logging.debug('Chained telegram stats : ' + json.dumps(PacketAnalyser.CHAINS.stats()))
+        logging.debug('Duplicate telegram stats : ' + json.dumps(PacketAnalyser.DUPLICATES.stats()))
+        logging.debug('VMI command coalescing stats : ' + json.dumps(PacketAnalyser.msc.coalesce_stats()))
+        if Packet.eep.generator is not None:
+            logging.debug('EEP decoder stats : ' + json.dumps(Packet.eep.generator.stats()))
+    except Exception as e:
+        logging.debug('Unable to get stats : ' + str(e))
+
 def read_communicator(name):
+    next_stats = time.time() + globals.STATS_INTERVAL
     while 1:
+        if time.time() > next_stats:
+            log_stats()
+            next_stats = time.time() + globals.STATS_INTERVAL
         try:
             if not globals.COMMUNICATOR.is_alive():
                 logging.error("Exception on communicator, communicator is dead")
@@ -100,11 +123,16 @@ def read_socket(name):
                 if message['cmd'] == 'add':
                     logging.debug('Add device : '+str(message['device']))
                     if 'id' in message['device'] and 'profils' in message['device']:
-                        globals.KNOWN_DEVICES[message['device']['id']] = message['device']['profils']
+                        enocean.utils.register_device(message['device']['id'], message['device']['profils'])
+                        if globals.EEP_LAZY:
+                            preload_profiles(message['device']['profils'])
+                        # Decoding depends on the device configuration
+                        PacketAnalyser.DECODE_CACHE.clear()
                 elif message['cmd'] == 'remove':
                     logging.debug('Remove device : '+str(message['device']))
                     if 'id' in message['device']:
-                        del globals.KNOWN_DEVICES[message['device']['id']]
+                        enocean.utils.unregister_device(message['device']['id'])
+                        PacketAnalyser.DECODE_CACHE.clear()
                 elif message['cmd'] == 'learnin':
                     logging.debug('Enter in learn mode')
                     globals.LEARN_MODE = True
@@ -144,6 +172,13 @@ def read_socket(name):
             logging.error("Exception on socket : %s" % str(e))
         time.sleep(0.02)
 
+def preload_profiles(profils):
+    for info in profils:
+        try:
+            Packet.eep.load_profile(int(info['rorg'], 16), int(info['func'], 16), int(info['type'], 16))
+        except Exception as e:
+            logging.debug('Cannot preload profile ' + str(info) + ' : ' + str(e))
+
 def handler(signum=None, frame=None):
     logging.debug("Signal %i caught, exiting..." % int(signum))
     shutdown()
@@ -186,6 +221,9 @@ parser.add_argument("--callback", help="Callback", type=str)
 parser.add_argument("--apikey", help="Apikey", type=str)
 parser.add_argument("--cycle", help="Cycle to send event", type=str)
 parser.add_argument("--pid", help="Pid file", type=str)
+parser.add_argument("--eeplazy", help="Load EEP profiles on demand", action="store_true")
+parser.add_argument("--eepcodegen", help="Decode EEP profiles with generated functions", action="store_true")
+parser.add_argument("--cachedir", help="Private directory of the caches", type=str)
 args = parser.parse_args()
 
 if args.device:
@@ -202,6 +240,14 @@ if args.pid:
     _pidfile = args.pid
 if args.cycle:
     _cycle = float(args.cycle)
+if args.eeplazy:
+    globals.EEP_LAZY = True
+if args.eepcodegen:
+    globals.EEP_CODEGEN = True
+if args.cachedir:
+    globals.CACHE_DIR = args.cachedir
+    globals.EEP_CACHE_FILE = os.path.join(args.cachedir, 'eep.cache')
+    globals.EEP_CODEGEN_DIR = os.path.join(args.cachedir, 'decoders')
 
 jeedom_utils.set_log_level(_log_level)
 globals.LOG_LEVEL = _log_level
@@ -213,6 +259,9 @@ logging.info('PID file : '+str(_pidfile))
 logging.info('Apikey : '+str(_apikey))
 logging.info('Callback : '+str(_callback))
 logging.info('Cycle : '+str(_cycle))
+logging.info('Lazy EEP loading : '+str(globals.EEP_LAZY))
+logging.info('Generated EEP decoders : '+str(globals.EEP_CODEGEN))
+logging.info('Cache directory : '+str(globals.CACHE_DIR))
 
 if _device == 'auto':
     _device = jeedom_utils.find_tty_usb('0403','6001','EnOcean')
@@ -231,8 +280,9 @@ signal.signal(signal.SIGTERM, handler)
 import enocean.utils
 from enocean.communicators.serialcommunicator import SerialCommunicator
 from enocean.communicators.arubacommunicator import ArubaCommunicator
+from enocean.scheduler import Scheduler
 from enocean.protocol.packet import RadioPacket, UTETeachIn
-from enocean.protocol.constants import PACKET, RORG
+from enocean.protocol.constants import PACKET, RORG, TX_PRIORITY
 from enocean import utils
 from enocean.protocol.packet import Packet
 from enocean import packet as PacketAnalyser
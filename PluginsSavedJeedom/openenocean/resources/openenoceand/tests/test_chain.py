@@ -0,0 +1,94 @@
+"""Tests for the reassembly of chained telegrams"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from enocean.protocol.chain import ChainReassembler
+
+SENDER = 0x0199ABCD
+FINAL = [0x01, 0x99, 0xAB, 0xCD, 0x00]
+# VLD telegram of 12 bytes, sent in 3 fragments
+TELEGRAM = [0xD2] + list(range(1, 12))
+
+
+def fragments(seq=1, telegram=TELEGRAM):
+    """Chained telegrams (RORG 0x40) carrying telegram: 5 bytes in the first one, then 5 bytes each"""
+    chunks = [telegram[:5], telegram[5:10], telegram[10:]]
+    first = [0x40, seq << 4, len(telegram) >> 8, len(telegram) & 0xFF] + chunks[0] + FINAL
+    return [first] + [[0x40, (seq << 4) | idx] + chunk + FINAL for idx, chunk in enumerate(chunks) if idx]
+
+
+class TestChainReassembler(unittest.TestCase):
+    """Test the reassembly of the fragments"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        self.chains = ChainReassembler(ttl=10, max_chains=2)
+
+    def add_all(self, parts, now=0):
+        results = [self.chains.add(SENDER, part, now=now) for part in parts]
+        return results[-1], results[:-1]
+
+    def test_in_order(self):
+        """Fragments in order give the telegram with the sender and status"""
+        result, pending = self.add_all(fragments())
+        self.assertEqual(pending, [None, None])
+        self.assertEqual(result, TELEGRAM + FINAL)
+        self.assertEqual(len(self.chains), 0)
+        self.assertEqual(self.chains.stats()['completed'], 1)
+
+    def test_out_of_order(self):
+        """Fragments are reassembled by index, whatever their order"""
+        first, second, third = fragments()
+        result, pending = self.add_all([third, first, second])
+        self.assertEqual(pending, [None, None])
+        self.assertEqual(result, TELEGRAM + FINAL)
+        result, pending = self.add_all([second, third, first])
+        self.assertEqual(result, TELEGRAM + FINAL)
+
+    def test_duplicate(self):
+        """A repeated fragment is ignored"""
+        first, second, third = fragments()
+        result, pending = self.add_all([first, second, second, third])
+        self.assertEqual(pending, [None, None, None])
+        self.assertEqual(result, TELEGRAM + FINAL)
+        self.assertEqual(self.chains.stats()['duplicates'], 1)
+
+    def test_restart(self):
+        """A different first fragment restarts the chain"""
+        other = [0xD2] + list(range(20, 31))
+        self.chains.add(SENDER, fragments()[0], now=0)
+        result, pending = self.add_all(fragments(telegram=other))
+        self.assertEqual(result, other + FINAL)
+
+    def test_interleaved_sequences(self):
+        """Chains of different sequences are kept apart"""
+        one, two = fragments(seq=1), fragments(seq=2)
+        results = [self.chains.add(SENDER, part, now=0) for pair in zip(one, two) for part in pair]
+        self.assertEqual(results[-2:], [TELEGRAM + FINAL, TELEGRAM + FINAL])
+
+    def test_expiry(self):
+        """An incomplete chain is dropped after ttl seconds"""
+        first, second, third = fragments()
+        self.chains.add(SENDER, first, now=0)
+        self.chains.add(SENDER, second, now=5)
+        self.assertIsNone(self.chains.add(SENDER, third, now=11))
+        self.assertEqual(self.chains.stats()['expired'], 1)
+        self.assertEqual(len(self.chains), 1)
+        self.assertIsNone(self.chains.add(SENDER, first, now=12))
+
+    def test_bounded(self):
+        """The oldest chain is dropped when max_chains are in flight"""
+        for seq in range(1, 5):
+            self.chains.add(SENDER, fragments(seq=seq)[0], now=0)
+        self.assertEqual(len(self.chains), 2)
+        self.assertEqual(self.chains.stats()['evicted'], 2)
+        self.assertIsNone(self.add_all(fragments(seq=1)[1:])[0])
+        self.assertEqual(self.add_all(fragments(seq=4)[1:])[0], TELEGRAM + FINAL)
+
+
+if __name__ == '__main__':
+    unittest.main()
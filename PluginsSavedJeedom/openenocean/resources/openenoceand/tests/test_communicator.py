@@ -0,0 +1,211 @@
+"""Tests for the transmission of frames by the communicator"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import globals
+from enocean.communicators.communicator import Communicator
+from enocean.communicators.dutycycle import DutyCycle
+from enocean.protocol.packet import Packet
+from enocean.protocol.constants import PACKET, RETURN_CODE, TX_PRIORITY
+
+
+class FakeCommunicator(Communicator):
+    """Communicator answering each written frame with the next return code, None for no answer"""
+
+    def __init__(self, codes=(), retries=None):
+        super(FakeCommunicator, self).__init__(retries=retries)
+        self.duty_cycle = None
+        self.codes = list(codes)
+        self.written = []
+
+    def _write_packet(self, packet):
+        self.written.append(packet)
+        code = self.codes.pop(0) if self.codes else RETURN_CODE.OK
+        if code is not None:
+            self.answer(code)
+        return True
+
+    def answer(self, code, data=()):
+        self._buffer.write(bytearray(Packet(PACKET.RESPONSE, [code] + list(data)).build()))
+        self.parse()
+
+    def start_writer(self):
+        writer = threading.Thread(target=self._transmit_loop)
+        writer.daemon = True
+        writer.start()
+
+
+def radio(value=0):
+    return Packet(PACKET.RADIO, [0xA5, value, 0, 0, 0x08, 0x01, 0x99, 0xAB, 0xCD, 0x00])
+
+
+class TestTransmission(unittest.TestCase):
+    """Test the retries and timeouts of a transmission"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        self.timeout = globals.TX_RESPONSE_TIMEOUT
+        globals.TX_RESPONSE_TIMEOUT = 0.02
+
+    def tearDown(self):
+        """Restore the response timeout"""
+        globals.TX_RESPONSE_TIMEOUT = self.timeout
+
+    def transmit(self, communicator, packet, **kwargs):
+        transmission = communicator.send(packet, **kwargs)
+        self.assertTrue(transmission.set_running_or_notify_cancel())
+        communicator._transmit(communicator._get_from_send_queue())
+        return transmission
+
+    def test_response_ok(self):
+        """A RESPONSE OK resolves the transmission after one write"""
+        communicator = FakeCommunicator()
+        transmission = self.transmit(communicator, radio())
+        self.assertEqual(transmission.result(0).response, RETURN_CODE.OK)
+        self.assertEqual(transmission.attempts, 1)
+        self.assertEqual(len(communicator.written), 1)
+
+    def test_retry_codes(self):
+        """The frame is written again on a retry code, until it is answered OK"""
+        communicator = FakeCommunicator([RETURN_CODE.ERROR, RETURN_CODE.RET_LOCK_SET, RETURN_CODE.OK], retries=2)
+        transmission = self.transmit(communicator, radio())
+        self.assertEqual(transmission.result(0).response, RETURN_CODE.OK)
+        self.assertEqual(len(communicator.written), 3)
+
+    def test_retries_exhausted(self):
+        """The last response is kept once the retries are exhausted"""
+        communicator = FakeCommunicator([RETURN_CODE.ERROR] * 5)
+        transmission = self.transmit(communicator, radio(), retries=1)
+        self.assertEqual(transmission.result(0).response, RETURN_CODE.ERROR)
+        self.assertEqual(len(communicator.written), 2)
+
+    def test_no_retry_on_other_codes(self):
+        """A code which is not worth retrying is returned at once"""
+        communicator = FakeCommunicator([RETURN_CODE.WRONG_PARAM], retries=2)
+        transmission = self.transmit(communicator, radio())
+        self.assertEqual(transmission.result(0).response, RETURN_CODE.WRONG_PARAM)
+        self.assertEqual(len(communicator.written), 1)
+
+    def test_timeout(self):
+        """Without response, the frame is written retries + 1 times and resolved with None"""
+        communicator = FakeCommunicator([None] * 5, retries=2)
+        transmission = self.transmit(communicator, radio())
+        self.assertIsNone(transmission.result(0))
+        self.assertEqual(len(communicator.written), 3)
+        self.assertEqual(communicator.stats()['transmit']['RADIO A5']['timeouts'], 3)
+
+    def test_failed_write(self):
+        """A failed write resolves the transmission with None"""
+        communicator = FakeCommunicator()
+        communicator._write_packet = lambda packet: False
+        transmission = self.transmit(communicator, radio())
+        self.assertIsNone(transmission.result(0))
+        self.assertEqual(transmission.attempts, 1)
+
+    def test_no_response_expected(self):
+        """Without WAITS_RESPONSE, the frame is resolved once written and a late RESPONSE keeps the Base ID"""
+        communicator = FakeCommunicator([None])
+        communicator.WAITS_RESPONSE = False
+        self.assertIsNone(communicator.base_id)
+        transmission = communicator._get_from_send_queue()
+        transmission.set_running_or_notify_cancel()
+        communicator._transmit(transmission)
+        self.assertIsNone(transmission.result(0))
+        self.assertEqual(communicator.stats()['transmit']['COMMON_COMMAND 08']['timeouts'], 0)
+        communicator.answer(RETURN_CODE.OK, [0xFF, 0x80, 0x00, 0x00])
+        self.assertEqual(communicator.base_id, [0xFF, 0x80, 0x00, 0x00])
+
+    def test_base_id(self):
+        """The Base ID is read from the RESPONSE to CO_RD_IDBASE"""
+        communicator = FakeCommunicator()
+        communicator._write_packet = lambda packet: communicator.answer(RETURN_CODE.OK, [0xFF, 0x80, 0x00, 0x01]) or True
+        communicator.start_writer()
+        try:
+            self.assertEqual(communicator.base_id, [0xFF, 0x80, 0x00, 0x01])
+        finally:
+            communicator.stop()
+
+
+class TestPriority(unittest.TestCase):
+    """Test the order of the transmit queue"""
+
+    def test_priority_order(self):
+        """Responses are written before interactive frames, before background frames, each in order"""
+        communicator = FakeCommunicator()
+        sent = [
+            communicator.send(radio(1), priority=TX_PRIORITY.BACKGROUND),
+            communicator.send(radio(2), priority=TX_PRIORITY.INTERACTIVE),
+            communicator.send(radio(3), priority=TX_PRIORITY.RESPONSE),
+            communicator.send(radio(4), priority=TX_PRIORITY.INTERACTIVE),
+            communicator.send(radio(5), priority=TX_PRIORITY.RESPONSE),
+        ]
+        communicator.start_writer()
+        try:
+            for transmission in sent:
+                transmission.result(5)
+        finally:
+            communicator.stop()
+        self.assertEqual([packet.data[1] for packet in communicator.written], [3, 5, 2, 4, 1])
+        stats = communicator.stats()['priority']
+        self.assertEqual(stats['RESPONSE']['sent'], 2)
+        self.assertEqual(stats['BACKGROUND']['depth'], 0)
+
+
+class TestPacing(unittest.TestCase):
+    """Test the frames held back by the duty cycle"""
+
+    def test_paced_frame_does_not_block(self):
+        """A held back frame is written later, and a response is written meanwhile"""
+        window = 0.3
+        communicator = FakeCommunicator()
+        # Budget of 2.5 telegrams: 2 interactive frames fit in the window
+        communicator.duty_cycle = DutyCycle(2.5 * DutyCycle.airtime(radio()) / window, window, max_wait=2, backoff=1)
+        sent = [communicator.send(radio(value)) for value in (1, 2, 3)]
+        start = time.time()
+        communicator.start_writer()
+        try:
+            sent[1].result(1)
+            response = communicator.send(radio(4), priority=TX_PRIORITY.RESPONSE)
+            response.result(window / 2)
+            self.assertFalse(sent[2].done())
+            self.assertEqual(sent[2].result(window + 1).response, RETURN_CODE.OK)
+            self.assertGreaterEqual(time.time() - start, window * 0.9)
+        finally:
+            communicator.stop()
+        self.assertEqual([packet.data[1] for packet in communicator.written], [1, 2, 4, 3])
+        self.assertEqual(communicator.duty_cycle.stats()['paced'], 1)
+
+    def test_no_free_buffer_held_back(self):
+        """A frame refused with RET_NO_FREE_BUFFER waits for the backoff before being written again"""
+        communicator = FakeCommunicator([RETURN_CODE.RET_NO_FREE_BUFFER])
+        communicator.duty_cycle = DutyCycle(1, 1, max_wait=2, backoff=0.2)
+        transmission = communicator.send(radio())
+        start = time.time()
+        communicator.start_writer()
+        try:
+            self.assertEqual(transmission.result(2).response, RETURN_CODE.OK)
+        finally:
+            communicator.stop()
+        self.assertGreaterEqual(time.time() - start, 0.2 * 0.9)
+        self.assertEqual(len(communicator.written), 2)
+
+    def test_refused_response_not_retried(self):
+        """A response refused by the module is not written again"""
+        communicator = FakeCommunicator([RETURN_CODE.RET_NO_FREE_BUFFER])
+        communicator.duty_cycle = DutyCycle(1, 1, max_wait=2, backoff=0.2)
+        communicator.send(radio(), priority=TX_PRIORITY.RESPONSE)
+        transmission = communicator._get_from_send_queue()
+        transmission.set_running_or_notify_cancel()
+        communicator._transmit(transmission)
+        self.assertEqual(transmission.result(0).response, RETURN_CODE.RET_NO_FREE_BUFFER)
+        self.assertEqual(len(communicator.written), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
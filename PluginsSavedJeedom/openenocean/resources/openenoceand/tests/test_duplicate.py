@@ -0,0 +1,70 @@
+"""Tests for the duplicate telegram filter"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from enocean.protocol.duplicate import DuplicateFilter
+
+SENDER = 0x0199ABCD
+# RPS rocker telegrams: data byte, sender id, status (T21 and NU, repeater count in the low nibble)
+PRESS = [0xF6, 0x30, 0x01, 0x99, 0xAB, 0xCD, 0x30]
+RELEASE = [0xF6, 0x00, 0x01, 0x99, 0xAB, 0xCD, 0x20]
+
+
+def repeated(data, count=1):
+    return data[:-1] + [data[-1] | count]
+
+
+class TestDuplicateFilter(unittest.TestCase):
+    """Test the suppression of the copies from repeaters"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        self.filter = DuplicateFilter(window=0.5, max_entries=4)
+
+    def test_double_click(self):
+        """Press, release, press, release within the window are all decoded"""
+        for now, data in enumerate((PRESS, RELEASE, PRESS, RELEASE)):
+            self.assertEqual(self.filter.check(SENDER, data, now=now * 0.1), DuplicateFilter.NEW)
+        self.assertEqual(self.filter.suppressed, 0)
+
+    def test_repeated_copy(self):
+        """A copy of the last telegram through a repeater is suppressed"""
+        self.assertEqual(self.filter.check(SENDER, PRESS, dBm=-80, now=0), DuplicateFilter.NEW)
+        self.assertEqual(self.filter.check(SENDER, repeated(PRESS), dBm=-85, now=0.05), DuplicateFilter.COPY)
+        self.assertEqual(self.filter.check(SENDER, repeated(PRESS, 2), dBm=-60, now=0.1), DuplicateFilter.BETTER_COPY)
+        self.assertEqual(self.filter.check(SENDER, repeated(PRESS), dBm=-70, now=0.15), DuplicateFilter.COPY)
+        self.assertEqual(self.filter.suppressed, 3)
+
+    def test_press_repeated_release_press(self):
+        """Copies of a press do not hide the next press after a release"""
+        self.assertEqual(self.filter.check(SENDER, PRESS, now=0), DuplicateFilter.NEW)
+        self.assertEqual(self.filter.check(SENDER, repeated(PRESS), now=0.01), DuplicateFilter.COPY)
+        self.assertEqual(self.filter.check(SENDER, RELEASE, now=0.1), DuplicateFilter.NEW)
+        self.assertEqual(self.filter.check(SENDER, PRESS, now=0.2), DuplicateFilter.NEW)
+
+    def test_window(self):
+        """The same telegram after the window is decoded again"""
+        self.assertEqual(self.filter.check(SENDER, PRESS, now=0), DuplicateFilter.NEW)
+        self.assertEqual(self.filter.check(SENDER, PRESS, now=0.6), DuplicateFilter.NEW)
+
+    def test_disabled(self):
+        """A window of 0 disables the filter"""
+        self.filter = DuplicateFilter(window=0)
+        self.assertEqual(self.filter.check(SENDER, PRESS, now=0), DuplicateFilter.NEW)
+        self.assertEqual(self.filter.check(SENDER, PRESS, now=0), DuplicateFilter.NEW)
+
+    def test_bounded(self):
+        """At most max_entries senders are remembered, expired ones are forgotten"""
+        for sender in range(10):
+            self.filter.check(sender, PRESS, now=0)
+        self.assertEqual(len(self.filter), 4)
+        self.filter.check(SENDER, PRESS, now=1)
+        self.assertEqual(len(self.filter), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Tests for the duty cycle of the transmitted telegrams"""
+
+import os
+import sys
+import unittest
+from unittest.mock import Mock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from enocean.communicators import dutycycle
+from enocean.communicators.dutycycle import DutyCycle
+from enocean.protocol.packet import Packet
+from enocean.protocol.constants import PACKET, TX_PRIORITY
+
+RADIO = Packet(PACKET.RADIO, [0xA5, 0x00, 0x00, 0x00, 0x08, 0x01, 0x99, 0xAB, 0xCD, 0x00])
+AIRTIME = DutyCycle.airtime(RADIO)
+WINDOW = 100
+MAX_WAIT = 10
+BACKOFF = 30
+
+
+class TestDutyCycle(unittest.TestCase):
+    """Test the airtime budget of each priority class"""
+
+    def setUp(self):
+        """Budget of 10.5 telegrams: 9 for interactive frames, 7 for background frames"""
+        self.now = 1000.0
+        clock = Mock()
+        clock.time.side_effect = lambda: self.now
+        patcher = patch.object(dutycycle, 'time', clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.duty_cycle = DutyCycle(10.5 * AIRTIME / WINDOW, WINDOW, MAX_WAIT, BACKOFF)
+
+    def send(self, count):
+        for i in range(count):
+            self.duty_cycle.record(RADIO)
+
+    def test_airtime(self):
+        """Only radio telegrams use airtime, 3 subtelegrams of 12 bits per byte"""
+        self.assertAlmostEqual(AIRTIME, 3 * (40 + 12 * 10) / 125000.0)
+        self.assertEqual(DutyCycle.airtime(Packet(PACKET.COMMON_COMMAND, [0x08])), 0)
+
+    def test_shares(self):
+        """Background frames get 70% of the budget, interactive frames 90%, responses all of it"""
+        self.send(6)
+        self.assertEqual(self.duty_cycle.admit(RADIO, TX_PRIORITY.BACKGROUND), 0)
+        self.send(1)
+        self.assertIsNone(self.duty_cycle.admit(RADIO, TX_PRIORITY.BACKGROUND))
+        self.assertEqual(self.duty_cycle.admit(RADIO, TX_PRIORITY.INTERACTIVE), 0)
+        self.send(2)
+        self.assertNotEqual(self.duty_cycle.admit(RADIO, TX_PRIORITY.INTERACTIVE), 0)
+        self.send(5)
+        self.assertEqual(self.duty_cycle.admit(RADIO, TX_PRIORITY.RESPONSE), 0)
+        self.assertEqual(self.duty_cycle.stats()['shed']['BACKGROUND'], 1)
+
+    def test_paced_delay(self):
+        """An interactive frame over its share waits for the oldest airtime to leave the window"""
+        self.send(1)
+        self.now += WINDOW - 5
+        self.send(8)
+        self.assertAlmostEqual(self.duty_cycle.admit(RADIO, TX_PRIORITY.INTERACTIVE), 5)
+        self.assertEqual(self.duty_cycle.stats()['paced'], 1)
+        self.now += 5
+        self.assertEqual(self.duty_cycle.admit(RADIO, TX_PRIORITY.INTERACTIVE), 0)
+
+    def test_max_wait(self):
+        """A frame is dropped when it would wait more than max_wait seconds in all"""
+        self.send(9)
+        self.assertIsNone(self.duty_cycle.admit(RADIO, TX_PRIORITY.INTERACTIVE))
+        self.now += WINDOW - 4
+        self.assertAlmostEqual(self.duty_cycle.admit(RADIO, TX_PRIORITY.INTERACTIVE), 4)
+        self.assertIsNone(self.duty_cycle.admit(RADIO, TX_PRIORITY.INTERACTIVE, waited=MAX_WAIT - 2))
+        self.assertEqual(self.duty_cycle.stats()['shed']['INTERACTIVE'], 2)
+
+    def test_window(self):
+        """Airtime older than the window is forgotten"""
+        self.send(10)
+        self.assertAlmostEqual(self.duty_cycle.stats()['used_s'], round(10 * AIRTIME, 3))
+        self.now += WINDOW
+        self.assertEqual(self.duty_cycle.admit(RADIO, TX_PRIORITY.BACKGROUND), 0)
+        self.assertEqual(self.duty_cycle.stats()['used_s'], 0)
+
+    def test_reject(self):
+        """After a refused frame, background frames are dropped and the others held back up to max_wait"""
+        self.duty_cycle.reject()
+        self.assertIsNone(self.duty_cycle.admit(RADIO, TX_PRIORITY.BACKGROUND))
+        self.assertEqual(self.duty_cycle.admit(RADIO, TX_PRIORITY.INTERACTIVE), MAX_WAIT)
+        self.assertEqual(self.duty_cycle.admit(RADIO, TX_PRIORITY.INTERACTIVE, waited=4), MAX_WAIT - 4)
+        self.assertEqual(self.duty_cycle.admit(RADIO, TX_PRIORITY.INTERACTIVE, waited=MAX_WAIT), 0)
+        self.assertEqual(self.duty_cycle.admit(RADIO, TX_PRIORITY.RESPONSE), 0)
+        self.assertTrue(self.duty_cycle.stats()['blocked'])
+        self.now += BACKOFF
+        self.assertEqual(self.duty_cycle.admit(RADIO, TX_PRIORITY.BACKGROUND), 0)
+        self.assertEqual(self.duty_cycle.stats()['rejected'], 1)
+
+    def test_not_radio(self):
+        """Frames which are not sent by radio are always admitted"""
+        self.duty_cycle.reject()
+        self.assertEqual(self.duty_cycle.admit(Packet(PACKET.COMMON_COMMAND, [0x03]), TX_PRIORITY.BACKGROUND), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Tests for the immediate changes sent to Jeedom"""
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from jeedom.jeedom import jeedom_com
+except ImportError:
+    jeedom_com = None
+
+
+@unittest.skipIf(jeedom_com is None, 'jeedom dependencies (requests, serial, pyudev) are not installed')
+class TestImmediateChanges(unittest.TestCase):
+    """Test the merge of the immediate changes"""
+
+    def send(self, *changes):
+        """Queue changes, and return the payloads posted by a single worker"""
+        com = jeedom_com(cycle=0, workers=0)
+        posted = []
+        done = threading.Event()
+
+        def post(change):
+            posted.append(change)
+            if com.immediate.empty():
+                done.set()
+
+        com.post = post
+        for change in changes:
+            com.send_change_immediate(change)
+        worker = threading.Thread(target=com.immediate_worker)
+        worker.daemon = True
+        worker.start()
+        self.assertTrue(done.wait(5))
+        return posted
+
+    def test_devices_merged(self):
+        """Updates of devices queued behind each other are sent together"""
+        posted = self.send(
+            {'devices': {'0199ABCD': {'id': '0199ABCD', 'dBm': '-70'}}},
+            {'devices': {'0199ABCE': {'id': '0199ABCE', 'dBm': '-80'}}},
+        )
+        self.assertEqual(posted, [{'devices': {
+            '0199ABCD': {'id': '0199ABCD', 'dBm': '-70'},
+            '0199ABCE': {'id': '0199ABCE', 'dBm': '-80'},
+        }}])
+
+    def test_conflicting_devices_not_merged(self):
+        """Two values of the same device are sent in order"""
+        first = {'devices': {'0199ABCD': {'id': '0199ABCD', 'dBm': '-70'}}}
+        second = {'devices': {'0199ABCD': {'id': '0199ABCD', 'dBm': '-60'}}}
+        self.assertEqual(self.send(first, second), [first, second])
+
+    def test_learn_mode_not_merged(self):
+        """learn_mode is sent alone, Jeedom stops handling the request after it"""
+        device = {'devices': {'0199ABCD': {'id': '0199ABCD', 'learn': 1}}}
+        learn = {'learn_mode': 0}
+        self.assertEqual(self.send(device, learn), [device, learn])
+
+    def test_identical_messages_not_merged(self):
+        """Identical messages are each sent"""
+        message = {'arubaMessage': {'sensor': 1}}
+        self.assertEqual(self.send(message, dict(message)), [message, message])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""Tests for the input buffer and the ESP3 frame scanner"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from enocean.communicators.communicator import Communicator
+from enocean.communicators.ringbuffer import RingBuffer
+from enocean.protocol.packet import Packet
+from enocean.protocol.constants import PACKET, PARSE_RESULT
+
+# 4BS telegram from 01:99:AB:CD, with optional data
+FRAME = bytearray(Packet(PACKET.RADIO, [0xA5, 0x01, 0x02, 0x03, 0x08, 0x01, 0x99, 0xAB, 0xCD, 0x00],
+                         [0x01, 0xFF, 0xFF, 0xFF, 0xFF, 0x40, 0x00]).build())
+
+
+class TestRingBuffer(unittest.TestCase):
+    """Test the cursors and the overflow of the input buffer"""
+
+    def test_write_consume(self):
+        """Consuming all the bytes rewinds the cursors"""
+        buffer = RingBuffer(16)
+        buffer.write(b'\x01\x02\x03')
+        self.assertEqual(len(buffer), 3)
+        buffer.consume(2)
+        self.assertEqual(len(buffer), 1)
+        buffer.consume(3)
+        self.assertEqual((buffer.read_pos, buffer.write_pos), (0, 0))
+
+    def test_compaction(self):
+        """Unread bytes are moved to the start when the tail runs out of room"""
+        buffer = RingBuffer(8)
+        buffer.write(b'\x01\x02\x03\x04\x05\x06')
+        buffer.consume(4)
+        buffer.write(b'\x07\x08\x09\x0a')
+        self.assertEqual(bytes(buffer.data[buffer.read_pos:buffer.write_pos]), b'\x05\x06\x07\x08\x09\x0a')
+        self.assertEqual(buffer.stats()['compactions'], 1)
+        self.assertEqual(buffer.stats()['dropped'], 0)
+
+    def test_overflow(self):
+        """The oldest unread bytes are dropped when full"""
+        buffer = RingBuffer(8)
+        buffer.write(b'\x01\x02\x03\x04\x05\x06')
+        buffer.write(b'\x07\x08\x09\x0a')
+        self.assertEqual(bytes(buffer.data[buffer.read_pos:buffer.write_pos]), b'\x03\x04\x05\x06\x07\x08\x09\x0a')
+        self.assertEqual(buffer.stats()['dropped'], 2)
+
+    def test_write_capacity(self):
+        """A write of at least capacity bytes keeps only its last capacity bytes"""
+        buffer = RingBuffer(8)
+        buffer.write(b'\x01\x02')
+        buffer.write(bytes(range(10)))
+        self.assertEqual(bytes(buffer.data[buffer.read_pos:buffer.write_pos]), bytes(range(2, 10)))
+        self.assertEqual(buffer.stats()['dropped'], 4)
+        buffer.write(bytes(range(20, 28)))
+        self.assertEqual(bytes(buffer.data[buffer.read_pos:buffer.write_pos]), bytes(range(20, 28)))
+        self.assertEqual(len(buffer), buffer.capacity)
+
+
+class TestScanner(unittest.TestCase):
+    """Test the parsing of the frames written to the input buffer"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        self.packets = []
+        self.communicator = Communicator(callback=self.packets.append, buffer_size=64)
+
+    def feed(self, chunk):
+        self.communicator._buffer.write(chunk)
+        return self.communicator.parse()
+
+    def test_frame(self):
+        """A whole frame is parsed, and consumed"""
+        self.feed(FRAME)
+        self.assertEqual(len(self.packets), 1)
+        self.assertEqual(self.packets[0].data, list(FRAME[6:16]))
+        self.assertEqual(len(self.communicator._buffer), 0)
+
+    def test_split_frame(self):
+        """A frame split across two writes is parsed once complete"""
+        self.assertEqual(self.feed(FRAME[:9]), PARSE_RESULT.INCOMPLETE)
+        self.assertEqual(self.packets, [])
+        self.assertEqual(len(self.communicator._buffer), 9)
+        self.feed(FRAME[9:])
+        self.assertEqual(len(self.packets), 1)
+        self.assertEqual(self.packets[0].sender, [0x01, 0x99, 0xAB, 0xCD])
+
+    def test_split_header(self):
+        """A frame split inside its header is parsed once complete"""
+        self.feed(FRAME[:3])
+        self.feed(FRAME[3:])
+        self.assertEqual(len(self.packets), 1)
+
+    def test_garbage_before_sync(self):
+        """Bytes before the sync byte are skipped"""
+        self.feed(b'\x00\x12\xff' + FRAME + b'\x01\x02')
+        self.assertEqual(len(self.packets), 1)
+        self.assertEqual(len(self.communicator._buffer), 0)
+
+    def test_header_crc_mismatch(self):
+        """A false sync byte is skipped, and the next frame is parsed"""
+        bad = bytearray(FRAME)
+        bad[5] ^= 0xFF
+        self.feed(bad[:6] + FRAME)
+        self.assertEqual(len(self.packets), 1)
+        self.assertEqual(self.packets[0].data, list(FRAME[6:16]))
+
+    def test_data_crc_mismatch(self):
+        """A frame with a bad data CRC is dropped as a whole"""
+        bad = bytearray(FRAME)
+        bad[-1] ^= 0xFF
+        self.feed(bad + FRAME)
+        self.assertEqual(len(self.packets), 1)
+        self.assertEqual(len(self.communicator._buffer), 0)
+
+    def test_scan_offsets(self):
+        """scan_msg reports the end of each frame and leaves the buffer untouched"""
+        buf = bytearray(b'\x00') + FRAME + FRAME
+        status, offset, packet = Packet.scan_msg(buf, 0)
+        self.assertEqual((status, offset), (PARSE_RESULT.OK, 1 + len(FRAME)))
+        status, offset, packet = Packet.scan_msg(buf, offset)
+        self.assertEqual((status, offset), (PARSE_RESULT.OK, len(buf)))
+        self.assertEqual(Packet.scan_msg(buf, offset), (PARSE_RESULT.INCOMPLETE, len(buf), None))
+        self.assertEqual(len(buf), 1 + 2 * len(FRAME))
+
+    def test_overflow_keeps_recent_frames(self):
+        """A write larger than the buffer keeps the frames at its end"""
+        self.feed(b'\x00' * 100 + FRAME)
+        self.assertEqual(len(self.packets), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""Tests for the scheduler of delayed calls"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from enocean.scheduler import Scheduler
+
+SPACING = 0.05
+# Margin for the scheduler thread to wake up
+SLACK = 0.5
+
+
+class TestScheduler(unittest.TestCase):
+    """Test the delayed and spaced calls"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        self.scheduler = Scheduler(max_pending=4)
+        self.scheduler.start()
+        self.calls = []
+        self.done = threading.Event()
+
+    def tearDown(self):
+        """Stop the scheduler thread"""
+        self.scheduler.stop()
+        self.scheduler.join(1)
+
+    def call(self, name, last=False):
+        self.calls.append((name, time.monotonic(), threading.current_thread()))
+        if last:
+            self.done.set()
+
+    def test_spaced_first_call_immediate(self):
+        """The first call of a key runs right away, from the calling thread"""
+        self.assertTrue(self.scheduler.call_spaced('a', SPACING, self.call, 1))
+        self.assertEqual(len(self.calls), 1)
+        self.assertIs(self.calls[0][2], threading.current_thread())
+        self.assertEqual(self.scheduler.stats()['immediate'], 1)
+
+    def test_spacing(self):
+        """Calls of a key are spaced, in the order they were requested"""
+        for name in range(3):
+            self.scheduler.call_spaced('a', SPACING, self.call, name, name == 2)
+        self.assertTrue(self.done.wait(3 * SPACING + SLACK))
+        self.assertEqual([call[0] for call in self.calls], [0, 1, 2])
+        for previous, following in zip(self.calls, self.calls[1:]):
+            self.assertGreaterEqual(following[1] - previous[1], SPACING * 0.9)
+        self.assertIs(self.calls[1][2], self.scheduler)
+
+    def test_keys_independent(self):
+        """A key is not delayed by the calls of another key"""
+        self.scheduler.call_spaced('a', SPACING, self.call, 'a1')
+        self.scheduler.call_spaced('a', SPACING, self.call, 'a2')
+        self.scheduler.call_spaced('b', SPACING, self.call, 'b1')
+        self.assertEqual([call[0] for call in self.calls], ['a1', 'b1'])
+
+    def test_spacing_expires(self):
+        """A key called again after its spacing runs right away"""
+        self.scheduler.call_spaced('a', SPACING, self.call, 1)
+        time.sleep(SPACING * 1.5)
+        self.scheduler.call_spaced('a', SPACING, self.call, 2)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.scheduler.stats()['keys'], 1)
+
+    def test_call_later(self):
+        """A delayed call runs after its delay"""
+        start = time.monotonic()
+        self.scheduler.call_later(SPACING, self.call, 1, True)
+        self.assertTrue(self.done.wait(SPACING + SLACK))
+        self.assertGreaterEqual(self.calls[0][1] - start, SPACING * 0.9)
+
+    def test_cancel(self):
+        """A cancelled call does not run"""
+        entry = self.scheduler.call_later(SPACING, self.call, 'cancelled')
+        self.scheduler.call_later(SPACING * 2, self.call, 'kept', True)
+        self.assertTrue(self.scheduler.cancel(entry))
+        self.assertFalse(self.scheduler.cancel(entry))
+        self.assertFalse(self.scheduler.cancel(None))
+        self.assertTrue(self.done.wait(2 * SPACING + SLACK))
+        self.assertEqual([call[0] for call in self.calls], ['kept'])
+
+    def test_max_pending(self):
+        """Calls above max_pending are dropped"""
+        entries = [self.scheduler.call_later(10, self.call, name) for name in range(5)]
+        self.assertIsNone(entries[-1])
+        self.assertEqual(self.scheduler.stats()['dropped'], 1)
+        self.scheduler.call_spaced('a', 10, self.call, 'first')
+        self.assertFalse(self.scheduler.call_spaced('a', 10, self.call, 'dropped'))
+
+    def test_exception(self):
+        """An exception in a call does not stop the scheduler"""
+        self.scheduler.call_later(0, lambda: 1 / 0)
+        self.scheduler.call_later(SPACING, self.call, 1, True)
+        self.assertTrue(self.done.wait(SPACING + SLACK))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,5 @@
 #!/bin/bash
-# Test script for Purevent2HA addon
+# Test script for Purevent2HA addon and the OpenEnOcean daemon
 
 set -e
 
@@ -11,4 +11,12 @@ pip install pytest pytest-cov pytest-asyncio aiohttp
 # Run tests
 pytest purevent2ha/tests/ -v --cov=purevent2ha/rootfs/app --cov=purevent2ha/custom_components
 
+echo "Running tests for the OpenEnOcean daemon..."
+
+# Install the daemon dependencies (plugin_info/packages.json)
+pip install requests pyudev pyserial beautifulsoup4
+
+# Run tests
+pytest PluginsSavedJeedom/openenocean/resources/openenoceand/tests/ -v
+
 echo "Tests complete!"